@@ -0,0 +1,380 @@
+from datetime import date, datetime
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user
+
+from extensions import db
+from models import User, Appointment
+import bitmap
+import booking
+import free_slots
+import queries
+import search
+import slots
+from availability import check_hours, save_days, save_weekly
+from cache import cache, user_tag
+
+# JSON api for kiosks and call-center tools, mounted at /api/v1 by create_app().
+#
+# same session login as the html pages: POST the /login form once and send the
+# cookie back. bodies must be application/json, which a cross-site html form can't
+# send, so the cookie alone is no csrf hole.
+#
+#   GET  /api/v1/availability?doctor_id=3,7,9&start=&days=   open slots, many doctors
+#   GET  /api/v1/availability/common?doctor_id=3,7,9&start=&days=
+#                                     slots free for all of them and utilization per day
+#                                     (staff only, bitmap.py)
+#   GET  /api/v1/next_available?department_id=&q=&from=&to=&limit=
+#                                     earliest open slots across doctors (free_slots.py)
+#   GET  /api/v1/appointments?status=&from=&to=              the caller's appointments
+#   POST /api/v1/appointments/batch   {"items": [{doctor_id, date, time, patient_id}], "atomic": false}
+#   POST /api/v1/appointments/cancel  {"ids": [...], "atomic": false}
+#   PUT  /api/v1/availability         {"days": [{date, start_time, end_time, is_available}]}
+#   PUT  /api/v1/availability/weekly  {"weekdays": [{weekday, start_time, end_time, is_available}]}
+#
+# "days" override single dates (leave, extra hours); "weekdays" are the usual hours
+# that repeat every week, 0 = Monday. see availability.py.
+#
+# batches run in one BEGIN IMMEDIATE transaction. every item gets a result; a
+# failed item only undoes itself (savepoint, see booking.add_booking) unless
+# "atomic" is true, then any failure rolls back the lot and the answer is 409.
+# GETs carry an ETag and answer If-None-Match with 304.
+
+DEFAULT_MAX_BATCH = 100
+DEFAULT_LIST_LIMIT = 200
+MAX_COMMON_DAYS = 366
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def error(message, status):
+    return jsonify(error=message), status
+
+
+def max_batch():
+    return current_app.config.get('API_MAX_BATCH', DEFAULT_MAX_BATCH)
+
+
+def conditional(data):
+    response = jsonify(data)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def parse_ids(value):
+    return [int(part) for part in value.split(',') if part.strip()] if value else []
+
+
+def parse_clock(value):
+    # 'HH:MM' like the forms, seconds tolerated
+    return datetime.strptime(value[:5], '%H:%M').time() if value else None
+
+
+def parse_flag(data, key, default):
+    """data[key] as a JSON boolean. "false" or 0 is an error, not a false."""
+    value = data.get(key, default)
+    if not isinstance(value, bool):
+        raise ValueError(f"{key} must be true or false, got {value!r}")
+    return value
+
+
+def appointment_json(appt):
+    return {
+        'id': appt.id,
+        'status': appt.status,
+        'date': appt.date.isoformat(),
+        'time': appt.time.strftime('%H:%M'),
+        'doctor': {'id': appt.doctor_id, 'name': appt.doctor.name,
+                   'department': appt.doctor.department.name if appt.doctor.department else None},
+        'patient': {'id': appt.patient_id, 'name': appt.patient.name},
+    }
+
+
+def json_body(key):
+    """(items, atomic) from the request body, or an error response."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(key), list):
+        return None, error(f"expected a JSON object with a {key!r} list", 400)
+    if len(data[key]) > max_batch():
+        return None, error(f"at most {max_batch()} {key} per request", 400)
+    try:
+        atomic = parse_flag(data, 'atomic', False)
+    except ValueError as e:
+        return None, error(str(e), 400)
+    return (data[key], atomic), None
+
+
+def finish_batch(results, atomic, tags):
+    """Commit (or roll back when atomic and something failed) and answer with the results."""
+    failed = any(not result['ok'] for result in results)
+    if atomic and failed:
+        db.session.rollback()
+        for result in results:
+            if result['ok']:
+                result.pop('id', None)
+                result.update(ok=False, error="rolled back, another item in the batch failed")
+        return jsonify(committed=False, results=results), 409
+    db.session.commit()
+    cache.invalidate(*tags)
+    return jsonify(committed=True, results=results)
+
+
+@api.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return error("login required", 401)
+    if request.method in ('POST', 'PUT') and not request.is_json:
+        return error("send application/json", 415)
+
+
+@api.route("/availability")
+def availability():
+    """Open slots for every doctor in ?doctor_id=1,2,3 over the booking horizon."""
+    try:
+        doctor_ids = parse_ids(request.args.get('doctor_id', ''))
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else date.today()
+        days = min(int(request.args.get('days', slots.horizon_days())), slots.horizon_days())
+    except ValueError:
+        return error("doctor_id must be comma separated ids, start YYYY-MM-DD, days a number", 400)
+    if not doctor_ids or len(doctor_ids) > max_batch():
+        return error(f"give between 1 and {max_batch()} doctor ids", 400)
+    if days < 1:
+        return error("days must be at least 1", 400)
+
+    active = set(db.session.scalars(db.select(User.id).where(
+        User.id.in_(doctor_ids), User.role == 'doctor', User.active.is_(True))))
+    found = slots.available_slots_many(sorted(active), start, days,
+                                       patient_id=current_user.id if current_user.role == 'patient' else None)
+    return conditional({
+        'start': start.isoformat(),
+        'days': days,
+        'doctors': {str(doctor_id): [{'date': day['date_str'], 'slots': day['slots']} for day in found[doctor_id]]
+                    for doctor_id in sorted(active)},
+        'unknown': [doctor_id for doctor_id in doctor_ids if doctor_id not in active],
+    })
+
+
+@api.route("/availability/common")
+def common_availability():
+    """Per day, the slots every doctor in ?doctor_id=1,2,3 has free and how booked they are together."""
+    if current_user.role not in ('admin', 'doctor'):
+        return error("staff only", 403)
+    try:
+        doctor_ids = parse_ids(request.args.get('doctor_id', ''))
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else date.today()
+        days = min(int(request.args.get('days', slots.horizon_days())), MAX_COMMON_DAYS)
+    except ValueError:
+        return error("doctor_id must be comma separated ids, start YYYY-MM-DD, days a number", 400)
+    if not doctor_ids or len(doctor_ids) > max_batch():
+        return error(f"give between 1 and {max_batch()} doctor ids", 400)
+    if days < 1:
+        return error("days must be at least 1", 400)
+
+    active = sorted(set(db.session.scalars(db.select(User.id).where(
+        User.id.in_(doctor_ids), User.role == 'doctor', User.active.is_(True)))))
+    bm = bitmap.load(active, start, days)
+    common, utilization = bm.common_free(active), bm.utilization()
+    return conditional({
+        'start': start.isoformat(),
+        'days': [{'date': day.isoformat(), 'slots': [t.strftime('%H:%M') for t in common[day]],
+                  'utilization': round(utilization[day], 4)} for day in bm.dates],
+        'unknown': [doctor_id for doctor_id in doctor_ids if doctor_id not in active],
+    })
+
+
+@api.route("/next_available")
+def next_available():
+    """The earliest open slots across a department's doctors, or those matching ?q=, within ?from=&to= (HH:MM)."""
+    try:
+        department_id = int(request.args['department_id']) if request.args.get('department_id') else None
+        start_time, end_time = parse_clock(request.args.get('from')), parse_clock(request.args.get('to'))
+        limit = min(int(request.args.get('limit', free_slots.DEFAULT_LIMIT)), free_slots.MAX_LIMIT)
+    except ValueError:
+        return error("department_id and limit must be numbers, from and to HH:MM", 400)
+    term = request.args.get('q', '').strip()
+    if department_id is None and not term:
+        return error("give a department_id or a search term q", 400)
+    if limit < 1:
+        return error("limit must be at least 1", 400)
+
+    doctor_ids = None
+    if term:
+        doctor_ids = [doctor.id for doctor in search.search_users(term, 'doctor', fields=('name', 'department'),
+                                                                   active_only=True)]
+    # ensure() may write on a connection of its own, end our read first (see views.next_available)
+    db.session.commit()
+    free_slots.ensure(db.engine)
+    found = free_slots.earliest(db.engine, doctor_ids, department_id, start_time, end_time, limit,
+                                patient_id=current_user.id if current_user.role == 'patient' else None)
+    return conditional({
+        'slots': [{'doctor_id': slot['doctor_id'], 'doctor': slot['doctor'], 'department': slot['department'],
+                   'date': slot['date'].isoformat(), 'time': slot['time']} for slot in found],
+    })
+
+
+@api.route("/availability", methods=["PUT"])
+def update_availability():
+    """Set the caller's (a doctor's) working hours for several days at once."""
+    if current_user.role != 'doctor':
+        return error("only doctors have availability", 403)
+    body, failure = json_body('days')
+    if failure:
+        return failure
+    items, atomic = body
+
+    parsed, results = [], []
+    for item in items:
+        try:
+            day = date.fromisoformat(item['date'])
+            is_available = parse_flag(item, 'is_available', True)
+            start_time, end_time = parse_clock(item.get('start_time')), parse_clock(item.get('end_time'))
+            if day < date.today():
+                raise ValueError("date is in the past")
+            check_hours(start_time, end_time, is_available)
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({'ok': False, 'error': f"invalid day: {e}"})
+            continue
+        parsed.append((day, start_time, end_time, is_available))
+        results.append({'ok': True, 'date': day.isoformat()})
+
+    # single dates, exceptions to the weekly hours (see availability.py)
+    save_days(current_user.id, parsed)
+    return finish_batch(results, atomic, [user_tag(current_user.id)])
+
+
+@api.route("/availability/weekly", methods=["PUT"])
+def update_weekly_availability():
+    """Set the caller's (a doctor's) usual hours per weekday, 0 = Monday."""
+    if current_user.role != 'doctor':
+        return error("only doctors have availability", 403)
+    body, failure = json_body('weekdays')
+    if failure:
+        return failure
+    items, atomic = body
+
+    parsed, results = [], []
+    for item in items:
+        try:
+            weekday = int(item['weekday'])
+            is_available = parse_flag(item, 'is_available', True)
+            start_time, end_time = parse_clock(item.get('start_time')), parse_clock(item.get('end_time'))
+            if not 0 <= weekday <= 6:
+                raise ValueError("weekday is 0 (Monday) to 6 (Sunday)")
+            check_hours(start_time, end_time, is_available)
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({'ok': False, 'error': f"invalid weekday: {e}"})
+            continue
+        parsed.append((weekday, start_time, end_time, is_available))
+        results.append({'ok': True, 'weekday': weekday})
+
+    save_weekly(current_user.id, parsed)
+    return finish_batch(results, atomic, [user_tag(current_user.id)])
+
+
+@api.route("/appointments")
+def appointments():
+    """The caller's appointments (admins filter by ?patient_id= or ?doctor_id=)."""
+    try:
+        status = request.args.get('status')
+        start = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+        limit = min(int(request.args.get('limit', DEFAULT_LIST_LIMIT)), 1000)
+        patient_id = int(request.args['patient_id']) if request.args.get('patient_id') else None
+        doctor_id = int(request.args['doctor_id']) if request.args.get('doctor_id') else None
+    except ValueError:
+        return error("from/to must be YYYY-MM-DD, limit/patient_id/doctor_id numbers", 400)
+
+    query = queries.appointments_query()
+    if current_user.role == 'patient':
+        query = query.filter(Appointment.patient_id == current_user.id)
+    elif current_user.role == 'doctor':
+        query = query.filter(Appointment.doctor_id == current_user.id)
+    elif patient_id is None and doctor_id is None:
+        return error("give patient_id or doctor_id", 400)
+    if patient_id is not None:
+        query = query.filter(Appointment.patient_id == patient_id)
+    if doctor_id is not None:
+        query = query.filter(Appointment.doctor_id == doctor_id)
+    if status:
+        query = query.filter(Appointment.status == status)
+    if start:
+        query = query.filter(Appointment.date >= start)
+    if end:
+        query = query.filter(Appointment.date <= end)
+    rows = query.order_by(Appointment.date, Appointment.time).limit(limit).all()
+    return conditional({'appointments': [appointment_json(appt) for appt in rows]})
+
+
+@api.route("/appointments/batch", methods=["POST"])
+def book_batch():
+    """Book several slots in one transaction. Patients book for themselves, admins for anyone."""
+    if current_user.role not in ('patient', 'admin'):
+        return error("only patients and admins can book", 403)
+    body, failure = json_body('items')
+    if failure:
+        return failure
+    items, atomic = body
+
+    # the whole batch under the write lock, see booking.write_transaction
+    booking.write_transaction(db.session)
+    if current_user.role == 'admin':
+        wanted = {item.get('patient_id') for item in items if isinstance(item, dict)}
+        patients = set(db.session.scalars(db.select(User.id).where(
+            User.id.in_([p for p in wanted if isinstance(p, int)]), User.role == 'patient', User.active.is_(True))))
+
+    results, tags = [], set()
+    for item in items:
+        try:
+            doctor_id = int(item['doctor_id'])
+            day = date.fromisoformat(item['date'])
+            time = parse_clock(item['time'])
+            patient_id = current_user.id if current_user.role == 'patient' else item['patient_id']
+        except (KeyError, TypeError, ValueError):
+            results.append({'ok': False, 'error': "needs doctor_id, date (YYYY-MM-DD), time (HH:MM)"
+                                                  + (" and patient_id" if current_user.role == 'admin' else "")})
+            continue
+        if current_user.role == 'admin' and patient_id not in patients:
+            results.append({'ok': False, 'error': "unknown patient"})
+            continue
+        try:
+            appt = booking.add_booking(patient_id, doctor_id, day, time)
+        except booking.BookingError as e:
+            results.append({'ok': False, 'error': str(e)})
+            continue
+        results.append({'ok': True, 'id': appt.id, 'doctor_id': doctor_id, 'patient_id': patient_id,
+                        'date': day.isoformat(), 'time': time.strftime('%H:%M')})
+        tags.update((user_tag(patient_id), user_tag(doctor_id)))
+    return finish_batch(results, atomic, tags)
+
+
+@api.route("/appointments/cancel", methods=["POST"])
+def cancel_batch():
+    """Cancel several Booked appointments of the caller (any, for admins) in one transaction."""
+    body, failure = json_body('ids')
+    if failure:
+        return failure
+    ids, atomic = body
+    if not all(isinstance(appt_id, int) for appt_id in ids):
+        return error("ids must be numbers", 400)
+
+    booking.write_transaction(db.session)
+    query = Appointment.query.filter(Appointment.id.in_(ids))
+    if current_user.role == 'patient':
+        query = query.filter(Appointment.patient_id == current_user.id)
+    elif current_user.role == 'doctor':
+        query = query.filter(Appointment.doctor_id == current_user.id)
+    found = {appt.id: appt for appt in query}
+
+    results, tags = [], set()
+    for appt_id in ids:
+        appt = found.get(appt_id)
+        if appt is None:
+            results.append({'ok': False, 'id': appt_id, 'error': "not found"})
+        elif appt.status != "Booked":
+            results.append({'ok': False, 'id': appt_id, 'error': f"already {appt.status.lower()}"})
+        else:
+            appt.status = "Cancelled"
+            results.append({'ok': True, 'id': appt_id})
+            tags.update((user_tag(appt.patient_id), user_tag(appt.doctor_id)))
+    return finish_batch(results, atomic, tags)
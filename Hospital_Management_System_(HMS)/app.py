@@ -1,859 +1,417 @@
-from sqlalchemy.exc import IntegrityError
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask import render_template, request, redirect, url_for, flash
-from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from sqlalchemy import or_, cast, String
-
-#30 mins ko antaral ma time slot banaune
-def generate_time_slots(start_str, end_str, interval_minutes = 30):
-    slots=[]
+import click
+from flask import Flask, current_app
+from flask.cli import with_appcontext
+
+# importing this module does no work: no database access and none of the app's own
+# modules until create_app() runs. the schema and the default admin are set up by
+#
+#   flask --app app init-db      apply pending migrations (migrations.py)
+#   flask --app app seed-admin   create the admin account if there isn't one
+#
+# gunicorn: gunicorn 'app:create_app()'
+
+
+def create_app(config=None):
+    """Build the Flask app. `config` overrides the defaults and the environment."""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'a-very-secret-and-random-string'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config:
+        app.config.update(config)
+
+    import cache
+    import database
+    import identity
+    import instrumentation
+    import passwords
+    from extensions import db, login_manager
+    from views import bp
+    from api import api
+
+    # everything below keeps its state on this app (app.extensions), so a second
+    # create_app() in the same process leaves this one alone
+    database.configure(app)  #DATABASE_URL / HMS_DB_PROFILE from the environment, see database.py
+    db.init_app(app)
+    login_manager.init_app(app)
+    passwords.init_app(app)  #PASSWORD_HASH_METHOD, LOGIN_* limits etc, see passwords.py
+    cache.init_app(app)  #CACHE_BACKEND: memory (default), sqlite or none, see cache.py
+    identity.init_app(app)  #IDENTITY_CACHE_BACKEND: sqlite (default, shared by workers), memory or none, see identity.py
+    instrumentation.init_app(app)  #Server-Timing headers and /metrics, see instrumentation.py
+    with app.app_context():
+        database.init_engine(app, db.engine)  #sqlite PRAGMAs on every new connection
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api)  #/api/v1, see api.py
+    for command in COMMANDS:
+        app.cli.add_command(command)
+    return app
+
+
+def ensure_admin(email='admin@hms.gmail.com', password='admin123', name='admin'):
+    """Create the admin account unless one exists. Returns True if it was created."""
+    from datetime import datetime
+    from sqlalchemy.exc import IntegrityError
+    from extensions import db
+    from models import User
+    from passwords import hasher
+
+    if User.query.filter_by(role='admin').first():
+        return False
+    db.session.add(User(name=name, email=email, password=hasher.hash(password),
+                        role='admin', created_at=datetime.utcnow()))
     try:
-        start_time = datetime.strptime(start_str, '%H:%M').time()
-        end_time =  datetime.strptime(end_str, '%H:%M').time()
-
-        current_time = datetime.combine(date.today(), start_time)
-        end_dt = datetime.combine(date.today(), end_time)
-
-        while current_time< end_dt:
-            slots.append(current_time.strftime('%H:%M'))
-            current_time+=timedelta(minutes=interval_minutes)
-    except Exception as e:
-        print(f"Error occured while generating time slots: {e}")
-        return ["09:00", "09:30", "10:00", "10:30", "11:00", "11:30", "12:00", "12:30", "14:00", "14:30", "15:00", "15:30", "16:00", "16:30"]
-    
-    return slots
-
-# create app first
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'a-very-secret-and-random-string'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///hospital.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'  
-login_manager.login_message_category = 'danger' 
-
-#use hunu agadi import garne
-from extensions import db
-from models import User, Department, Appointment, Treatment, DoctorAvailability
-
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
-
-
-
-db.init_app(app)
-
-with app.app_context():
-    db.create_all()  #creates tables if they don't exist
-
-    #checking if admin already exists
-    admin_exists = User.query.filter_by(role='admin').first()
-    if not admin_exists:
-        admin_user = User(
-            name='admin',
-            email='admin@hms.gmail.com',
-            password=generate_password_hash('admin123'),  #generating hashed password
-            role='admin',
-            created_at=datetime.utcnow()
-        )
-        db.session.add(admin_user)
         db.session.commit()
-        print("default admin user created with email: admin@hms.gmail.com and password: admin123")
+    except IntegrityError:
+        # another process seeded it first
+        db.session.rollback()
+        return False
+    return True
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db():
+    """Create/upgrade the tables (see migrations.py)."""
+    import migrations
+    from extensions import db
+    applied = migrations.upgrade(db.engine)
+    print(f"applied migrations {applied}" if applied else "database is up to date")
+
+
+@click.command("seed-admin")
+@click.option("--email", default="admin@hms.gmail.com")
+@click.option("--password", default="admin123")
+@with_appcontext
+def seed_admin(email, password):
+    """Create the default admin account if there is no admin yet."""
+    if ensure_admin(email, password):
+        print(f"default admin user created with email: {email}")
     else:
         print("admin user already exists")
 
 
-
-
-@app.route("/")
-def index():
-    # redirect root to the registration page to avoid 404 when visiting '/'
-    return redirect(url_for('register'))
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    if current_user.is_authenticated:
-        if current_user.role == "admin":
-            return redirect(url_for("admin_dashboard"))
-        if current_user.role == "doctor":
-            return redirect(url_for("doctor_dashboard"))
-        if current_user.role == "patient":
-            return redirect(url_for("patient_dashboard"))
-
-    if request.method == "POST":
-        email = request.form.get("email", "").strip().lower()
-        password = request.form.get("password", "")
-
-        if not email or not password:
-            flash("Email and password are required.", "danger")
-            return render_template("login.html")
-
-        user = User.query.filter_by(email=email).first()
-
-        if not user or not user.is_active:
-            flash("Invalid email or password. Please try again.", "danger")
-            return render_template("login.html")
-
-
-        if not check_password_hash(user.password, password):
-            flash("Invalid email or password. Please try again.", "danger")
-            return render_template("login.html")
-
-        login_user(user)
-        flash("Logged in successfully!", "success")
-
-        if user.role == "admin":
-            return redirect(url_for("admin_dashboard"))
-        elif user.role == "doctor":
-            return redirect(url_for("doctor_dashboard"))
-        else:
-            return redirect(url_for("patient_dashboard"))
-
-    return render_template("login.html")
-
-
-@app.route("/logout")
-@login_required
-def logout():
-    logout_user()
-    flash("You have been logged out.", "success")
-    return redirect(url_for("login"))
-
-@app.route("/register", methods=["GET", "POST"])
-def register():
-    #login vaisakeko huda redirect by role
-    if current_user.is_authenticated:
-        if current_user.role == "admin":
-            return redirect(url_for("admin_dashboard"))
-        if current_user.role == "doctor":
-            return redirect(url_for("doctor_dashboard"))
-        if current_user.role == "patient":
-            return redirect(url_for("patient_dashboard"))
-        
-    if request.method == "POST":
-        name = request.form.get("name", "").strip()
-        email = request.form.get("email", "").strip().lower()
-        password = request.form.get("password", "")
-        confirm = request.form.get("confirm_password", "")
-        age_raw = request.form.get("age", "").strip()
-        gender = request.form.get("gender", "").strip() or None
-        contact_number = request.form.get("contact_number", "").strip() or None
-        address = request.form.get("address", "").strip() or None
-
-        age = None
-
-        #server tira bata validate garne
-        if not name or not email or not password or not confirm:
-            flash("Please fill all the required fields.", "danger")
-            return render_template("register.html")
-        
-        if len(password) < 6:
-            flash("Password must be atleast 6 characters long.", "danger")
-            return render_template("register.html")
-        
-        if password != confirm:
-            flash("Passwords do not match.", "danger")
-            return render_template("register.html")
-        
-        age = None
-        if age_raw:
-            try:
-                age_val = int(age_raw)
-                if age_val>0:
-                    age = age_val
-                else:
-                    flash("Age must be a positive number.", "danger")
-                    return render_template("register.html")
-            except ValueError:
-                flash("Please enter a valid age!","danger")
-                return render_template("register.html")
-
-        
-        #email ko uniqueness check garna lai
-        existing = User.query.filter_by(email=email).first()
-        if existing:
-            flash("An account already exists with that email, try logging in.", "danger")
-            return render_template("register.html")
-        
-        #ps hash gari patient user banaune
-        try:
-            hashed = generate_password_hash(password)
-            user = User(
-                name=name,
-                email=email,
-                password=hashed,
-                role="patient",
-                age=age,
-                gender=gender,
-                contact_number=contact_number,
-                address=address,
-                active=True
-            )
-            db.session.add(user)
-            db.session.commit()
-            flash("Registration successful. Now you can login.", "success")
-            return redirect(url_for("login"))   
-        
-        except IntegrityError:
-            db.session.rollback()
-            flash("An account already exists with that email, try logging in.", "danger")
-            return render_template("register.html")
-        
-        except Exception as e:
-            db.session.rollback()
-            flash("Unexpected error occured while creating your account, Please try again.", "danger")
-            return render_template("register.html")
-        
-    #GET mas
-    return render_template("register.html")
-
-
-@app.route("/dashboard/admin")
-@login_required
-def admin_dashboard():
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
-    doctor_search = request.args.get("doctor_search", "").strip()
-    patient_search = request.args.get("patient_search", "").strip()
-
-    patient_count = User.query.filter(User.role == 'patient', User.active == True).count()
-    doctor_count = User.query.filter(User.role == 'doctor', User.active == True).count()
-    appointment_count = Appointment.query.count()
-
-    all_patients_query = User.query.filter_by(role='patient')
-    all_doctors_query = User.query.filter_by(role='doctor')
-
-    if patient_search:
-        search_term = f"%{patient_search}%"
-        all_patients_query = all_patients_query.filter(
-            or_(
-                User.name.ilike(search_term),
-                User.email.ilike(search_term),
-                User.contact_number.ilike(search_term),
-                cast(User.id, String).ilike(search_term)
-            )
-        )
-    
-    if doctor_search:
-        search_term = f"%{doctor_search}%"
-        all_doctors_query = all_doctors_query.join(Department, Department.id == User.specialization_id).filter(
-            or_(
-                User.name.ilike(search_term),
-                User.email.ilike(search_term),
-                Department.name.ilike(search_term) 
-            )
-        )
-
-    all_patients = all_patients_query.order_by(User.name).all()
-    all_doctors = all_doctors_query.order_by(User.name).all()
-    
-    # get departments
-    departments = Department.query.all()
-    
-    # sort(newest first)
-    all_appointments = Appointment.query.order_by(Appointment.created_at.desc()).all()
-    
-    return render_template("admin_dashboard.html", 
-                           departments=departments,
-                           patient_count=patient_count,
-                           doctor_count=doctor_count,
-                           appointment_count=appointment_count,
-                           all_patients=all_patients,
-                           all_doctors=all_doctors,
-                           doctor_search=doctor_search,
-                           patient_search=patient_search,
-                           all_appointments=all_appointments
-                           )
-
-
-@app.route("/admin/edit_doctor/<int:user_id>", methods=["GET"])
-@login_required
-def edit_doctor_form(user_id):
-    """Show the form to edit a doctor's profile."""
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-        
-    doctor = User.query.filter_by(id=user_id, role='doctor').first_or_404()
-    departments = Department.query.all()
-    
-    return render_template("edit_doctor.html", doctor=doctor, departments=departments)
-
-
-@app.route("/admin/edit_doctor/<int:user_id>", methods=["POST"])
-@login_required
-def edit_doctor_submit(user_id):
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    doctor = User.query.filter_by(id=user_id, role='doctor').first_or_404()
-    
-    name = request.form.get("name", "").strip()
-    email = request.form.get("email", "").strip().lower()
-    specialization_id = request.form.get("specialization_id")
-
-    if not name or not email or not specialization_id:
-        flash("Name, Email, and Department are required.", "danger")
-        return redirect(url_for('edit_doctor_form', user_id=user_id))
-
-    # check if agadi dekhi vako email ma change hudaixa ki vanera
-    if email != doctor.email and User.query.filter_by(email=email).first():
-        flash("That email is already in use by another account.", "danger")
-        return redirect(url_for('edit_doctor_form', user_id=user_id))
-    
-    try:
-        doctor.name = name
-        doctor.email = email
-        doctor.specialization_id = int(specialization_id)
-        db.session.commit()
-        flash(f"Doctor {doctor.name}'s profile has been updated.", "success")
-        return redirect(url_for('admin_dashboard'))
-        
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred while updating: {e}", "danger")
-        return redirect(url_for('edit_doctor_form', user_id=user_id))
-
-@app.route("/admin/toggle_active/<int:user_id>", methods = ["POST"])
-@login_required
-def toggle_active(user_id):
-    if current_user.role!='admin':
-        flash("Access Unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    user = User.query.get_or_404(user_id)
-
-    if user.id == current_user.id:
-        flash("You cannot deactivate your own account.", "danger")
-        return redirect(url_for('login'))
-    
-    user.is_active = not user.is_active
-    db.session.commit()
-
-    if user.is_active:
-        flash(f"User {user.name} has been activated.", "success")
-    else:
-        flash(f"User {user.name} has been deactivated/blacklisted.", "success")
-    return redirect(url_for('admin_dashboard'))
-
-@app.route("/admin/add_department", methods=["POST"])
-@login_required
-def add_department():
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
-    if request.method == "POST":
-        name = request.form.get("name", "").strip()
-        description = request.form.get("description", "").strip() or None
-
-        if not name:
-            flash("Department name is required.", "danger")
-            return redirect(url_for('admin_dashboard'))
-
-        existing = Department.query.filter_by(name=name).first()
-        if existing:
-            flash("A department with this name already exists.", "danger")
-            return redirect(url_for('admin_dashboard'))
-        
+@click.command("reconcile-counters")
+@with_appcontext
+def reconcile_counters():
+    """Recompute the admin dashboard counters from the tables."""
+    import counters
+    from extensions import db
+    with db.engine.begin() as conn:
+        before = counters.read_all(conn)
+        after = counters.reconcile(conn)
+    for name in sorted(set(before) | set(after)):
+        drift = after.get(name, 0) - before.get(name, 0)
+        print(f"{name}: {after.get(name, 0)}" + (f" (was {before.get(name, 0)})" if drift else ""))
+
+
+@click.command("archive-appointments")
+@click.option("--older-than-days", default=None, type=int, help="Default: ARCHIVE_AFTER_DAYS (365).")
+@click.option("--batch-size", default=1000, help="Appointments moved per transaction.")
+@with_appcontext
+def archive_appointments(older_than_days, batch_size):
+    """Move closed appointments (and their treatments) past the cutoff into the archive tables."""
+    import archive
+    from extensions import db
+    if older_than_days is None:
+        older_than_days = current_app.config.get('ARCHIVE_AFTER_DAYS', archive.DEFAULT_AFTER_DAYS)
+    before = archive.cutoff(older_than_days)
+    appointments, treatments = archive.archive(
+        db.engine, before, batch_size,
+        progress=lambda a, t: click.echo(f"  {a} appointments, {t} treatments so far", err=True))
+    print(f"archived {appointments} appointments and {treatments} treatments dated before {before}")
+
+
+@click.command("run-worker")
+@click.option("--once", is_flag=True, help="Run whatever is due and exit (for cron).")
+@click.option("--interval", default=5.0, help="Seconds between looks at the queue.")
+@with_appcontext
+def run_worker(once, interval):
+    """Run the background jobs (follow-up reminders, no-show sweep), see jobs.py."""
+    import jobs
+    from extensions import db
+    jobs.work(db.engine, current_app.config, interval, once)
+
+
+@click.command("job-benchmark")
+@click.option("--batch-size", "batch_sizes", multiple=True, type=int, help="JOB_BATCH_SIZE to try, repeatable.")
+@click.option("--days", default=30, help="Reminders look this far ahead, the sweep runs as if this many days had passed.")
+@with_appcontext
+def job_benchmark(batch_sizes, days):
+    """Rows per second of each background job on a copy of the database."""
+    import os
+    import shutil
+    import tempfile
+    from datetime import date, timedelta
+    import database
+    import jobs
+    from extensions import db
+
+    # stretched so there is work to measure
+    runs = (("follow_up_reminders", date.today()), ("no_show_sweep", date.today() + timedelta(days=days)))
+    for size in batch_sizes or (100, jobs.DEFAULT_BATCH_SIZE, 5000):
+        # a fresh copy per size, the first run would leave nothing for the next
+        workdir = tempfile.mkdtemp(prefix="hms-jobs-")
         try:
-            new_dept = Department(name=name, description=description)
-            db.session.add(new_dept)
-            db.session.commit()
-            flash(f"Department '{name}' added successfully.", "success")
-        except Exception as e:
-            db.session.rollback()
-            flash(f"Error adding department: {e}", "danger")
-        
-        return redirect(url_for('admin_dashboard'))
-
-
-@app.route("/admin/add_doctor", methods=["POST"])
-@login_required
-def add_doctor():
-    # Only admin can add doctors
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
-    if request.method == "POST":
-        name = request.form.get("name", "").strip()
-        email = request.form.get("email", "").strip().lower()
-        password = request.form.get("password", "")
-        
+            copy = os.path.join(workdir, "jobs.db")
+            database.snapshot(db.engine.url.database, copy)
+            bench_app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{copy}", 'CACHE_BACKEND': 'none',
+                                    'HMS_DB_PROFILE': current_app.config['HMS_DB_PROFILE']})
+            with bench_app.app_context():
+                config = dict(bench_app.config, JOB_BATCH_SIZE=size, FOLLOW_UP_REMINDER_DAYS=days)
+                for name, today in runs:
+                    r = jobs.measure(db.engine, name, config, today)
+                    print(f"{name:20s} batch {size:5d}  {r['rows']:7d} rows ({r['changed']} written) "
+                          f"in {r['seconds']:6.2f}s = {r['rows_per_second']:8.0f}/s, "
+                          f"{r['batches']} batches, longest {r['longest_batch_ms']:.1f} ms")
+                db.engine.dispose()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+@click.command("bitmap-benchmark")
+@click.option("--doctors", default=1000, help="How many active doctors to take.")
+@click.option("--days", default=30, help="Days from today.")
+@click.option("--group-size", default=50, help="Doctors per \"free slots in common\" question.")
+@with_appcontext
+def bitmap_benchmark(doctors, days, group_size):
+    """String-list slots against bitsets (and numpy, if installed) over doctors x days, see bitmap.py."""
+    from datetime import date
+    import bitmap
+    import slots
+    from extensions import db
+    from models import User
+
+    doctor_ids = db.session.scalars(db.select(User.id).where(
+        User.role == 'doctor', User.active.is_(True)).order_by(User.id).limit(doctors)).all()
+    if not doctor_ids:
+        raise click.ClickException("no active doctors, run `flask seed-data` first")
+    print(f"{len(doctor_ids)} doctors x {days} days, {slots.interval_minutes()}-minute slots, "
+          f"groups of {group_size}{'' if bitmap.numpy() else ' (numpy not installed)'}")
+    for r in bitmap.compare(doctor_ids, date.today(), days, slots.interval_minutes(), group_size):
+        print(f"{r['representation']:13s} build {r['build_s'] * 1000:8.1f} ms ({r['build_peak_kib']:8.0f} KiB peak)  "
+              f"common slots {r['common_s'] * 1000:8.1f} ms  utilization {r['utilization_s'] * 1000:7.1f} ms"
+              f"{'' if r['matches'] else '  MISMATCH'}")
+
+
+@click.command("password-benchmark")
+@click.option("--seconds", default=3.0, help="How long to run.")
+@click.option("--method", default=None, help="Hash method to try instead of PASSWORD_HASH_METHOD.")
+@with_appcontext
+def password_benchmark(seconds, method):
+    """Password verifications (= logins) per second, overall and per core."""
+    import passwords
+    method = method or passwords.hasher.method
+    rate, per_core = passwords.benchmark(seconds, method=method)
+    print(f"{passwords.method_prefix(method)}: {rate:.1f} logins/s, {per_core:.1f} per core")
+
+
+@click.command("db-loadtest")
+@click.option("--profile", "profiles", multiple=True, help="Profiles to compare (default: baseline and the current one).")
+@click.option("--readers", default=4, help="Reader processes.")
+@click.option("--writers", default=2, help="Writer processes.")
+@click.option("--seconds", default=5.0, help="How long each run lasts.")
+@with_appcontext
+def db_loadtest(profiles, readers, writers, seconds):
+    """Multi-process read/write throughput on a copy of the database, per profile."""
+    import database
+    from extensions import db
+    profiles = profiles or ('baseline', current_app.config['HMS_DB_PROFILE'])
+    source = db.engine.url.database
+    for profile in dict.fromkeys(profiles):
+        result = database.loadtest(source, profile, readers, writers, seconds)
+        print(f"{profile:12s} reads/s {result['reads/s']:9.1f}  writes/s {result['writes/s']:8.1f}  "
+              f"locked errors {result['errors']}")
+
+
+@click.command("startup-benchmark")
+@click.option("--runs", default=5, help="Cold workers to start.")
+@click.option("--path", default="/login", help="Page requested as the first response.")
+def startup_benchmark(runs, path):
+    """Time from a cold interpreter to the first response: import, create_app, first request."""
+    import json
+    import os
+    import statistics
+    import subprocess
+    import sys
+
+    probe = f"""
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+t1 = time.perf_counter()
+app = create_app()
+t2 = time.perf_counter()
+status = app.test_client().get({path!r}).status_code
+t3 = time.perf_counter()
+print(json.dumps([t1 - t0, t2 - t1, t3 - t2, status]))
+"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, check=True,
+                             capture_output=True, text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    for i, label in enumerate(("import", "create_app", "first response")):
+        times = [sample[i] * 1000 for sample in samples]
+        print(f"{label:15s} median {statistics.median(times):7.1f} ms   max {max(times):7.1f} ms")
+    total = [sum(sample[:3]) * 1000 for sample in samples]
+    print(f"{'total':15s} median {statistics.median(total):7.1f} ms   (status {samples[-1][3]})")
+
+
+@click.command("seed-data")
+@click.option("--departments", default=20)
+@click.option("--doctors", default=2000)
+@click.option("--patients", default=200000)
+@click.option("--appointments", default=2000000)
+@click.option("--history-days", default=365, help="How far back appointments go.")
+@click.option("--availability-days", default=90, help="How far ahead availability and bookings go.")
+@click.option("--batch-size", default=20000)
+@click.option("--password", default="secret1", help="Password of every generated user.")
+@click.option("--tag", default="seed", help="Emails end in @<tag>.hms.test, use a new tag to seed again.")
+@click.option("--seed", "random_seed", default=0, help="Random seed, same seed gives the same data.")
+@with_appcontext
+def seed_data(departments, doctors, patients, appointments, history_days, availability_days,
+              batch_size, password, tag, random_seed):
+    """Fill the database with synthetic departments, users, availability and appointments."""
+    import seed
+    from extensions import db
+    from passwords import hasher
+    with db.engine.connect() as conn:
         try:
-            specialization_id = int(request.form.get("specialization_id"))
-        except (ValueError, TypeError):
-            flash("Please select a valid department.", "danger")
-            return redirect(url_for('admin_dashboard'))
-
-        if not name or not email or not password or not specialization_id:
-            flash("All fields are required.", "danger")
-            return redirect(url_for('admin_dashboard'))
-        
-        if len(password) < 6:
-            flash("Password must be at least 6 characters long.", "danger")
-            return redirect(url_for('admin_dashboard'))
-        
-        existing = User.query.filter_by(email=email).first()
-        if existing:
-            flash("An account already exists with that email.", "danger")
-            return redirect(url_for('admin_dashboard'))
-        
-    #doctor banauna lai
-        try:
-            hashed = generate_password_hash(password)
-            new_doctor = User(
-                name=name,
-                email=email,
-                password=hashed,
-                role="doctor",
-                specialization_id=specialization_id
-            )
-            db.session.add(new_doctor)
-            db.session.commit()
-            flash(f"Doctor {name} added successfully.", "success")
-        except Exception as e:
-            db.session.rollback()
-            flash(f"Error adding doctor: {e}", "danger")
-        
-        return redirect(url_for('admin_dashboard'))
-
-
-@app.route("/dashboard/doctor")
-@login_required
-def doctor_dashboard():
-    if current_user.role != 'doctor':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    today = date.today().strftime("%Y-%m-%d")
-
-    all_appointments = Appointment.query.filter_by(doctor_id = current_user.id).all()
-
-    upcoming_appointments = []
-    past_appointments = []
-
-    for apt in all_appointments:
-        if apt.status=="Booked" and apt.date>=today:
-            upcoming_appointments.append(apt)
-        else:
-            past_appointments.append(apt)
-    
-    upcoming_appointments.sort(key= lambda x: (x.date, x.time))
-    past_appointments.sort(key= lambda x:(x.date, x.time), reverse=True)
-
-    availability_schedule = []
-    start_date = date.today()
-    
-    for i in range(7):
-        current_date = start_date + timedelta(days=i)
-        date_str = current_date.strftime("%Y-%m-%d")
-        day_name = current_date.strftime('%A')
-
-        avail = DoctorAvailability.query.filter_by(
-            doctor_id=current_user.id,
-            date=date_str
-            ).first()
-        
-        if not avail:
-            avail = DoctorAvailability(
-                doctor_id=current_user.id,
-                date=date_str)
-            db.session.add(avail)
-        
-        if not avail.start_time:
-            avail.start_time = "09:00"
-        if not avail.end_time:
-            avail.end_time = "17:00"
-        if not avail.is_available:
-            avail.is_available = False
-
-        availability_schedule.append({
-            'day_name': day_name,
-            'avail_record': avail
-        })
-    
-    db.session.commit()
-
-
-    return render_template("doctor_dashboard.html",
-                           upcoming_appointments = upcoming_appointments,
-                           past_appointments = past_appointments,
-                           availability_schedule = availability_schedule) 
-
-
-@app.route("/dashboard/patient")
-@login_required
-def patient_dashboard():
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    search_query = request.args.get("search_query", "").strip()
-    doctor_query = User.query.filter_by(role = "doctor", active = True)
-
-    if search_query:
-        search_term = f"%{search_query}%"
-        doctor_query = doctor_query.join(Department, User.specialization_id == Department.id).filter(
-            or_(
-                User.name.ilike(search_term),
-                Department.name.like(search_term)
-            )
-        )
-    
-    doctors = doctor_query.order_by(User.name).all()
-
-    today_str = date.today().strftime("%Y-%m-%d")
-
-    all_appointments = Appointment.query.filter_by(
-        patient_id=current_user.id
-    ).order_by(Appointment.date.desc(), Appointment.time.desc()).all()
-    
-    upcoming_appointments = []
-    past_appointments = []
-    
-    for appt in all_appointments:
-        if appt.status == "Booked" and appt.date >= today_str:
-            upcoming_appointments.append(appt)
-        else:
-            past_appointments.append(appt)
-
-    upcoming_appointments.reverse()
-
-    return render_template("patient_dashboard.html",
-                           doctors = doctors,
-                           search_query = search_query,
-                           upcoming_appointments=upcoming_appointments,
-                           past_appointments=past_appointments)
-
-@app.route("/doctor/manage_appointment/<int:appt_id>", methods = ["GET", "POST"])
-@login_required
-def manage_appointment(appt_id):
-    if current_user.role!='doctor':
-        flash("Access denied!!", "danger")
-        return redirect(url_for('login'))
-    
-    appt = Appointment.query.filter_by(id=appt_id, doctor_id = current_user.id).first_or_404()
-
-    treatment = Treatment.query.filter_by(appointment_id = appt_id).first()
-
-    if request.method == "POST":
-        diagnosis = request.form.get("diagnosis", "").strip()
-        prescription = request.form.get("prescription", "").strip()
-        notes = request.form.get("notes", "").strip() or None
-
-        if not diagnosis or not prescription:
-            flash("Diagnosis and Prescription are required to complete an appointment.", "danger")
-            return render_template("manage_appointment.html", appt=appt, treatment=treatment)
-        
-        try:
-            if treatment:
-                treatment.diagnosis = diagnosis
-                treatment.prescription = prescription
-                treatment.notes = notes
-            else:
-                treatment = Treatment(
-                    appointment_id = appt.id,
-                    diagnosis = diagnosis,
-                    prescription = prescription,
-                    notes = notes)
-                db.session.add(treatment)
-            
-            appt.status =  "Completed"
-
-            db.session.commit()
-            flash("Appointment marked as 'Completed' and treatment notes saved", "success")
-            return redirect(url_for('doctor_dashboard'))
-        
-        except Exception as e:
-            db.session.rollback()
-            flash(f"An error occured: {e}", "danger")
-
-    return render_template("manage_appointment.html", appt=appt, treatment=treatment)
-
-
-@app.route("/doctor/cancel_appointment/<int:appt_id>", methods=["POST"])
-@login_required
-def cancel_appointment(appt_id):
-    if current_user.role != 'doctor':
-        flash("Access denied!!", "danger")
-        return redirect(url_for('login'))
-    appt = Appointment.query.filter_by(id=appt_id, doctor_id=current_user.id, status="Booked").first_or_404()
-    
-    try:
-        appt.status = "Cancelled"
-        db.session.commit()
-        flash("Appointment has been cancelled.", "success")
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred: {e}", "danger")
-        
-    return redirect(url_for('doctor_dashboard'))
-
-@app.route("/doctor/patient_history/<int:patient_id>")
-@login_required
-def patient_history(patient_id):
-    if current_user.role!='doctor':
-        flash("Accedd denied!!", "danger")
-        return redirect(url_for('login'))
-    
-    patient = User.query.get_or_404(patient_id)
-    if patient.role != 'patient':
-        return 404
-    
-    history = Appointment.query.filter_by(
-        patient_id=patient.id,
-        status="Completed"
-    ).order_by(Appointment.date.desc(), Appointment.time.desc()).all()
-
-    return render_template("patient_history.html", patient=patient, history=history)
-
-@app.route("/doctor/update_availability", methods=["POST"])
-@login_required
-def update_availability():
-    if current_user.role != 'doctor':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
+            seed.generate(conn, departments, doctors, patients, appointments, history_days,
+                          availability_days, batch_size, hasher.hash(password), tag=tag, seed=random_seed)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+
+@click.command("import-data")
+@click.argument("entity", type=click.Choice(["departments", "users", "appointments", "treatments"]))
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None, help="Default: from the file name.")
+@click.option("--chunk-size", default=2000)
+@click.option("--default-password", default=None, help="For user rows without a password.")
+@click.option("--workers", default=None, type=int, help="Password hashing processes (default: one per core).")
+@click.option("--errors", "errors_path", default=None, help="Write every rejected row to this CSV.")
+@with_appcontext
+def import_data(entity, source, fmt, chunk_size, default_password, workers, errors_path):
+    """Bulk-load CSV/NDJSON rows (see transfer.py for the columns). Bad rows are skipped and reported."""
+    import csv
+    import transfer
+    from extensions import db
+    from passwords import hasher
+    fmt = transfer.detect_format(source.name, fmt)
+    with db.engine.connect() as conn:
+        imported, errors = transfer.import_rows(conn, entity, transfer.read_rows(source, fmt), chunk_size,
+                                                default_password, hasher.method, workers)
+    if imported and entity in ("appointments", "treatments"):
+        # visit histories are cached for an hour, don't let them hide the new rows
+        from cache import cache, HISTORY
+        cache.invalidate(HISTORY)
+    for line_no, message in errors[:20]:
+        click.echo(f"line {line_no}: {message}", err=True)
+    if len(errors) > 20:
+        click.echo(f"... and {len(errors) - 20} more", err=True)
+    if errors_path:
+        with open(errors_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("line", "error"))
+            writer.writerows(errors)
+    print(f"imported {imported} {entity}, rejected {len(errors)}")
+
+
+@click.command("export-data")
+@click.argument("entity", type=click.Choice(["departments", "users", "appointments", "treatments"]))
+@click.argument("target", type=click.File("w", encoding="utf-8", lazy=True), default="-")
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None, help="Default: from the file name.")
+@with_appcontext
+def export_data(entity, target, fmt):
+    """Stream every row of ENTITY to TARGET (stdout by default) as CSV or NDJSON."""
+    import transfer
+    from extensions import db
+    fmt = transfer.detect_format(target.name, fmt)
+    with db.engine.connect() as conn:
+        count = transfer.export(conn, entity, target, fmt)
+    click.echo(f"exported {count} {entity}", err=True)
+
+
+@click.command("benchmark")
+@click.option("--requests", default=50, help="Timed requests per route.")
+@click.option("--warmup", default=5, help="Untimed requests per route first.")
+@click.option("--password", default="secret1", help="Password of the seeded doctor/patient used.")
+@click.option("--cache-backend", default="none", help="CACHE_BACKEND for the run (default none: measure the real work).")
+@click.option("--save", "save_path", default=None, help="Write the results to this JSON file.")
+@click.option("--compare", "compare_path", default=None, help="Diff against a saved baseline JSON.")
+@click.option("--threshold", default=0.2, help="p95 slowdown counted as a regression.")
+@with_appcontext
+def run_benchmark(requests, warmup, password, cache_backend, save_path, compare_path, threshold):
+    """Drive every route through the test client on a copy of the database."""
+    import os
+    import shutil
+    import tempfile
+    import benchmark
+    import database
+    from extensions import db
+
+    workdir = tempfile.mkdtemp(prefix="hms-benchmark-")
     try:
-        for avail_id in request.form.getlist("avail_id"):
-            avail = DoctorAvailability.query.filter_by(
-                id = int(avail_id),
-                doctor_id = current_user.id
-            ).first()
-
-            if avail:
-                avail.start_time = request.form.get(f"start_time_{avail_id}")
-                avail.end_time = request.form.get(f"end_time_{avail_id}")
-
-                avail.is_available = f"is_available_{avail_id}" in request.form
-        
-        db.session.commit()
-        flash("Availability updated successfully.", "success")
-
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred: {e}", "danger")
-
-    return redirect(url_for('doctor_dashboard'))
-
-@app.route("/patient/book_appointment/<int:doctor_id>")
-@login_required
-def book_appointment_form(doctor_id):
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-        
-    doctor = User.query.filter_by(id=doctor_id, role='doctor', active=True).first_or_404()
-
-    available_slots = []
-    
-    start_date = date.today()
-    for i in range(7):
-        current_date = start_date + timedelta(days=i)
-        date_str = current_date.strftime("%Y-%m-%d")
-        day_name = current_date.strftime('%A')
-
-        doc_avail = DoctorAvailability.query.filter_by(
-            doctor_id=doctor.id,
-            date=date_str,
-            is_available=True
-        ).first()
-        
-        if doc_avail:
-            booked_appts = Appointment.query.filter_by(doctor_id = doctor_id,
-                                                       date = date_str).all()
-            booked_times = [appt.time for appt in booked_appts]
-            all_possible_slots = generate_time_slots(doc_avail.start_time, doc_avail.end_time)
-            
-            day_slots = []
-            for slot in all_possible_slots:
-                if slot not in booked_times:
-                    day_slots.append(slot)
-
-
-            if day_slots:
-                available_slots.append({
-                    'date_str': date_str,
-                    'day_name': day_name,
-                    'slots': day_slots
-                })
-                
-    return render_template("book_appointment.html", 
-                           doctor=doctor, 
-                           available_slots=available_slots)
-
-@app.route("/patient/create_appointment", methods=["POST"])
-@login_required
-def create_appointment():
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
-    doctor_id = request.form.get("doctor_id")
-    appt_date = request.form.get("appt_date")
-    appt_time = request.form.get("appt_time")
-    
-    if not doctor_id or not appt_date or not appt_time:
-        flash("An error occurred. Please try booking again.", "danger")
-        return redirect(url_for('patient_dashboard'))
-
-    try:
-        existing = Appointment.query.filter_by(
-            doctor_id=doctor_id,
-            date=appt_date,
-            time=appt_time
-        ).first()
-        
-        if existing:
-            flash("Sorry, this time slot is already booked", "danger")
-            return redirect(url_for('book_appointment_form', doctor_id = doctor_id))
-        
-        new_appt = Appointment(
-            patient_id=current_user.id,
-            doctor_id=doctor_id,
-            date=appt_date,
-            time=appt_time,
-            status="Booked"
-        )
-        db.session.add(new_appt)
-        db.session.commit()
-        
-        flash("Appointment booked successfully!", "success")
-        return redirect(url_for('patient_dashboard'))
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred: {e}", "danger")
-        return redirect(url_for('book_appointment_form', doctor_id=doctor_id))
-
-@app.route("/patient/cancel_appointment/<int:appt_id>", methods=["POST"])
-@login_required
-def patient_cancel_appointment(appt_id):
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    appt = Appointment.query.filter_by(
-        id=appt_id, 
-        patient_id=current_user.id, 
-        status="Booked"
-    ).first_or_404()
-
-    try:
-        appt.status = "Cancelled"
-        db.session.commit()
-        flash("Your appointment has been successfully cancelled.", "success")
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred: {e}", "danger")
-        
-    return redirect(url_for('patient_dashboard'))
-
-@app.route("/patient/view_details/<int:appt_id>")
-@login_required
-def view_appointment_details(appt_id):
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    appt = Appointment.query.filter_by(id=appt_id, patient_id=current_user.id).first_or_404()
-
-    if appt.status != "Completed":
-        flash("Details are only available for completed appointments.", "danger")
-        return redirect(url_for('patient_dashboard'))
-    
-    treatment = Treatment.query.filter_by(appointment_id=appt.id).first()
-
-    return render_template("view_appointment_details.html", appt=appt, treatment=treatment)
-
-
-
-@app.route("/patient/edit_profile", methods=["GET"])
-@login_required
-def edit_profile_form():
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-        
-    return render_template("edit_profile.html")
-    
-
-@app.route("/patient/edit_profile", methods=["POST"])
-@login_required
-def edit_profile_submit():
-    if current_user.role != 'patient':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-
-    name = request.form.get("name", "").strip()
-    age_raw = request.form.get("age", "").strip()
-    gender = request.form.get("gender", "").strip() or None
-    contact_number = request.form.get("contact_number", "").strip() or None
-    address = request.form.get("address", "").strip() or None
-
-    if not name:
-        flash("Name is required.", "danger")
-        return render_template("edit_profile.html")
-        
-    age = None
-    if age_raw:
+        copy = os.path.join(workdir, "benchmark.db")
+        database.snapshot(db.engine.url.database, copy)
+        bench_app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{copy}",
+            'HMS_DB_PROFILE': current_app.config['HMS_DB_PROFILE'],
+            'CACHE_BACKEND': cache_backend,
+            'CACHE_SQLITE_PATH': os.path.join(workdir, "cache.sqlite"),
+            'IDENTITY_CACHE_PATH': os.path.join(workdir, "identity.sqlite"),
+            'LOGIN_MAX_ATTEMPTS_PER_IP': 10**9,
+            'LOGIN_MAX_FAILURES_PER_ACCOUNT': 10**9,
+        })
         try:
-            age_val = int(age_raw)
-            if age_val > 0:
-                age = age_val
-            else:
-                flash("Age must be a positive number.", "danger")
-                return render_template("edit_profile.html")
-        except ValueError:
-            flash("Please enter a valid age.", "danger")
-            return render_template("edit_profile.html")
-            
-    try:
-        user = User.query.get(current_user.id)
-        user.name = name
-        user.age = age
-        user.gender = gender
-        user.contact_number = contact_number
-        user.address = address
-        
-        db.session.commit()
-        flash("Your profile has been updated successfully.", "success")
-        return redirect(url_for('patient_dashboard'))
+            results = benchmark.run(bench_app, password, requests, warmup)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if compare_path:
+        lines, regressions = benchmark.compare(results, compare_path, threshold)
+        print("\n".join(lines))
+        print(f"{regressions} regression(s) against {compare_path}")
+    if save_path:
+        benchmark.save(results, save_path, {'requests': requests, 'warmup': warmup, 'cache_backend': cache_backend,
+                                            'profile': current_app.config['HMS_DB_PROFILE']})
+        print(f"saved {save_path}")
+    if compare_path and regressions:
+        raise SystemExit(1)
+
+
+@click.command("check-indexes")
+@with_appcontext
+def check_indexes():
+    """EXPLAIN the hot scheduling queries and fail if one stops using its index."""
+    import migrations
+    from extensions import db
+    failed = False
+    with db.engine.connect() as conn:
+        for description, index, plan, ok in migrations.explain_hot_queries(conn):
+            print(f"{'ok  ' if ok else 'FAIL'} {description}: {plan}")
+            if not ok:
+                print(f"     expected {index}")
+                failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+COMMANDS = [init_db, seed_admin, reconcile_counters, archive_appointments, run_worker, job_benchmark,
+            bitmap_benchmark, password_benchmark, db_loadtest, startup_benchmark, seed_data, import_data, export_data,
+            run_benchmark, check_indexes]
 
-    except Exception as e:
-        db.session.rollback()
-        flash(f"An error occurred: {e}", "danger")
-        return render_template("edit_profile.html")
-
-@app.route("/admin/view_details/<int:appt_id>")
-@login_required
-def admin_view_appointment_details(appt_id):
-    if current_user.role != 'admin':
-        flash("Access unauthorized.", "danger")
-        return redirect(url_for('login'))
-    
-    appt = Appointment.query.get_or_404(appt_id)
-
-    if appt.status != "Completed":
-        flash("Details only available for completed appointments.", "danger")
-        return redirect(url_for('admin_dashboard'))
-    treatment = Treatment.query.filter_by(appointment_id=appt.id).first()
-    
-    if not treatment:
-        flash("No treatment details were found.", "warning")
-        return redirect(url_for('admin_dashboard'))
-    
-    return render_template("view_appointment_details.html", appt=appt, treatment=treatment)
 
 if __name__ == "__main__":
+    app = create_app()
+    with app.app_context():
+        # dev server convenience: same as running init-db and seed-admin first
+        import migrations
+        from extensions import db
+        migrations.upgrade(db.engine)
+        ensure_admin()
     app.run(debug=True)
@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+from sqlalchemy import bindparam, text
+
+# hot/cold split of appointments, run with `flask archive-appointments`.
+#
+# closed (Completed/Cancelled/No-Show) appointments dated more than ARCHIVE_AFTER_DAYS
+# ago move, together with their treatments, to appointments_archive/treatments_archive.
+# booking, slot lookups and the dashboards only query the live tables, which stay
+# the size of the recent past plus the future. patient_history and the appointment
+# details pages read both (queries.history_page, queries.find_appointment).
+#
+# appointments keep their ids, treatments get new ones in the archive (nothing
+# refers to a treatment id). the newest appointment is never moved: sqlite gives the
+# next insert MAX(id) + 1, so an emptied live table would start handing out ids the
+# archive already has.
+#
+# counters don't change, an archived appointment still counts (counters.reconcile
+# reads both tables). each batch is its own short transaction, so bookings carry on
+# while a large backlog drains.
+
+DEFAULT_AFTER_DAYS = 365
+DEFAULT_BATCH_SIZE = 1000
+
+# the first statement writes, so the batch holds the write lock from the moment it
+# picks its rows and nothing can change them before they are deleted
+MOVE_APPOINTMENTS = text("""
+    INSERT INTO appointments_archive (id, patient_id, doctor_id, date, time, status, created_at)
+    SELECT id, patient_id, doctor_id, date, time, status, created_at FROM appointments
+    WHERE date < :before AND status IN ('Completed', 'Cancelled', 'No-Show')
+      AND id < (SELECT MAX(id) FROM appointments)
+    ORDER BY id LIMIT :limit
+    RETURNING id""")
+
+MOVE_TREATMENTS = text("""
+    INSERT INTO treatments_archive (appointment_id, diagnosis, prescription, follow_up_date, notes, created_at)
+    SELECT appointment_id, diagnosis, prescription, follow_up_date, notes, created_at FROM treatments
+    WHERE appointment_id IN :ids ORDER BY id""").bindparams(bindparam('ids', expanding=True))
+
+DELETE_TREATMENTS = text("DELETE FROM treatments WHERE appointment_id IN :ids").bindparams(
+    bindparam('ids', expanding=True))
+
+DELETE_APPOINTMENTS = text("DELETE FROM appointments WHERE id IN :ids").bindparams(
+    bindparam('ids', expanding=True))
+
+
+def cutoff(after_days=DEFAULT_AFTER_DAYS, today=None):
+    return (today or date.today()) - timedelta(days=after_days)
+
+
+def archive_batch(connection, before, batch_size=DEFAULT_BATCH_SIZE):
+    """Move up to `batch_size` closed appointments dated before `before`.
+
+    Returns (appointments, treatments) moved. The caller commits.
+    """
+    ids = connection.execute(MOVE_APPOINTMENTS, {'before': before.isoformat(), 'limit': batch_size}).scalars().all()
+    if not ids:
+        return 0, 0
+    treatments = connection.execute(MOVE_TREATMENTS, {'ids': ids}).rowcount
+    connection.execute(DELETE_TREATMENTS, {'ids': ids})
+    connection.execute(DELETE_APPOINTMENTS, {'ids': ids})
+    return len(ids), treatments
+
+
+def archive(engine, before, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Drain every closed appointment dated before `before` into the archive, batch by batch."""
+    appointments = treatments = 0
+    while True:
+        with engine.begin() as conn:
+            moved, moved_treatments = archive_batch(conn, before, batch_size)
+        appointments += moved
+        treatments += moved_treatments
+        if progress and moved:
+            progress(appointments, treatments)
+        if moved < batch_size:
+            return appointments, treatments
@@ -0,0 +1,123 @@
+from datetime import date, time, timedelta
+
+from extensions import db
+from models import AvailabilityTemplate, DoctorAvailability
+import queries
+
+# doctor availability as a weekly template plus exceptions.
+#
+# each doctor has up to seven AvailabilityTemplate rows, their usual hours per
+# weekday (0 = Monday). a DoctorAvailability row is an exception for one date
+# (leave, extra hours) and exists only while that date differs from the template.
+# what a doctor offers on a date is computed on the fly: the exception if there is
+# one, else the weekday's template, else nothing. so the tables hold about seven
+# rows per doctor plus the exceptions, whatever the horizon.
+#
+# writers go through save_weekly()/save_days(), which drop exceptions that have
+# come to match the template. the worker deletes past exceptions (jobs.py).
+
+DEFAULT_START = time(9, 0)
+DEFAULT_END = time(17, 0)
+
+
+def same_hours(a, b):
+    """Whether two availabilities offer the same thing (closed days match whatever their times)."""
+    if bool(a.is_available) != bool(b.is_available):
+        return False
+    return not a.is_available or (a.start_time, a.end_time) == (b.start_time, b.end_time)
+
+
+def check_hours(start_time, end_time, is_available):
+    """ValueError unless an available day runs from a start_time to a later end_time."""
+    if is_available and not (start_time and end_time and start_time < end_time):
+        raise ValueError("an available day needs start_time before end_time")
+
+
+def weekly(doctor_id):
+    """{weekday: AvailabilityTemplate} for the doctor."""
+    return {row.weekday: row for row in AvailabilityTemplate.query.filter_by(doctor_id=doctor_id)}
+
+
+def merge(templates, exceptions, doctor_ids, dates):
+    """{(doctor_id, date): exception or template} from rows with doctor_id/weekday and doctor_id/date.
+
+    Dates with neither are left out, the doctor isn't available then.
+    """
+    templates = {(row.doctor_id, row.weekday): row for row in templates}
+    exceptions = {(row.doctor_id, row.date): row for row in exceptions}
+    result = {}
+    for doctor_id in doctor_ids:
+        for day in dates:
+            avail = exceptions.get((doctor_id, day)) or templates.get((doctor_id, day.weekday()))
+            if avail is not None:
+                result[doctor_id, day] = avail
+    return result
+
+
+def by_date_many(doctor_ids, days, start=None):
+    """{(doctor_id, date): template or exception row} over `days` days, two queries."""
+    start = start or date.today()
+    templates = AvailabilityTemplate.query.filter(AvailabilityTemplate.doctor_id.in_(doctor_ids))
+    exceptions = DoctorAvailability.query.filter(
+        DoctorAvailability.doctor_id.in_(doctor_ids),
+        queries.within_days(DoctorAvailability.date, days, start))
+    return merge(templates, exceptions, doctor_ids, [start + timedelta(days=i) for i in range(days)])
+
+
+def by_date(doctor_id, days, start=None):
+    """{date: template or exception row} for one doctor."""
+    return {day: avail for (_, day), avail in by_date_many([doctor_id], days, start).items()}
+
+
+def save_weekly(doctor_id, rows):
+    """Set the doctor's weekly hours from (weekday, start_time, end_time, is_available) tuples.
+
+    Upcoming exceptions that now match the new hours are dropped. Raises ValueError,
+    with nothing changed, if a row fails check_hours(). The caller commits.
+    """
+    for _, start_time, end_time, is_available in rows:
+        check_hours(start_time, end_time, is_available)
+    templates = weekly(doctor_id)
+    for weekday, start_time, end_time, is_available in rows:
+        template = templates.get(weekday)
+        if template is None:
+            template = templates[weekday] = AvailabilityTemplate(doctor_id=doctor_id, weekday=weekday)
+            db.session.add(template)
+        template.start_time, template.end_time, template.is_available = start_time, end_time, is_available
+    for exception in DoctorAvailability.query.filter(DoctorAvailability.doctor_id == doctor_id,
+                                                     DoctorAvailability.date >= date.today()):
+        template = templates.get(exception.date.weekday())
+        if template is not None and same_hours(exception, template):
+            db.session.delete(exception)
+
+
+def save_days(doctor_id, rows):
+    """Set the hours of single dates from (date, start_time, end_time, is_available) tuples.
+
+    A date that matches the weekly template loses its exception, any other gets one.
+    Raises ValueError, with nothing changed, if a row fails check_hours(). The caller commits.
+    """
+    # the last word on a date counts
+    rows = list({row[0]: row for row in rows}.values())
+    for _, start_time, end_time, is_available in rows:
+        check_hours(start_time, end_time, is_available)
+    if not rows:
+        return
+    templates = weekly(doctor_id)
+    existing = {row.date: row for row in DoctorAvailability.query.filter(
+        DoctorAvailability.doctor_id == doctor_id,
+        DoctorAvailability.date.in_([day for day, _, _, _ in rows]))}
+    for day, start_time, end_time, is_available in rows:
+        wanted = DoctorAvailability(doctor_id=doctor_id, date=day, start_time=start_time,
+                                    end_time=end_time, is_available=is_available)
+        template = templates.get(day.weekday())
+        exception = existing.get(day)
+        # no template means closed
+        if same_hours(wanted, template or AvailabilityTemplate(is_available=False)):
+            if exception is not None:
+                db.session.delete(exception)
+        elif exception is None:
+            existing[day] = wanted
+            db.session.add(wanted)
+        else:
+            exception.start_time, exception.end_time, exception.is_available = start_time, end_time, is_available
@@ -0,0 +1,310 @@
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, text
+
+# route-level benchmark: every view in views.py driven through the test client.
+#
+# each scenario is a callable giving the (method, url, form) of its i-th request
+# (method "JSON" posts `form` as a json body),
+# or None once it has run out of things to do (e.g. free slots to book). every
+# scenario is timed over `requests` requests after `warmup` ones, with the SQL
+# statements counted per request; then one more request runs under tracemalloc for
+# its peak allocation (kept out of the timed loop, it slows everything down).
+#
+# the run writes: it books, cancels, completes, registers, toggles ... so
+# `flask benchmark` points it at a copy of the database.
+
+ADMIN = ('admin@hms.gmail.com', 'admin123')
+API_BATCH = 5   # appointments per api batch request
+
+
+def percentile(values, pct):
+    # nearest rank
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def _login(app, email, password):
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': password})
+    if response.status_code != 302:
+        raise RuntimeError(f"could not log in as {email} (status {response.status_code})")
+    # the first page after login carries the flash, get it out of the way
+    client.get(response.location)
+    return client
+
+
+def pick_fixtures(connection, wanted, today=None):
+    """Ids the scenarios need: a busy doctor, one of their patients, a completed appointment ...
+
+    `wanted` is how many of the doctor's upcoming bookings to set aside for the
+    complete/cancel scenarios.
+    """
+    today = today or date.today()
+    doctor_id = connection.execute(text("""
+        SELECT doctor_id FROM availability_templates
+        JOIN users ON users.id = availability_templates.doctor_id AND users.active = 1
+        WHERE is_available = 1
+        GROUP BY doctor_id ORDER BY COUNT(*) DESC, doctor_id LIMIT 1""")).scalar()
+    if doctor_id is None:
+        raise RuntimeError("no doctor with open availability, run `flask seed-data` first")
+    completed = connection.execute(text("""
+        SELECT appointments.id, appointments.patient_id FROM appointments
+        JOIN treatments ON treatments.appointment_id = appointments.id
+        JOIN users ON users.id = appointments.patient_id AND users.active = 1
+        WHERE appointments.doctor_id = :doctor AND appointments.status = 'Completed'
+        ORDER BY appointments.id LIMIT 1"""), {'doctor': doctor_id}).first()
+    if completed is None:
+        raise RuntimeError("the busiest doctor has no completed appointment to look at")
+    spare_patient = connection.execute(text("""
+        SELECT id FROM users WHERE role = 'patient' AND id != :patient ORDER BY id LIMIT 1"""),
+        {'patient': completed.patient_id}).scalar()
+    emails = dict(connection.execute(text("SELECT id, email FROM users WHERE id IN (:d, :p)"),
+                                     {'d': doctor_id, 'p': completed.patient_id}).all())
+    name, department_id = connection.execute(text("SELECT name, specialization_id FROM users WHERE id = :id"),
+                                             {'id': doctor_id}).first()
+    others = connection.execute(text("""
+        SELECT id FROM users WHERE role = 'doctor' AND active = 1 AND id != :doctor ORDER BY id LIMIT 20"""),
+        {'doctor': doctor_id}).scalars().all()
+    upcoming = connection.execute(text("""
+        SELECT id FROM appointments WHERE doctor_id = :doctor AND status = 'Booked' AND date >= :today
+        ORDER BY date, time LIMIT :n"""), {'doctor': doctor_id, 'today': today, 'n': 2 * wanted}).scalars().all()
+    return {
+        'doctor_id': doctor_id, 'doctor_email': emails[doctor_id], 'doctor_name': name,
+        'patient_id': completed.patient_id, 'patient_email': emails[completed.patient_id],
+        'completed_appt_id': completed.id, 'spare_patient_id': spare_patient,
+        'department_id': department_id, 'other_doctor_ids': others,
+        'to_complete': upcoming[0::2], 'to_cancel': upcoming[1::2],
+    }
+
+
+def scenarios(app, fx, password):
+    """[(name, client, request_fn)] in the order they run, plus {url: []} for the ids bookings create."""
+    import slots
+    admin = _login(app, *ADMIN)
+    doctor = _login(app, fx['doctor_email'], password)
+    patient = _login(app, fx['patient_email'], password)
+    run = uuid.uuid4().hex[:8]
+
+    with app.app_context():
+        free = [(day['date_str'], t) for day in slots.available_slots(fx['doctor_id'], patient_id=fx['patient_id'])
+                for t in day['slots']]
+        # the api scenarios book the other doctors, so they don't race book/hold for slots
+        api_free = [{'doctor_id': doctor_id, 'date': day['date_str'], 'time': t}
+                    for doctor_id, days in slots.available_slots_many(
+                        fx['other_doctor_ids'], patient_id=fx['patient_id']).items()
+                    for day in days for t in day['slots']]
+    # appointment ids the booking scenarios create, the patient cancels them again
+    booked = {'/patient/create_appointment': [], '/api/v1/appointments/batch': []}
+
+    def get(url):
+        return lambda i: ('GET', url, None)
+
+    def book(i):
+        if i >= len(free):
+            return None
+        day, t = free[i]
+        return 'POST', '/patient/create_appointment', {'doctor_id': fx['doctor_id'], 'appt_date': day, 'appt_time': t}
+
+    def hold(i):
+        if i >= len(free):
+            return None
+        day, t = free[-1 - i]
+        return 'POST', '/patient/hold_slot', {'doctor_id': fx['doctor_id'], 'appt_date': day, 'appt_time': t}
+
+    def each(ids, method, url, form=None):
+        # one appointment per request, None once they're used up
+        return lambda i: (method, url.format(ids[i]), form) if i < len(ids) else None
+
+    def api_book(i):
+        items = api_free[i * API_BATCH:(i + 1) * API_BATCH]
+        return ('JSON', '/api/v1/appointments/batch', {'items': items}) if items else None
+
+    def api_cancel(i):
+        ids = booked['/api/v1/appointments/batch'][i * API_BATCH:(i + 1) * API_BATCH]
+        return ('JSON', '/api/v1/appointments/cancel', {'ids': ids}) if ids else None
+
+    def availability(i):
+        days = [(date.today() + timedelta(days=n)).isoformat() for n in range(7)]
+        form = {'avail_date': days}
+        for day in days:
+            form.update({f'start_time_{day}': '09:00', f'end_time_{day}': '17:00', f'is_available_{day}': 'on'})
+        return 'POST', '/doctor/update_availability', form
+
+    def weekly(i):
+        form = {'weekday': [str(n) for n in range(7)]}
+        for n in range(7):
+            form.update({f'start_time_w{n}': '09:00', f'end_time_w{n}': '17:00', f'is_available_w{n}': 'on'})
+        return 'POST', '/doctor/update_availability', form
+
+    return [
+        ('GET main.index', admin, get('/')),
+        ('GET main.login', app.test_client(), get('/login')),
+        ('GET main.register', app.test_client(), get('/register')),
+        ('POST main.register', app.test_client(), lambda i: (
+            'POST', '/register', {'name': 'Bench Patient', 'email': f'bench{run}{i}@bench.hms.test',
+                                  'password': password, 'confirm_password': password})),
+        ('POST main.login', None, lambda i: ('POST', '/login', {'email': fx['patient_email'], 'password': password})),
+        ('GET main.admin_dashboard', admin, get('/dashboard/admin')),
+        ('GET main.admin_dashboard (search)', admin, get(f"/dashboard/admin?doctor_search={fx['doctor_name'].split()[0]}&patient_search=sh")),
+        ('GET main.admin_dashboard (filtered)', admin, get(f"/dashboard/admin?status=Completed&doctor_id={fx['doctor_id']}")),
+        ('GET main.export_appointments (filtered)', admin, get(f"/admin/appointments/export?doctor_id={fx['doctor_id']}")),
+        ('GET main.cache_stats', admin, get('/admin/cache_stats')),
+        ('GET main.edit_doctor_form', admin, get(f"/admin/edit_doctor/{fx['doctor_id']}")),
+        ('POST main.edit_doctor_submit', admin, lambda i: (
+            'POST', f"/admin/edit_doctor/{fx['doctor_id']}",
+            {'name': fx['doctor_name'], 'email': fx['doctor_email'], 'specialization_id': fx['department_id']})),
+        ('POST main.toggle_active', admin, lambda i: ('POST', f"/admin/toggle_active/{fx['spare_patient_id']}", None)),
+        ('POST main.add_department', admin, lambda i: (
+            'POST', '/admin/add_department', {'name': f'Bench {run} {i}', 'description': 'benchmark'})),
+        ('POST main.add_doctor', admin, lambda i: (
+            'POST', '/admin/add_doctor', {'name': 'Bench Doctor', 'email': f'benchdr{run}{i}@bench.hms.test',
+                                          'password': password, 'specialization_id': fx['department_id']})),
+        ('GET main.admin_view_appointment_details', admin, get(f"/admin/view_details/{fx['completed_appt_id']}")),
+        ('GET main.doctor_dashboard', doctor, get('/dashboard/doctor')),
+        ('GET main.patient_history', doctor, get(f"/doctor/patient_history/{fx['patient_id']}")),
+        ('POST main.update_availability', doctor, availability),
+        ('POST main.update_availability (weekly)', doctor, weekly),
+        ('GET main.patient_dashboard', patient, get('/dashboard/patient')),
+        ('GET main.patient_dashboard (search)', patient, get(f"/dashboard/patient?search_query={fx['doctor_name'].split()[0]}")),
+        ('GET main.book_appointment_form', patient, get(f"/patient/book_appointment/{fx['doctor_id']}")),
+        ('GET main.next_available', patient, get(f"/patient/next_available?department_id={fx['department_id']}")),
+        ('POST main.hold_slot', patient, hold),
+        ('POST main.create_appointment', patient, book),
+        ('GET main.manage_appointment', doctor, get(f"/doctor/manage_appointment/{fx['completed_appt_id']}")),
+        ('POST main.manage_appointment', doctor, each(fx['to_complete'], 'POST', '/doctor/manage_appointment/{}',
+                                                      {'diagnosis': 'Benchmark', 'prescription': 'Rest'})),
+        ('POST main.cancel_appointment', doctor, each(fx['to_cancel'], 'POST', '/doctor/cancel_appointment/{}')),
+        ('POST main.patient_cancel_appointment', patient, each(booked['/patient/create_appointment'], 'POST',
+                                                               '/patient/cancel_appointment/{}')),
+        ('GET main.view_appointment_details', patient, get(f"/patient/view_details/{fx['completed_appt_id']}")),
+        ('GET main.edit_profile_form', patient, get('/patient/edit_profile')),
+        ('POST main.edit_profile_submit', patient, lambda i: ('POST', '/patient/edit_profile', {'name': 'Bench Patient'})),
+        ('GET api.availability', patient, get(
+            f"/api/v1/availability?doctor_id={','.join(map(str, [fx['doctor_id']] + fx['other_doctor_ids']))}")),
+        ('GET api.next_available', patient, get(f"/api/v1/next_available?department_id={fx['department_id']}&from=13:00")),
+        ('GET api.appointments', patient, get('/api/v1/appointments?status=Booked')),
+        ('POST api.book_batch', patient, api_book),
+        ('POST api.cancel_batch', patient, api_cancel),
+        ('GET main.logout', None, lambda i: ('GET', '/logout', None)),
+    ], booked
+
+
+def _send(client, method, url, form):
+    if method == 'GET':
+        response = client.get(url)
+        response.get_data()   # streamed bodies are only produced here
+        return response
+    if method == 'JSON':
+        return client.post(url, json=form)
+    return client.post(url, data=form)
+
+
+def run(app, password, requests=50, warmup=5, progress=print):
+    """Benchmark every scenario. Returns {name: {n, p50_ms, p95_ms, p99_ms, queries, peak_kib}}."""
+    from extensions import db
+    from models import Appointment
+
+    total = warmup + requests + 1   # the last one is the tracemalloc run
+    with app.app_context():
+        with db.engine.connect() as conn:
+            fx = pick_fixtures(conn, total)
+        counter = QueryCounter(db.engine)
+    plan, booked = scenarios(app, fx, password)
+    results = {}
+    for name, client, request in plan:
+        timings, queries, peak = [], [], None
+        for i in range(total):
+            spec = request(i)
+            if spec is None:
+                break
+            method, url, form = spec
+            if client is None:
+                # login/logout: a fresh session each time, that's the thing measured
+                own = app.test_client()
+                if url == '/logout':
+                    own.post('/login', data={'email': fx['patient_email'], 'password': password})
+            else:
+                own = client
+            traced = i == total - 1
+            if traced:
+                tracemalloc.start()
+            counter.count = 0
+            started = time.perf_counter()
+            response = _send(own, method, url, form)
+            elapsed = time.perf_counter() - started
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: {method} {url} answered {response.status_code}")
+            if url == '/patient/create_appointment':
+                with app.app_context():
+                    appt_id = db.session.execute(db.select(Appointment.id).where(
+                        Appointment.patient_id == fx['patient_id'], Appointment.doctor_id == fx['doctor_id'],
+                        Appointment.status == 'Booked', Appointment.date == date.fromisoformat(form['appt_date']),
+                        Appointment.time == datetime.strptime(form['appt_time'], '%H:%M').time())).scalar()
+                if appt_id:
+                    booked[url].append(appt_id)
+            elif url == '/api/v1/appointments/batch':
+                booked[url].extend(result['id'] for result in response.json['results'] if result['ok'])
+            if warmup <= i and not traced:
+                timings.append(elapsed * 1000)
+                queries.append(counter.count)
+        if not timings:
+            progress(f"{name:45s} skipped (nothing to do)")
+            continue
+        results[name] = r = {
+            'n': len(timings),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'queries': percentile(queries, 50),
+            'peak_kib': round(peak / 1024, 1) if peak is not None else None,
+        }
+        progress(f"{name:45s} n={r['n']:<4d} p50 {r['p50_ms']:8.2f}  p95 {r['p95_ms']:8.2f}  "
+                 f"p99 {r['p99_ms']:8.2f} ms  queries {r['queries']:<3d} peak {r['peak_kib'] or 0:9.1f} KiB")
+    return results
+
+
+def save(results, path, meta=None):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta or {}, 'results': results}, f, indent=2, sort_keys=True)
+
+
+def compare(results, path, threshold=0.2, floor_ms=2.0):
+    """Lines describing the change against the baseline at `path`; regressions are marked.
+
+    A p95 slowdown only counts when it is over `threshold` and over `floor_ms`, so
+    scheduler jitter on the 2 ms routes isn't reported.
+    """
+    with open(path) as f:
+        baseline = json.load(f)['results']
+    lines, regressions = [], 0
+    for name in sorted(set(results) | set(baseline)):
+        new, old = results.get(name), baseline.get(name)
+        if not new or not old:
+            lines.append(f"{name:45s} {'only in baseline' if old else 'new'}")
+            continue
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0
+        slower = change > threshold and new['p95_ms'] - old['p95_ms'] > floor_ms
+        worse = slower or new['queries'] > old['queries']
+        regressions += worse
+        lines.append(f"{'!!' if worse else '  '} {name:42s} p95 {old['p95_ms']:8.2f} -> {new['p95_ms']:8.2f} ms "
+                     f"({change:+.0%})  queries {old['queries']} -> {new['queries']}")
+    return lines, regressions
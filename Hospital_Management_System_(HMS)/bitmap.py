@@ -0,0 +1,270 @@
+import math
+import time as timer
+import tracemalloc
+from datetime import date, time, timedelta
+from functools import lru_cache
+
+import availability
+import slots
+
+# slot occupancy as bitsets, for questions about many doctors and days at once:
+# the slots a set of doctors all have free, utilization per day.
+#
+# a doctor-day is an int whose bit i stands for the slot starting i * resolution
+# minutes after midnight. every doctor-day has the same width (1440 / resolution
+# bits, 48 with 30-minute slots), so combining doctors is &, | and a popcount
+# instead of intersecting lists of times. resolution is the slot interval, or a
+# finer step when someone's hours don't start on that grid.
+#
+# with numpy installed (optional, imported on first use) the same questions run
+# as array operations over a doctors x days x slots matrix, which is what makes
+# sets of hundreds of doctors cheap. without it the int bitsets answer them.
+# `flask bitmap-benchmark` compares both with the string lists of the slot engine.
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def numpy():
+    """The numpy module, or None when it isn't installed."""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _minutes(t):
+    return t.hour * 60 + t.minute
+
+
+def resolution(interval, starts):
+    """Minutes per bit: the interval, or the finer step one of the window `starts` needs."""
+    return math.gcd(interval, *(_minutes(start) for start in starts))
+
+
+@lru_cache(maxsize=1024)
+def window_bits(start, end, interval, step):
+    """The slot starts of [start, end) every `interval` minutes as a bitset. Memoized."""
+    bits = 0
+    for t in slots.slot_grid(start, end, interval):
+        bits |= 1 << (_minutes(t) // step)
+    return bits
+
+
+def time_bits(times, step):
+    # times off the grid can't be a slot, they stay out
+    bits = 0
+    for t in times:
+        if _minutes(t) % step == 0:
+            bits |= 1 << (_minutes(t) // step)
+    return bits
+
+
+def bit_times(bits, step):
+    """The times a bitset stands for, earliest first."""
+    times = []
+    while bits:
+        low = bits & -bits
+        minutes = (low.bit_length() - 1) * step
+        times.append(time(minutes // 60, minutes % 60))
+        bits ^= low
+    return times
+
+
+class Bitmap:
+    """Open and booked slots of some doctors over some dates, one bitset per doctor-day."""
+
+    def __init__(self, doctor_ids, dates, step, open_bits, booked_bits):
+        self.doctor_ids = list(doctor_ids)
+        self.dates = list(dates)
+        self.step = step
+        self.open = open_bits        # {(doctor_id, date): int}, missing = closed
+        self.booked = booked_bits    # {(doctor_id, date): int}, only bits that are open
+        self._rows = {doctor_id: n for n, doctor_id in enumerate(self.doctor_ids)}
+        self._arrays = None
+
+    @property
+    def width(self):
+        return MINUTES_PER_DAY // self.step
+
+    def free(self, doctor_id, day):
+        return self.open.get((doctor_id, day), 0) & ~self.booked.get((doctor_id, day), 0)
+
+    def arrays(self):
+        """(open, booked) as doctors x days x slots bool arrays. Needs numpy."""
+        np = numpy()
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        if self._arrays is None:
+            size = (self.width + 7) // 8
+            shape = (len(self.doctor_ids), len(self.dates), size)
+
+            def unpack(bits):
+                raw = b''.join(bits.get((doctor_id, day), 0).to_bytes(size, 'little')
+                               for doctor_id in self.doctor_ids for day in self.dates)
+                packed = np.frombuffer(raw, dtype=np.uint8).reshape(shape)
+                return np.unpackbits(packed, axis=2, bitorder='little')[:, :, :self.width].astype(bool)
+
+            self._arrays = unpack(self.open), unpack(self.booked)
+        return self._arrays
+
+    def common_free(self, doctor_ids, use_numpy=None):
+        """{date: [times]} free for every one of `doctor_ids`."""
+        if not doctor_ids:
+            return {day: [] for day in self.dates}
+        if use_numpy is None:
+            use_numpy = numpy() is not None
+        if use_numpy:
+            open_, booked = self.arrays()
+            rows = [self._rows[doctor_id] for doctor_id in doctor_ids]
+            common = (open_[rows] & ~booked[rows]).all(axis=0)
+            return {day: [time(int(i) * self.step // 60, int(i) * self.step % 60) for i in common[n].nonzero()[0]]
+                    for n, day in enumerate(self.dates)}
+        result = {}
+        for day in self.dates:
+            bits = -1
+            for doctor_id in doctor_ids:
+                bits &= self.free(doctor_id, day)
+            result[day] = bit_times(bits, self.step)
+        return result
+
+    def utilization(self, use_numpy=None):
+        """{date: booked slots / open slots} over all the doctors (0.0 on a day nobody works)."""
+        if use_numpy is None:
+            use_numpy = numpy() is not None
+        if use_numpy:
+            open_, booked = self.arrays()
+            open_count, booked_count = open_.sum(axis=(0, 2)), booked.sum(axis=(0, 2))
+            return {day: float(booked_count[n] / open_count[n]) if open_count[n] else 0.0
+                    for n, day in enumerate(self.dates)}
+        result = {}
+        for day in self.dates:
+            open_count = sum(self.open.get((doctor_id, day), 0).bit_count() for doctor_id in self.doctor_ids)
+            booked_count = sum(self.booked.get((doctor_id, day), 0).bit_count() for doctor_id in self.doctor_ids)
+            result[day] = booked_count / open_count if open_count else 0.0
+        return result
+
+
+def build(doctor_ids, dates, hours, booked, interval):
+    """Bitmap from {(doctor_id, date): availability} and {(doctor_id, date): booked times}."""
+    open_hours = {key: avail for key, avail in hours.items()
+                  if avail.is_available and avail.start_time and avail.end_time}
+    step = resolution(interval, {avail.start_time for avail in open_hours.values()})
+    open_bits = {}
+    for key, avail in open_hours.items():
+        bits = window_bits(avail.start_time, avail.end_time, interval, step)
+        if bits:
+            open_bits[key] = bits
+    booked_bits = {key: time_bits(times, step) & open_bits[key] for key, times in booked.items() if key in open_bits}
+    return Bitmap(doctor_ids, dates, step, open_bits, booked_bits)
+
+
+def load(doctor_ids, start=None, days=None, interval=None):
+    """Bitmap of the doctors' coming days from their availability and Booked appointments, three queries."""
+    start = start or date.today()
+    days = days or slots.horizon_days()
+    interval = interval or slots.interval_minutes()
+    hours = availability.by_date_many(doctor_ids, days, start)
+    booked = slots.booked_times(doctor_ids, start, days)
+    return build(doctor_ids, [start + timedelta(days=i) for i in range(days)], hours, booked, interval)
+
+
+# `flask bitmap-benchmark`
+
+def _string_lists(doctor_ids, dates, hours, booked, interval):
+    # what slots.available_slots_many builds per doctor-day, plus the grid size for utilization
+    free, open_count, booked_count = {}, {}, {}
+    for key, avail in hours.items():
+        if not avail.is_available:
+            continue
+        grid = slots.slot_grid(avail.start_time, avail.end_time, interval)
+        taken = booked.get(key, set())
+        free[key] = [t.strftime('%H:%M') for t in grid if t not in taken]
+        open_count[key] = len(grid)
+        booked_count[key] = len(grid) - len(free[key])
+    return free, open_count, booked_count
+
+
+def _string_common(free, doctor_ids, dates):
+    result = {}
+    for day in dates:
+        common = None
+        for doctor_id in doctor_ids:
+            times = set(free.get((doctor_id, day), ()))
+            common = times if common is None else common & times
+        result[day] = sorted(common or ())
+    return result
+
+
+def _string_utilization(open_count, booked_count, doctor_ids, dates):
+    result = {}
+    for day in dates:
+        total = sum(open_count.get((doctor_id, day), 0) for doctor_id in doctor_ids)
+        taken = sum(booked_count.get((doctor_id, day), 0) for doctor_id in doctor_ids)
+        result[day] = taken / total if total else 0.0
+    return result
+
+
+def _timed(fn):
+    started = timer.perf_counter()
+    value = fn()
+    return value, timer.perf_counter() - started
+
+
+def _peak(fn):
+    # a run of its own, tracemalloc slows everything down
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def _cold(fn):
+    # builds start without the memoized grids
+    def run():
+        slots.slot_grid.cache_clear()
+        window_bits.cache_clear()
+        return fn()
+    return run
+
+
+def compare(doctor_ids, start, days, interval, group_size=50):
+    """Time the three representations on the same data. Yields one dict per representation.
+
+    Each one builds its structure from the same rows (numpy's includes the
+    bitsets it is unpacked from), then answers "free slots common to the doctors"
+    for every group of `group_size` doctors on every day, and utilization per day
+    over everyone. The answers are checked against the string lists.
+    """
+    dates = [start + timedelta(days=i) for i in range(days)]
+    hours = availability.by_date_many(doctor_ids, days, start)
+    booked = slots.booked_times(doctor_ids, start, days)
+    groups = [doctor_ids[i:i + group_size] for i in range(0, len(doctor_ids), group_size)]
+
+    strings = _cold(lambda: _string_lists(doctor_ids, dates, hours, booked, interval))
+    (free, open_count, booked_count), build_s = _timed(strings)
+    expected, common_s = _timed(lambda: [_string_common(free, group, dates) for group in groups])
+    expected_use, use_s = _timed(lambda: _string_utilization(open_count, booked_count, doctor_ids, dates))
+    yield {'representation': 'string lists', 'build_s': build_s, 'build_peak_kib': _peak(strings) / 1024,
+           'common_s': common_s, 'utilization_s': use_s, 'matches': True}
+
+    def as_strings(common):
+        return [{day: [t.strftime('%H:%M') for t in times] for day, times in by_day.items()} for by_day in common]
+
+    def close(a, b):
+        return all(abs(a[day] - b[day]) < 1e-9 for day in dates)
+
+    representations = [('int bitsets', False)] + ([('numpy matrix', True)] if numpy() is not None else [])
+    for name, use_numpy in representations:
+        def make():
+            bm = build(doctor_ids, dates, hours, booked, interval)
+            if use_numpy:
+                bm.arrays()
+            return bm
+        bm, build_s = _timed(_cold(make))
+        common, common_s = _timed(lambda: [bm.common_free(group, use_numpy) for group in groups])
+        use, use_s = _timed(lambda: bm.utilization(use_numpy))
+        yield {'representation': name, 'build_s': build_s, 'build_peak_kib': _peak(_cold(make)) / 1024,
+               'common_s': common_s, 'utilization_s': use_s,
+               'matches': as_strings(common) == expected and close(use, expected_use)}
@@ -0,0 +1,147 @@
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+
+from cache import cache, user_tag
+from extensions import db
+from models import User, Appointment, SlotHold
+import availability
+import slots
+
+# race-free booking.
+# the database decides who gets a slot: uq_appointments_active_slot allows one
+# Booked row per (doctor_id, date, time), so of any number of concurrent inserts
+# exactly one commits and the rest get an IntegrityError, reported as "slot taken".
+# book() and hold_slot() read before they write, so they run under BEGIN IMMEDIATE
+# (write_transaction): concurrent bookers queue for the write lock and the losers
+# find the slot taken, instead of failing with "database is locked".
+# an optional hold (SLOT_HOLD_SECONDS, 0 disables) reserves the slot while the
+# patient confirms so two people aren't both walked through the same booking.
+
+DEFAULT_HOLD_SECONDS = 300
+
+
+class BookingError(Exception):
+    """The slot can't be booked; the message is safe to show to the patient."""
+
+
+class SlotTaken(BookingError):
+    pass
+
+
+def hold_seconds():
+    return current_app.config.get('SLOT_HOLD_SECONDS', DEFAULT_HOLD_SECONDS)
+
+
+def write_transaction(session):
+    """Start the session's next transaction with BEGIN IMMEDIATE, for read-then-write work.
+
+    A plain BEGIN reads from a snapshot and only asks for the write lock at the
+    first write. Under WAL, if another writer committed in between, sqlite can't
+    upgrade the snapshot and gives up at once with "database is locked", busy
+    timeout or not. Taking the lock up front makes concurrent bookers queue on the
+    busy timeout instead, and the second one sees the first one's row. Whatever
+    the session has open is committed first.
+    """
+    session.commit()
+    # database.install_transactions turns the option into BEGIN IMMEDIATE
+    session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
+
+
+def check_bookable(doctor_id, day, time, today=None):
+    """Raise BookingError unless `time` on `day` is a slot in the doctor's availability."""
+    today = today or date.today()
+    doctor = User.query.filter_by(id=doctor_id, role='doctor', active=True).first()
+    if not doctor:
+        raise BookingError("That doctor is not taking appointments.")
+    if not today <= day < today + timedelta(days=slots.horizon_days()):
+        raise BookingError("Appointments can only be booked for the coming days shown.")
+    avail = availability.by_date(doctor_id, 1, day).get(day)
+    if not avail or not avail.is_available:
+        raise BookingError("The doctor is not available on that day.")
+    if time not in slots.slot_grid(avail.start_time, avail.end_time, slots.interval_minutes()):
+        raise BookingError("That time is outside the doctor's available hours.")
+
+
+def live_hold(doctor_id, day, time, now=None):
+    now = now or datetime.utcnow()
+    return SlotHold.query.filter(
+        SlotHold.doctor_id == doctor_id,
+        SlotHold.date == day,
+        SlotHold.time == time,
+        SlotHold.expires_at > now
+    ).first()
+
+
+def hold_slot(patient_id, doctor_id, day, time, now=None):
+    """Reserve the slot for `patient_id`. Returns the expiry, raises BookingError/SlotTaken.
+
+    A single upsert takes the hold when it is free, expired, or already ours, so
+    two patients racing for it can't both succeed.
+    """
+    now = now or datetime.utcnow()
+    write_transaction(db.session)
+    try:
+        check_bookable(doctor_id, day, time)
+        if Appointment.query.filter_by(doctor_id=doctor_id, date=day, time=time, status="Booked").first():
+            raise SlotTaken("Sorry, this time slot is already booked.")
+    except BookingError:
+        # let go of the write lock
+        db.session.rollback()
+        raise
+
+    expires_at = now + timedelta(seconds=hold_seconds())
+    stmt = insert(SlotHold).values(
+        doctor_id=doctor_id, date=day, time=time, patient_id=patient_id, expires_at=expires_at
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SlotHold.doctor_id, SlotHold.date, SlotHold.time],
+        set_={'patient_id': stmt.excluded.patient_id, 'expires_at': stmt.excluded.expires_at},
+        where=(SlotHold.expires_at <= now) | (SlotHold.patient_id == stmt.excluded.patient_id)
+    )
+    acquired = db.session.execute(stmt).rowcount == 1
+    # expired holds are dead weight, sweep them while we hold the write lock anyway
+    db.session.execute(db.delete(SlotHold).where(SlotHold.expires_at <= now))
+    db.session.commit()
+    if not acquired:
+        raise SlotTaken("Someone else is booking this slot right now, please pick another.")
+    return expires_at
+
+
+def add_booking(patient_id, doctor_id, day, time, now=None):
+    """Flush a Booked appointment without committing. Raises BookingError/SlotTaken.
+
+    The insert runs in a savepoint, so a lost race only undoes this booking and
+    the caller's transaction (e.g. the rest of an API batch) carries on.
+    """
+    now = now or datetime.utcnow()
+    check_bookable(doctor_id, day, time)
+    holder = live_hold(doctor_id, day, time, now)
+    if holder and holder.patient_id != patient_id:
+        raise SlotTaken("Someone else is booking this slot right now, please pick another.")
+
+    appt = Appointment(patient_id=patient_id, doctor_id=doctor_id, date=day, time=time, status="Booked")
+    try:
+        with db.session.begin_nested():
+            db.session.add(appt)
+    except IntegrityError:
+        raise SlotTaken("Sorry, this time slot was just taken.")
+    db.session.execute(db.delete(SlotHold).where(
+        SlotHold.doctor_id == doctor_id, SlotHold.date == day, SlotHold.time == time
+    ))
+    return appt
+
+
+def book(patient_id, doctor_id, day, time, now=None):
+    """Create a Booked appointment and commit. Raises BookingError/SlotTaken."""
+    write_transaction(db.session)
+    try:
+        appt = add_booking(patient_id, doctor_id, day, time, now)
+    except BookingError:
+        db.session.rollback()
+        raise
+    db.session.commit()
+    cache.invalidate(user_tag(patient_id), user_tag(doctor_id))
+    return appt
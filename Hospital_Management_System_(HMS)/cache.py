@@ -0,0 +1,279 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+from werkzeug.local import LocalProxy
+
+# response cache for the per-user dashboards.
+#
+# entries are rendered pages keyed by view, user and query string. each entry also
+# carries tags naming whose data it shows ("user:12", "doctors"), and the write paths
+# call invalidate() with the tags they touched, which drops exactly those entries.
+# the backend is pluggable:
+#   memory  one LRU+TTL dict per process, fine for a single worker
+#   sqlite  a small shared file, so several gunicorn workers see each other's
+#           invalidations
+#   none    caching off
+# a backend failure is never allowed to fail the request, it just counts as a miss.
+#
+# every app gets its own PageCache (init_app), `cache` is the current app's.
+
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # key -> (value, expires_at, tags)
+        self.by_tag = {}               # tag -> set of keys
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl, tags=()):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, time.time() + ttl, tuple(tags))
+            for tag in tags:
+                self.by_tag.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.by_tag.get(tag, ())):
+                    self._drop(key)
+
+    def size(self):
+        return len(self.entries)
+
+    def _drop(self, key):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[tag]
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.evictions = 0
+        self.local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                expires_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed_at ON cache_entries (accessed_at)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache_tags (
+                tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key)) WITHOUT ROWID""")
+
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?",
+                           (key,)).fetchone()
+        if row is None or row[1] < now:
+            return None
+        # LRU bookkeeping costs a write, so only refresh entries that have gone a while unread
+        if now - row[2] > 5:
+            conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl, tags=()):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("""INSERT INTO cache_entries (key, value, expires_at, accessed_at)
+                VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET
+                value = excluded.value, expires_at = excluded.expires_at, accessed_at = excluded.accessed_at""",
+                (key, json.dumps(value), now + ttl, now))
+            conn.executemany("INSERT OR IGNORE INTO cache_tags (tag, key) VALUES (?, ?)",
+                             [(tag, key) for tag in tags])
+            self._writes += 1
+            if self._writes % 64 == 0:
+                self._trim(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, tags):
+        conn = self._connect()
+        placeholders = ", ".join("?" for _ in tags)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"""DELETE FROM cache_entries WHERE key IN
+                (SELECT key FROM cache_tags WHERE tag IN ({placeholders}))""", tuple(tags))
+            conn.execute(f"DELETE FROM cache_tags WHERE tag IN ({placeholders})", tuple(tags))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+    def _trim(self, conn, now):
+        conn.execute("DELETE FROM cache_entries WHERE expires_at < ?", (now,))
+        over = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0] - self.max_entries
+        if over > 0:
+            conn.execute("""DELETE FROM cache_entries WHERE key IN
+                (SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)""", (over,))
+            self.evictions += over
+        conn.execute("DELETE FROM cache_tags WHERE key NOT IN (SELECT key FROM cache_entries)")
+
+
+class PageCache:
+    def __init__(self, kind='memory', max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None):
+        self.ttl = ttl
+        self.lookups = Counter()   # (kind, 'hits'/'misses') -> n, kind is the key's prefix
+        self.errors = 0
+        if kind == 'memory':
+            self.backend = MemoryBackend(max_entries)
+        elif kind == 'sqlite':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.backend = SQLiteBackend(path, max_entries)
+        elif kind == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"unknown CACHE_BACKEND {kind!r}")
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            self.errors += 1
+            value = None
+        kind = key.split(':', 1)[0]
+        self.lookups[kind, 'misses' if value is None else 'hits'] += 1
+        return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        if self.backend is None:
+            return
+        try:
+            self.backend.set(key, value, ttl or self.ttl, tags)
+        except Exception:
+            self.errors += 1
+
+    def invalidate(self, *tags):
+        tags = [tag for tag in tags if tag]
+        if self.backend is None or not tags:
+            return
+        try:
+            self.backend.invalidate(tags)
+        except Exception:
+            self.errors += 1
+
+    def stats(self):
+        kinds = {}
+        for kind in sorted({kind for kind, _ in self.lookups}):
+            hits, misses = self.lookups[kind, 'hits'], self.lookups[kind, 'misses']
+            kinds[kind] = {'hits': hits, 'misses': misses,
+                           'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None}
+        return {
+            'backend': self.backend.name if self.backend else 'none',
+            'lookups': kinds,
+            'errors': self.errors,
+            'entries': self.backend.size() if self.backend else 0,
+            'evictions': self.backend.evictions if self.backend else 0,
+            'ttl_seconds': self.ttl,
+        }
+
+
+def init_app(app):
+    """Give `app` a page cache of its own, from CACHE_BACKEND and the CACHE_* settings."""
+    app.extensions['page_cache'] = PageCache(
+        app.config.get('CACHE_BACKEND', 'memory'),
+        app.config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+        app.config.get('CACHE_TTL_SECONDS', DEFAULT_TTL),
+        app.config.get('CACHE_SQLITE_PATH') or os.path.join(app.instance_path, 'cache.sqlite'))
+
+
+# the current app's PageCache
+cache = LocalProxy(lambda: current_app.extensions['page_cache'])
+
+
+def user_tag(user_id):
+    return f"user:{user_id}"
+
+
+DOCTOR_DIRECTORY = "doctors"
+
+
+def history_tag(patient_id):
+    return f"history:{patient_id}"
+
+
+# on every cached visit history, so a bulk import can drop them all at once
+HISTORY = "history"
+
+
+def add_tags(*tags):
+    """Inside a cached view: the page being rendered also shows data for `tags`."""
+    if g.get('cache_tags') is not None:
+        g.cache_tags.update(tags)
+
+
+def cached_page(view):
+    """Serve the view's rendered page from the cache, per user and query string.
+
+    Only plain GET renders are cached. A pending flash message bypasses the cache
+    both ways, since it's part of the page and meant to be shown exactly once.
+    """
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if cache.backend is None or request.method != 'GET' or session.get('_flashes'):
+            return view(*args, **kwargs)
+        key = f"page:{view.__name__}:{current_user.id}:{request.full_path}"
+        page = cache.get(key)
+        if page is not None:
+            return page
+        g.cache_tags = {user_tag(current_user.id)}
+        rv = view(*args, **kwargs)
+        tags, g.cache_tags = g.cache_tags, None
+        if isinstance(rv, str):
+            cache.set(key, rv, tags)
+        return rv
+    return wrapped
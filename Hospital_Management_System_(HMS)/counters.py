@@ -0,0 +1,149 @@
+from collections import Counter
+
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session
+
+from models import User, Appointment
+
+# maintained totals for the admin dashboard, so it reads one small table instead
+# of running COUNT(*) over users and appointments on every load.
+#
+#   patients.active / doctors.active      active users by role
+#   appointments.total
+#   appointments.status.<status>          e.g. appointments.status.Booked
+#   appointments.department.<dept id>     by the doctor's department (0 = none)
+#
+# the after_flush hook below turns every insert/update/delete of a User or an
+# Appointment into deltas and applies them on the flush's connection, so the
+# counters commit or roll back together with the rows. code that changes rows
+# with bulk UPDATEs bypasses the ORM and must call adjust() itself.
+# `flask reconcile-counters` recomputes everything from scratch. archived
+# appointments (archive.py) still count.
+
+ACTIVE_ROLES = ('patient', 'doctor')
+
+
+def active_key(role):
+    return f"{role}s.active"
+
+
+def status_key(status):
+    return f"appointments.status.{status}"
+
+
+def department_key(dept_id):
+    return f"appointments.department.{dept_id or 0}"
+
+
+def adjust(connection, deltas):
+    for name, delta in deltas.items():
+        if delta:
+            connection.execute(text("""
+                INSERT INTO counters (name, value) VALUES (:name, :delta)
+                ON CONFLICT (name) DO UPDATE SET value = value + excluded.value"""),
+                {'name': name, 'delta': delta})
+
+
+def read_all(connection):
+    return dict(connection.execute(text("SELECT name, value FROM counters")).all())
+
+
+def reconcile(connection):
+    """Throw the counters away and recompute them from the tables. Returns the new values."""
+    values = Counter()
+    for role, count in connection.execute(text(
+            "SELECT role, COUNT(*) FROM users WHERE active = 1 GROUP BY role")):
+        if role in ACTIVE_ROLES:
+            values[active_key(role)] = count
+    for status, dept_id, count in connection.execute(text("""
+            SELECT appointments.status, users.specialization_id, COUNT(*)
+            FROM (SELECT status, doctor_id FROM appointments
+                  UNION ALL SELECT status, doctor_id FROM appointments_archive) AS appointments
+            LEFT JOIN users ON users.id = appointments.doctor_id
+            GROUP BY appointments.status, users.specialization_id""")):
+        values['appointments.total'] += count
+        values[status_key(status)] += count
+        values[department_key(dept_id)] += count
+
+    connection.execute(text("DELETE FROM counters"))
+    for name, value in values.items():
+        connection.execute(text("INSERT INTO counters (name, value) VALUES (:name, :value)"),
+                           {'name': name, 'value': value})
+    return dict(values)
+
+
+def _old(state, key):
+    # value before this flush (falls back to the current one if it didn't change)
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, key)
+
+
+def _user_deltas(session, deltas):
+    for user in session.new:
+        if isinstance(user, User) and user.role in ACTIVE_ROLES and user.active:
+            deltas[active_key(user.role)] += 1
+    for user in session.dirty:
+        if not isinstance(user, User):
+            continue
+        state = inspect(user)
+        if not (state.attrs.active.history.has_changes() or state.attrs.role.history.has_changes()):
+            continue
+        old_role, old_active = _old(state, 'role'), _old(state, 'active')
+        if old_role in ACTIVE_ROLES and old_active:
+            deltas[active_key(old_role)] -= 1
+        if user.role in ACTIVE_ROLES and user.active:
+            deltas[active_key(user.role)] += 1
+    for user in session.deleted:
+        if isinstance(user, User) and user.role in ACTIVE_ROLES and _old(inspect(user), 'active'):
+            deltas[active_key(user.role)] -= 1
+
+
+def _appointment_deltas(session, connection, deltas):
+    new = [a for a in session.new if isinstance(a, Appointment)]
+    deleted = [a for a in session.deleted if isinstance(a, Appointment)]
+    changed = [a for a in session.dirty if isinstance(a, Appointment)
+               and inspect(a).attrs.status.history.has_changes()]
+    for appt in changed:
+        deltas[status_key(_old(inspect(appt), 'status'))] -= 1
+        deltas[status_key(appt.status)] += 1
+    if not new and not deleted:
+        return
+
+    doctor_ids = {a.doctor_id for a in new + deleted}
+    departments = dict(connection.execute(
+        text("SELECT id, specialization_id FROM users WHERE id IN :ids").bindparams(
+            bindparam('ids', expanding=True)), {'ids': list(doctor_ids)}
+    ).all())
+    for appt, sign in [(a, 1) for a in new] + [(a, -1) for a in deleted]:
+        deltas['appointments.total'] += sign
+        deltas[status_key(_old(inspect(appt), 'status') if sign < 0 else appt.status)] += sign
+        deltas[department_key(departments.get(appt.doctor_id))] += sign
+
+
+def _doctor_moves(session, connection, deltas):
+    # a doctor changing department takes their appointment counts along
+    # (appointments inserted in this same flush were already counted under the new one)
+    new_by_doctor = Counter(a.doctor_id for a in session.new if isinstance(a, Appointment))
+    for user in session.dirty:
+        if not isinstance(user, User):
+            continue
+        history = inspect(user).attrs.specialization_id.history
+        if not history.has_changes():
+            continue
+        count = connection.execute(
+            text("SELECT COUNT(*) FROM appointments WHERE doctor_id = :id"), {'id': user.id}
+        ).scalar() - new_by_doctor[user.id]
+        deltas[department_key(history.deleted[0] if history.deleted else None)] -= count
+        deltas[department_key(user.specialization_id)] += count
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_counts(session, flush_context):
+    deltas = Counter()
+    connection = session.connection()
+    _user_deltas(session, deltas)
+    _appointment_deltas(session, connection, deltas)
+    _doctor_moves(session, connection, deltas)
+    adjust(connection, deltas)
@@ -0,0 +1,186 @@
+import os
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+# database settings per deployment profile, picked from the environment:
+#
+#   DATABASE_URL     sqlalchemy url (default sqlite:///hospital.db, i.e. instance/hospital.db)
+#   HMS_DB_PROFILE   development (default) | production | test | baseline
+#
+# for sqlite every new connection gets the profile's PRAGMAs. the ones that matter
+# under several gunicorn workers:
+#   journal_mode=WAL      readers no longer block on the writer and vice versa
+#   synchronous=NORMAL    with WAL only the checkpoint fsyncs, still crash-safe
+#   busy_timeout          wait for the write lock instead of failing at once with
+#                         "database is locked"
+# "baseline" applies nothing and is only there to measure against
+# (flask db-loadtest).
+
+BASE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'foreign_keys': 'ON',
+}
+
+PROFILES = {
+    'development': {
+        'pragmas': BASE_PRAGMAS,
+        'engine': {},
+    },
+    'production': {
+        'pragmas': dict(BASE_PRAGMAS,
+                        busy_timeout=10000,
+                        cache_size=-65536,        # 64 MiB page cache per connection
+                        mmap_size=268435456,      # 256 MiB memory-mapped reads
+                        temp_store='MEMORY'),
+        # one connection per worker thread, with a little headroom for the odd burst
+        'engine': {'pool_size': 8, 'max_overflow': 8, 'pool_timeout': 10, 'pool_recycle': 3600},
+    },
+    'test': {
+        # throwaway databases, durability doesn't matter
+        'pragmas': {'journal_mode': 'MEMORY', 'synchronous': 'OFF', 'foreign_keys': 'ON'},
+        'engine': {},
+    },
+    'baseline': {
+        'pragmas': {},
+        'engine': {},
+    },
+}
+
+DEFAULT_URL = 'sqlite:///hospital.db'
+
+
+def configure(app):
+    """Fill the SQLALCHEMY_* settings from the profile. Values already in app.config win."""
+    profile = app.config.get('HMS_DB_PROFILE') or os.environ.get('HMS_DB_PROFILE', 'development')
+    if profile not in PROFILES:
+        raise ValueError(f"unknown HMS_DB_PROFILE {profile!r}, expected one of {', '.join(PROFILES)}")
+    settings = PROFILES[profile]
+    app.config['HMS_DB_PROFILE'] = profile
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', os.environ.get('DATABASE_URL', DEFAULT_URL))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict(settings['engine']))
+    app.config.setdefault('SQLITE_PRAGMAS', dict(settings['pragmas']))
+
+
+def install_pragmas(engine, pragmas):
+    """Run `pragmas` on every new DBAPI connection of a sqlite `engine`."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name} = {value}")
+        cur.close()
+
+
+def install_transactions(engine):
+    """Let sqlalchemy, not the sqlite3 module, decide when a transaction begins.
+
+    The module only sends BEGIN before the first write, so a SAVEPOINT after a few
+    SELECTs opens the transaction itself and releasing it commits everything so far.
+    Batches that rely on rolling back one item (booking.add_booking) need the real
+    BEGIN to come first. A connection with the execution option
+    sqlite_begin='IMMEDIATE' gets BEGIN IMMEDIATE, see booking.write_transaction().
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _autocommit(dbapi_conn, connection_record):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _begin(conn):
+        # straight to the driver, so the query counters don't see it
+        mode = conn.get_execution_options().get('sqlite_begin')
+        conn.connection.driver_connection.execute(f"BEGIN {mode}" if mode else "BEGIN")
+
+
+def init_engine(app, engine):
+    # called once db.engine exists, before anything connects
+    install_pragmas(engine, app.config.get('SQLITE_PRAGMAS'))
+    install_transactions(engine)
+
+
+def current_pragmas(connection, names=None):
+    names = names or sorted(set(BASE_PRAGMAS) | set(PROFILES['production']['pragmas']))
+    return {name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in names}
+
+
+def snapshot(source, path):
+    """Copy the sqlite database at `source` to `path` (online backup, safe while in use)."""
+    import sqlite3
+    src, dst = sqlite3.connect(source), sqlite3.connect(path)
+    try:
+        src.backup(dst)
+        # a plain rollback-journal file, whoever opens it applies their own journal_mode
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        src.close()
+        dst.close()
+
+
+def _loadtest_worker(args):
+    path, profile, role, seconds, seed = args
+    engine = create_engine(f"sqlite:///{path}", **PROFILES[profile]['engine'])
+    install_pragmas(engine, PROFILES[profile]['pragmas'])
+    with engine.connect() as conn:
+        doctors = [row[0] for row in conn.exec_driver_sql("SELECT id FROM users WHERE role = 'doctor'")] or [0]
+    today = date.today().isoformat()
+    done = errors = 0
+    i = seed
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        i += 1
+        try:
+            if role == 'write':
+                with engine.begin() as conn:
+                    conn.exec_driver_sql("INSERT INTO loadtest_writes (worker, n) VALUES (?, ?)", (seed, i))
+            else:
+                with engine.connect() as conn:
+                    conn.exec_driver_sql("""SELECT id, patient_id, date, time, status FROM appointments
+                        WHERE doctor_id = ? AND date >= ? ORDER BY date, time LIMIT 50""",
+                        (doctors[i % len(doctors)], today)).all()
+            done += 1
+        except OperationalError:
+            # "database is locked"
+            errors += 1
+    engine.dispose()
+    return role, done, errors
+
+
+def loadtest(source, profile, readers=4, writers=2, seconds=5.0):
+    """Hammer a copy of the sqlite file `source` from separate processes.
+
+    Returns {'reads/s', 'writes/s', 'errors'} for `profile`. The copy lives in a
+    temp dir, the real database is only read once to take it.
+    """
+    import multiprocessing, shutil, sqlite3, tempfile
+    workdir = tempfile.mkdtemp(prefix="hms-loadtest-")
+    path = os.path.join(workdir, "loadtest.db")
+    try:
+        snapshot(source, path)
+        dst = sqlite3.connect(path)
+        dst.execute("CREATE TABLE loadtest_writes (id INTEGER PRIMARY KEY, worker INTEGER, n INTEGER)")
+        dst.commit()
+        dst.close()
+
+        jobs = [(path, profile, 'read', seconds, n) for n in range(readers)]
+        jobs += [(path, profile, 'write', seconds, readers + n) for n in range(writers)]
+        with multiprocessing.get_context().Pool(len(jobs)) as pool:
+            results = pool.map(_loadtest_worker, jobs)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    totals = {'read': 0, 'write': 0}
+    errors = 0
+    for role, done, failed in results:
+        totals[role] += done
+        errors += failed
+    return {'reads/s': totals['read'] / seconds, 'writes/s': totals['write'] / seconds, 'errors': errors}
@@ -1,4 +1,9 @@
+from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 
 # shared DB instance used by app and models to avoid circular imports
 db = SQLAlchemy()
+
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
+login_manager.login_message_category = 'danger'
@@ -0,0 +1,241 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import Appointment, AvailabilityTemplate, DoctorAvailability
+import availability
+import slots
+
+# precomputed free slots, for "next available" across a department or a search.
+#
+# free_slots holds one row per open (doctor, date, time) of the booking horizon:
+# the slot grid of the doctor's effective hours (availability.py) minus their
+# Booked appointments. the earliest slots of any set of doctors are then one walk
+# of the (date, time, doctor_id) primary key, stopping at the limit, instead of
+# the slot engine run doctor by doctor. holds are short-lived and per patient, so
+# they stay out of the table and are filtered when searching.
+#
+# free_slot_days lists the dates that are indexed, and the slot interval they were
+# built with. ensure() builds the horizon's missing dates for every doctor (the
+# first search of a day pays for one new date, the worker usually got there
+# first) and drops the past ones. after that the after_flush hook at the bottom
+# keeps the indexed dates in step: every flush that books, cancels, moves or
+# closes an appointment, or changes a template or an exception, recomputes the
+# affected doctor-days on the flush's connection, so the index commits or rolls
+# back with the change. code that writes those tables with raw SQL (seed-data,
+# import-data) calls reset() and the next ensure() rebuilds.
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+# doctors per query when building whole days
+BUILD_CHUNK = 500
+
+
+def _clock(value):
+    return value.strftime('%H:%M:%S')
+
+
+def _free(connection, doctor_ids, dates, interval):
+    """[(doctor_id, date, time)] open on `dates`, holds not counted."""
+    start, end = min(dates), max(dates)
+    templates = connection.execute(db.select(
+        AvailabilityTemplate.doctor_id, AvailabilityTemplate.weekday, AvailabilityTemplate.start_time,
+        AvailabilityTemplate.end_time, AvailabilityTemplate.is_available
+    ).where(AvailabilityTemplate.doctor_id.in_(doctor_ids))).all()
+    exceptions = connection.execute(db.select(
+        DoctorAvailability.doctor_id, DoctorAvailability.date, DoctorAvailability.start_time,
+        DoctorAvailability.end_time, DoctorAvailability.is_available
+    ).where(DoctorAvailability.doctor_id.in_(doctor_ids), DoctorAvailability.date.between(start, end))).all()
+    booked = {tuple(row) for row in connection.execute(db.select(
+        Appointment.doctor_id, Appointment.date, Appointment.time
+    ).where(Appointment.doctor_id.in_(doctor_ids), Appointment.status == "Booked", Appointment.date.between(start, end)))}
+    rows = []
+    for (doctor_id, day), avail in availability.merge(templates, exceptions, doctor_ids, dates).items():
+        if avail.is_available:
+            rows.extend((doctor_id, day, t) for t in slots.slot_grid(avail.start_time, avail.end_time, interval)
+                        if (doctor_id, day, t) not in booked)
+    return rows
+
+
+def _insert(connection, rows):
+    if rows:
+        connection.execute(text("INSERT OR IGNORE INTO free_slots (date, time, doctor_id) VALUES (:date, :time, :doctor_id)"),
+                           [{'date': day.isoformat(), 'time': _clock(t), 'doctor_id': doctor_id}
+                            for doctor_id, day, t in rows])
+
+
+def _build_days(connection, dates, interval):
+    # every doctor, active or not: the search filters on users.active, so
+    # reactivating a doctor needs no rebuild
+    doctor_ids = connection.execute(text("SELECT id FROM users WHERE role = 'doctor' ORDER BY id")).scalars().all()
+    built = 0
+    for i in range(0, len(doctor_ids), BUILD_CHUNK):
+        rows = _free(connection, doctor_ids[i:i + BUILD_CHUNK], dates, interval)
+        _insert(connection, rows)
+        built += len(rows)
+    return built
+
+
+def refresh(connection, pairs, interval):
+    """Recompute the given (doctor_id, date) pairs, those on indexed dates. The caller commits."""
+    dates = sorted({day for _, day in pairs})
+    if not dates:
+        return
+    indexed = {date.fromisoformat(d) for d in connection.execute(
+        text("SELECT date FROM free_slot_days WHERE date IN :dates").bindparams(bindparam('dates', expanding=True)),
+        {'dates': [d.isoformat() for d in dates]}).scalars()}
+    pairs = {(doctor_id, day) for doctor_id, day in pairs if day in indexed}
+    if not pairs:
+        return
+    connection.execute(text("DELETE FROM free_slots WHERE doctor_id = :doctor_id AND date = :date"),
+                       [{'doctor_id': doctor_id, 'date': day.isoformat()} for doctor_id, day in pairs])
+    doctor_ids = sorted({doctor_id for doctor_id, _ in pairs})
+    rows = _free(connection, doctor_ids, sorted({day for _, day in pairs}), interval)
+    _insert(connection, [row for row in rows if (row[0], row[1]) in pairs])
+
+
+def is_current(connection, today, days, interval):
+    return connection.execute(text("""
+        SELECT COUNT(*) FROM free_slot_days WHERE date BETWEEN :start AND :end AND slot_minutes = :interval"""),
+        {'start': today.isoformat(), 'end': (today + timedelta(days=days - 1)).isoformat(),
+         'interval': interval}).scalar() == days
+
+
+def ensure(engine, today=None, days=None, interval=None):
+    """Index the horizon's missing dates and drop the past ones. Returns how many dates were built."""
+    today = today or date.today()
+    days = days or slots.horizon_days()
+    interval = interval or slots.interval_minutes()
+    with engine.connect() as conn:
+        if is_current(conn, today, days, interval):
+            return 0
+    with engine.begin() as conn:
+        # writes first: whoever inserts a date's free_slot_days row builds it, so
+        # two workers or requests never build the same date twice
+        stale = conn.execute(text("""
+            DELETE FROM free_slot_days WHERE date < :today OR slot_minutes != :interval RETURNING date"""),
+            {'today': today.isoformat(), 'interval': interval}).scalars().all()
+        conn.execute(text("DELETE FROM free_slots WHERE date < :today"), {'today': today.isoformat()})
+        if stale:
+            conn.execute(text("DELETE FROM free_slots WHERE date IN :dates").bindparams(
+                bindparam('dates', expanding=True)), {'dates': stale})
+        mine = []
+        for i in range(days):
+            day = today + timedelta(days=i)
+            if conn.execute(text("""
+                    INSERT OR IGNORE INTO free_slot_days (date, slot_minutes, built_at) VALUES (:date, :interval, :now)"""),
+                    {'date': day.isoformat(), 'interval': interval, 'now': datetime.utcnow().isoformat(sep=' ')}).rowcount:
+                mine.append(day)
+        if mine:
+            _build_days(conn, mine, interval)
+    return len(mine)
+
+
+def reset(connection):
+    """Forget the whole index (after raw SQL writes); the next ensure() rebuilds it."""
+    connection.execute(text("DELETE FROM free_slots"))
+    connection.execute(text("DELETE FROM free_slot_days"))
+
+
+def earliest(engine, doctor_ids=None, department_id=None, start_time=None, end_time=None,
+             limit=DEFAULT_LIMIT, patient_id=None, today=None, days=None, now=None):
+    """The first `limit` open slots of active doctors, soonest first.
+
+    Narrowed to `doctor_ids` and/or a department, and to slots starting in
+    [start_time, end_time) when given. Slots under someone else's hold are left
+    out, `patient_id`'s own holds stay in. Call ensure() first.
+    Returns dicts with doctor_id, doctor, department, date and time.
+    """
+    today = today or date.today()
+    days = days or slots.horizon_days()
+    params = {'start': today.isoformat(), 'end': (today + timedelta(days=days - 1)).isoformat(),
+              'now': (now or datetime.utcnow()).isoformat(sep=' '), 'patient_id': patient_id or 0, 'limit': limit}
+    where = []
+    if doctor_ids is not None:
+        if not doctor_ids:
+            return []
+        where.append("AND f.doctor_id IN :doctor_ids")
+        params['doctor_ids'] = list(doctor_ids)
+    if department_id is not None:
+        where.append("AND users.specialization_id = :department_id")
+        params['department_id'] = department_id
+    if start_time:
+        where.append("AND f.time >= :start_time")
+        params['start_time'] = _clock(start_time)
+    if end_time:
+        where.append("AND f.time < :end_time")
+        params['end_time'] = _clock(end_time)
+    query = text(f"""
+        SELECT f.doctor_id, users.name, departments.name, f.date, f.time
+        FROM free_slots AS f
+        JOIN users ON users.id = f.doctor_id AND users.active = 1
+        LEFT JOIN departments ON departments.id = users.specialization_id
+        WHERE f.date BETWEEN :start AND :end {' '.join(where)}
+          AND NOT EXISTS (SELECT 1 FROM slot_holds AS h
+                          WHERE h.doctor_id = f.doctor_id AND h.date = f.date AND h.time = f.time
+                            AND h.expires_at > :now AND h.patient_id != :patient_id)
+        ORDER BY f.date, f.time, f.doctor_id
+        LIMIT :limit""")
+    if doctor_ids is not None:
+        query = query.bindparams(bindparam('doctor_ids', expanding=True))
+    # a short read of its own, like the ledger: ensure() may just have committed
+    with engine.connect() as conn:
+        rows = conn.execute(query, params).all()
+    return [{'doctor_id': doctor_id, 'doctor': name, 'department': department,
+             'date': date.fromisoformat(day), 'time': t[:5]} for doctor_id, name, department, day, t in rows]
+
+
+# keeping the indexed dates in step with the ORM writes
+
+def _was(state, key):
+    # value before this flush (the current one if it didn't change)
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(state.object, key)
+
+
+def _touched(session):
+    """What this flush may change: slots just booked, (doctor_id, date) pairs and whole doctors."""
+    taken, pairs, doctors = set(), set(), set()
+    for obj in session.new:
+        if isinstance(obj, Appointment) and obj.status == "Booked":
+            # the common case, a new booking only takes its own slot
+            taken.add((obj.doctor_id, obj.date, obj.time))
+        elif isinstance(obj, DoctorAvailability):
+            pairs.add((obj.doctor_id, obj.date))
+        elif isinstance(obj, AvailabilityTemplate):
+            doctors.add(obj.doctor_id)
+    for obj in session.dirty:
+        if isinstance(obj, (Appointment, DoctorAvailability)):
+            state = inspect(obj)
+            keys = ('status', 'doctor_id', 'date', 'time') if isinstance(obj, Appointment) else \
+                ('doctor_id', 'date', 'start_time', 'end_time', 'is_available')
+            if any(state.attrs[key].history.has_changes() for key in keys):
+                pairs.add((_was(state, 'doctor_id'), _was(state, 'date')))
+                pairs.add((obj.doctor_id, obj.date))
+        elif isinstance(obj, AvailabilityTemplate):
+            doctors.add(obj.doctor_id)
+    for obj in session.deleted:
+        if isinstance(obj, (Appointment, DoctorAvailability)):
+            state = inspect(obj)
+            pairs.add((_was(state, 'doctor_id'), _was(state, 'date')))
+        elif isinstance(obj, AvailabilityTemplate):
+            doctors.add(obj.doctor_id)
+    return taken, pairs, doctors
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_free_slots(session, flush_context):
+    taken, pairs, doctors = _touched(session)
+    if not taken and not pairs and not doctors:
+        return
+    connection = session.connection()
+    if taken:
+        connection.execute(text("DELETE FROM free_slots WHERE date = :date AND time = :time AND doctor_id = :doctor_id"),
+                           [{'date': day.isoformat(), 'time': _clock(t), 'doctor_id': doctor_id}
+                            for doctor_id, day, t in taken])
+    if doctors:
+        indexed = [date.fromisoformat(d) for d in connection.execute(text("SELECT date FROM free_slot_days")).scalars()]
+        pairs |= {(doctor_id, day) for doctor_id in doctors for day in indexed}
+    refresh(connection, pairs, slots.interval_minutes())
@@ -0,0 +1,87 @@
+import os
+
+from flask import current_app
+from flask_login import UserMixin
+from werkzeug.local import LocalProxy
+
+from cache import PageCache, user_tag
+from extensions import db
+from models import User
+
+# what flask-login's user_loader hands back on every request.
+#
+# the few fields the routes check (role, active, name, specialization) are kept
+# in a cache for IDENTITY_TTL_SECONDS, so a warm request doesn't SELECT the user
+# at all. anything else (email, age, address, relationships ...) loads the full row
+# on first use. the writes to those fields (toggle_active, edit_doctor_submit,
+# edit_profile_submit) forget() the user.
+#
+# the store is separate from the page cache because a stale entry here is a
+# deactivated account that stays signed in. IDENTITY_CACHE_BACKEND:
+#   sqlite  (default) a file every gunicorn worker shares, so a deactivation
+#           reaches all of them on the next request
+#   memory  per process, only for a single worker
+#   none    load the user from the database on every request
+
+DEFAULT_TTL = 30
+FIELDS = ('id', 'role', 'active', 'name', 'specialization_id')
+
+
+def init_app(app):
+    """Give `app` its identity cache, from IDENTITY_CACHE_BACKEND and IDENTITY_CACHE_PATH."""
+    app.extensions['identity_cache'] = PageCache(
+        app.config.get('IDENTITY_CACHE_BACKEND', 'sqlite'),
+        ttl=app.config.get('IDENTITY_TTL_SECONDS', DEFAULT_TTL),
+        path=app.config.get('IDENTITY_CACHE_PATH') or os.path.join(app.instance_path, 'identity.sqlite'))
+
+
+# the current app's identity cache
+cache = LocalProxy(lambda: current_app.extensions['identity_cache'])
+
+
+def identity_key(user_id):
+    return f"identity:{user_id}"
+
+
+class Identity(UserMixin):
+    def __init__(self, fields):
+        self.__dict__.update(fields)
+
+    @property
+    def is_active(self):
+        return self.active
+
+    @property
+    def row(self):
+        """The full User row, loaded once per request."""
+        if '_row' not in self.__dict__:
+            self._row = db.session.get(User, self.id)
+        return self._row
+
+    def __getattr__(self, name):
+        # only reached for attributes not in FIELDS
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.row, name)
+
+
+def load(user_id):
+    """The Identity for `user_id`, or None when it doesn't exist or is deactivated."""
+    key = identity_key(user_id)
+    fields = cache.get(key)
+    if fields is None:
+        row = db.session.execute(
+            db.select(*(getattr(User, f) for f in FIELDS)).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        fields = dict(row._mapping)
+        cache.set(key, fields, tags=(user_tag(user_id),))
+    if not fields['active']:
+        return None
+    return Identity(fields)
+
+
+def forget(user_id):
+    """After a commit that changed `user_id`'s role, name, department or active flag."""
+    cache.invalidate(user_tag(user_id))
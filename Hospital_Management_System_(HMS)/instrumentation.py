@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request, Response
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import LocalProxy
+
+# where a request's time goes: SQL, jinja rendering, password hashing.
+#
+# per request the totals are sent back as a Server-Timing header (browser devtools
+# show it under "Timing"):
+#   sql;desc="7 queries";dur=3.1, render;dur=4.0, hash;dur=0, total;dur=9.8
+# render includes the SQL fired from templates by lazy loads, so the parts can add
+# up to more than total.
+#
+# per endpoint they accumulate into counters and a latency histogram served at
+# /metrics in the prometheus text format. like the login throttle these live in the
+# process, with several gunicorn workers each one reports only its own share.
+#
+# statements slower than SLOW_QUERY_MS are logged with their text, never their
+# parameters: those carry password hashes, emails and addresses.
+#
+# settings: INSTRUMENTATION (on), SERVER_TIMING (on), SLOW_QUERY_MS (100),
+# METRICS_TOKEN (set: /metrics needs "Authorization: Bearer <token>", unset: /metrics
+# answers 401, except under TESTING).
+#
+# every app from create_app() collects into its own Metrics (init_app), `metrics`
+# is the current app's.
+
+DEFAULT_SLOW_QUERY_MS = 100
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _timing():
+    # this request's totals, None outside a request or when instrumentation is off
+    return g.get('timing') if has_request_context() else None
+
+
+def add_time(part, seconds):
+    """Charge `seconds` to `part` ("hash", ...) of the current request, if any."""
+    timing = _timing()
+    if timing is not None:
+        timing[part] = timing.get(part, 0.0) + seconds
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if _timing() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    timing = _timing()
+    started = conn.info.get('query_started')
+    if timing is None or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    timing['queries'] += 1
+    timing['sql'] += elapsed
+    if elapsed * 1000 >= metrics.slow_query_ms:
+        with metrics.lock:
+            metrics.slow_queries += 1
+        current_app.logger.warning("slow query (%.1f ms) in %s: %s", elapsed * 1000,
+                                   request.endpoint, " ".join(statement.split()))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class Metrics:
+    def __init__(self, app):
+        self.enabled = app.config.get('INSTRUMENTATION', True)
+        self.server_timing = app.config.get('SERVER_TIMING', True)
+        self.slow_query_ms = app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+        self.token = app.config.get('METRICS_TOKEN')
+        self.public = app.config.get('TESTING', False)   # no token needed
+        self.lock = threading.Lock()
+        self.reset()
+        if self.enabled:
+            app.add_url_rule('/metrics', 'metrics', self.view)
+            app.before_request(self._start)
+            app.after_request(self._finish)
+            app.teardown_request(self._record)
+            before_render_template.connect(self._render_started, app)
+            template_rendered.connect(self._render_finished, app)
+
+    def reset(self):
+        self.latency = defaultdict(Histogram)   # (endpoint, method) -> Histogram
+        self.responses = defaultdict(int)       # (endpoint, method, status) -> count
+        self.totals = defaultdict(float)        # (endpoint, part) -> queries or seconds
+        self.slow_queries = 0
+
+    # request hooks
+
+    def _start(self):
+        g.timing = {'started': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'render': 0.0, 'hash': 0.0}
+
+    def _render_started(self, sender, template, context, **extra):
+        timing = _timing()
+        if timing is not None:
+            timing.setdefault('rendering', []).append(time.perf_counter())
+
+    def _render_finished(self, sender, template, context, **extra):
+        timing = _timing()
+        if timing is not None and timing.get('rendering'):
+            timing['render'] += time.perf_counter() - timing['rendering'].pop()
+
+    def _finish(self, response):
+        timing = _timing()
+        if timing is None:
+            return response
+        timing['status'] = response.status_code
+        if self.server_timing:
+            total = time.perf_counter() - timing['started']
+            response.headers['Server-Timing'] = (
+                f'sql;desc="{timing["queries"]} queries";dur={timing["sql"] * 1000:.1f}, '
+                f'render;dur={timing["render"] * 1000:.1f}, hash;dur={timing["hash"] * 1000:.1f}, '
+                f'total;dur={total * 1000:.1f}')
+        return response
+
+    def _record(self, exc):
+        # teardown runs for failed requests too, those count as 500s
+        timing = g.pop('timing', None)
+        if timing is None or request.endpoint == 'metrics':
+            return
+        elapsed = time.perf_counter() - timing['started']
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            self.latency[endpoint, request.method].observe(elapsed)
+            self.responses[endpoint, request.method, timing.get('status', 500)] += 1
+            for part in ('queries', 'sql', 'render', 'hash'):
+                self.totals[endpoint, part] += timing[part]
+
+    # /metrics
+
+    def view(self):
+        if self.token:
+            allowed = request.headers.get('Authorization') == f"Bearer {self.token}"
+        else:
+            allowed = self.public
+        if not allowed:
+            return Response("unauthorized\n", 401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+    def render(self):
+        """Everything collected so far, in the prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            family("hms_request_duration_seconds", "histogram", "Time to answer a request, per route.")
+            for (endpoint, method), hist in sorted(self.latency.items()):
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'hms_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'hms_request_duration_seconds_bucket{{{labels},le="+Inf"}} {hist.total}')
+                lines.append(f'hms_request_duration_seconds_sum{{{labels}}} {hist.sum:.6f}')
+                lines.append(f'hms_request_duration_seconds_count{{{labels}}} {hist.total}')
+
+            family("hms_requests_total", "counter", "Responses, per route and status.")
+            for (endpoint, method, status), count in sorted(self.responses.items()):
+                lines.append(f'hms_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            parts = (("queries", "hms_request_queries_total", "SQL statements run, per route."),
+                     ("sql", "hms_request_sql_seconds_total", "Time spent in SQL, per route."),
+                     ("render", "hms_request_render_seconds_total", "Time spent rendering templates, per route."),
+                     ("hash", "hms_request_hash_seconds_total", "Time spent hashing passwords, per route."))
+            for part, name, help_text in parts:
+                family(name, "counter", help_text)
+                for (endpoint, key), value in sorted(self.totals.items()):
+                    if key == part:
+                        lines.append(f'{name}{{endpoint="{endpoint}"}} {value:.6g}')
+
+            family("hms_slow_queries_total", "counter", f"Statements slower than SLOW_QUERY_MS ({self.slow_query_ms} ms).")
+            lines.append(f"hms_slow_queries_total {self.slow_queries}")
+        return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """Give `app` its own Metrics: Server-Timing headers and /metrics, from the settings above."""
+    app.extensions['metrics'] = Metrics(app)
+
+
+# the current app's
+metrics = LocalProxy(lambda: current_app.extensions['metrics'])
@@ -0,0 +1,252 @@
+import time
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import text
+
+import counters
+import free_slots
+from cache import cache, user_tag
+
+# background jobs, run by `flask run-worker` in a process of their own so none of
+# this is on the request path.
+#
+# the queue is the job_queue table in the app database, no broker to run. periodic
+# jobs queue their own next run when they finish, and a partial unique index allows
+# one queued-or-running row per job name, so any number of workers can share the
+# queue without double scheduling. a worker claims a row with a single
+# UPDATE ... RETURNING, so two workers never run the same one.
+#
+# every job works in batches of JOB_BATCH_SIZE (500) rows, one short transaction per
+# batch, so bookings never wait behind a long sweep.
+#
+#   follow_up_reminders  treatments whose follow_up_date falls within the next
+#                        FOLLOW_UP_REMINDER_DAYS (3) days get a follow_up_reminders
+#                        row, the outbox whatever sends the mail/SMS reads and marks
+#                        sent_at. walks ix_treatments_follow_up_date.
+#   no_show_sweep        Booked appointments on days already gone become "No-Show",
+#                        bulk UPDATEs on ix_appointments_booked_date. the counters are
+#                        adjusted in the same transaction.
+#   availability_cleanup availability exceptions for days already gone are deleted,
+#                        the weekly templates cover everything else (availability.py).
+#   free_slot_index      indexes the booking horizon's new day ahead of the first
+#                        search of the day (free_slots.py).
+#
+# the sweep drops the affected users' cached pages, which only reaches the web
+# workers with the shared CACHE_BACKEND=sqlite. with the memory backend they see
+# the change when their entries expire (CACHE_TTL_SECONDS).
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_REMINDER_DAYS = 3
+# a running row older than this belonged to a worker that died
+DEFAULT_JOB_TIMEOUT = 3600
+NO_SHOW = "No-Show"
+
+JOBS = {}   # name -> (function, seconds between runs or None)
+
+
+def job(name, every=None):
+    def register(fn):
+        JOBS[name] = (fn, every)
+        return fn
+    return register
+
+
+def batch_size(config):
+    return config.get('JOB_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def _now():
+    return datetime.utcnow().isoformat(sep=' ')
+
+
+# the queue
+
+def enqueue(connection, name, run_at=None):
+    """Queue job `name` to run at `run_at` (now by default). A no-op while one is already queued or running."""
+    if name not in JOBS:
+        raise ValueError(f"unknown job {name!r}")
+    connection.execute(text("INSERT OR IGNORE INTO job_queue (name, status, run_at) VALUES (:name, 'queued', :run_at)"),
+                       {'name': name, 'run_at': (run_at or datetime.utcnow()).isoformat(sep=' ')})
+
+
+def schedule(engine, timeout=DEFAULT_JOB_TIMEOUT):
+    """Fail the runs of dead workers and make sure every periodic job is queued."""
+    stale = (datetime.utcnow() - timedelta(seconds=timeout)).isoformat(sep=' ')
+    with engine.begin() as conn:
+        conn.execute(text("""UPDATE job_queue SET status = 'failed', finished_at = :now, error = 'worker stopped'
+                             WHERE status = 'running' AND started_at < :stale"""), {'now': _now(), 'stale': stale})
+        for name, (_, every) in JOBS.items():
+            if every:
+                enqueue(conn, name)
+
+
+def claim(engine):
+    """Take the next due job: (id, name), or None when nothing is due."""
+    now = _now()
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            UPDATE job_queue SET status = 'running', started_at = :now
+            WHERE id = (SELECT id FROM job_queue WHERE status = 'queued' AND run_at <= :now
+                        ORDER BY run_at, id LIMIT 1)
+            RETURNING id, name"""), {'now': now}).first()
+
+
+def finish(engine, job_id, name, processed=None, error=None):
+    every = JOBS[name][1]
+    with engine.begin() as conn:
+        conn.execute(text("""UPDATE job_queue SET status = :status, finished_at = :now, processed = :processed,
+                             error = :error WHERE id = :id"""),
+                     {'status': 'failed' if error else 'done', 'now': _now(), 'processed': processed,
+                      'error': error, 'id': job_id})
+        if every:
+            enqueue(conn, name, datetime.utcnow() + timedelta(seconds=every))
+        # keep a week of finished runs to look back at
+        conn.execute(text("DELETE FROM job_queue WHERE status IN ('done', 'failed') AND run_at < :cutoff"),
+                     {'cutoff': (datetime.utcnow() - timedelta(days=7)).isoformat(sep=' ')})
+
+
+def run_next(engine, config):
+    """Run one due job. Returns its name, or None if nothing was due."""
+    claimed = claim(engine)
+    if claimed is None:
+        return None
+    job_id, name = claimed
+    started = time.perf_counter()
+    try:
+        processed = JOBS[name][0](engine, config, date.today())
+    except Exception as e:
+        current_app.logger.exception("job %s failed", name)
+        finish(engine, job_id, name, error=f"{type(e).__name__}: {e}")
+    else:
+        current_app.logger.info("job %s: %d rows in %.2fs", name, processed, time.perf_counter() - started)
+        finish(engine, job_id, name, processed=processed)
+    return name
+
+
+def work(engine, config, interval=5.0, once=False):
+    """The worker loop. With `once`, stop as soon as nothing is due (for cron)."""
+    timeout = config.get('JOB_TIMEOUT_SECONDS', DEFAULT_JOB_TIMEOUT)
+    while True:
+        schedule(engine, timeout)
+        while run_next(engine, config):
+            pass
+        if once:
+            return
+        time.sleep(interval)
+
+
+# the jobs
+
+@job("follow_up_reminders", every=3600)
+def follow_up_reminders(engine, config, today, on_batch=None):
+    """Queue a reminder for every follow-up due in the window. Returns how many were new."""
+    end = today + timedelta(days=config.get('FOLLOW_UP_REMINDER_DAYS', DEFAULT_REMINDER_DAYS))
+    limit = batch_size(config)
+    position, queued = None, 0
+    while True:
+        params = {'start': today.isoformat(), 'end': end.isoformat(), 'limit': limit}
+        keyset = ""
+        if position:
+            # a row value again, so the index is entered right at the last row seen
+            keyset = "AND (t.follow_up_date, t.id) > (:last_date, :last_id)"
+            params.update(last_date=position[0], last_id=position[1])
+        # read, then write in a transaction of its own: a read that turns into a
+        # write fails under WAL if someone else committed in between
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT t.follow_up_date, t.id, t.appointment_id, a.patient_id, a.doctor_id
+                FROM treatments AS t JOIN appointments AS a ON a.id = t.appointment_id
+                WHERE t.follow_up_date BETWEEN :start AND :end {keyset}
+                ORDER BY t.follow_up_date, t.id LIMIT :limit"""), params).all()
+        new = 0
+        if rows:
+            now = _now()
+            with engine.begin() as conn:
+                # the unique (appointment_id, follow_up_date) makes a rescan a no-op
+                new = conn.execute(text("""
+                    INSERT OR IGNORE INTO follow_up_reminders
+                    (appointment_id, patient_id, doctor_id, follow_up_date, created_at)
+                    VALUES (:appointment_id, :patient_id, :doctor_id, :follow_up_date, :now)"""),
+                    [{'appointment_id': row[2], 'patient_id': row[3], 'doctor_id': row[4],
+                      'follow_up_date': row[0], 'now': now} for row in rows]).rowcount
+        queued += new
+        if on_batch:
+            on_batch(len(rows))
+        if len(rows) < limit:
+            return queued
+        position = rows[-1][0], rows[-1][1]
+
+
+@job("no_show_sweep", every=3600)
+def no_show_sweep(engine, config, today, on_batch=None):
+    """Mark Booked appointments before `today` as No-Show. Returns how many."""
+    limit = batch_size(config)
+    swept = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                UPDATE appointments SET status = :no_show
+                WHERE id IN (SELECT id FROM appointments WHERE status = 'Booked' AND date < :today LIMIT :limit)
+                RETURNING patient_id, doctor_id"""),
+                {'no_show': NO_SHOW, 'today': today.isoformat(), 'limit': limit}).all()
+            # a bulk UPDATE, the ORM counter hook never sees it
+            counters.adjust(conn, {counters.status_key("Booked"): -len(rows), counters.status_key(NO_SHOW): len(rows)})
+        if rows:
+            cache.invalidate(*{user_tag(user_id) for row in rows for user_id in row})
+        swept += len(rows)
+        if on_batch:
+            on_batch(len(rows))
+        if len(rows) < limit:
+            return swept
+
+
+@job("availability_cleanup", every=86400)
+def availability_cleanup(engine, config, today, on_batch=None):
+    """Delete availability exceptions dated before `today`. Returns how many."""
+    limit = batch_size(config)
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text("""
+                DELETE FROM doctor_availability
+                WHERE id IN (SELECT id FROM doctor_availability WHERE date < :today LIMIT :limit)"""),
+                {'today': today.isoformat(), 'limit': limit}).rowcount
+        deleted += n
+        if on_batch:
+            on_batch(n)
+        if n < limit:
+            return deleted
+
+
+@job("free_slot_index", every=3600)
+def free_slot_index(engine, config, today, on_batch=None):
+    """Build the free slot index for the horizon's missing dates. Returns how many dates."""
+    built = free_slots.ensure(engine, today)
+    if on_batch:
+        on_batch(built)
+    return built
+
+
+def forget_reminders(connection, appointment_id):
+    """Drop the unsent reminders of an appointment whose follow-up date changed."""
+    connection.execute(text("DELETE FROM follow_up_reminders WHERE appointment_id = :id AND sent_at IS NULL"),
+                       {'id': appointment_id})
+
+
+def measure(engine, name, config, today):
+    """Run job `name` once and time it: rows, seconds, batches and the longest batch (the lock hold)."""
+    marks = []
+
+    def on_batch(rows):
+        marks.append((time.perf_counter(), rows))
+
+    started = time.perf_counter()
+    processed = JOBS[name][0](engine, config, today, on_batch=on_batch)
+    seconds = time.perf_counter() - started
+    rows = sum(n for _, n in marks)
+    longest, previous = 0.0, started
+    for moment, _ in marks:
+        longest, previous = max(longest, moment - previous), moment
+    return {'job': name, 'rows': rows, 'changed': processed, 'seconds': seconds, 'batches': len(marks),
+            'longest_batch_ms': longest * 1000, 'rows_per_second': rows / seconds if seconds else 0.0}
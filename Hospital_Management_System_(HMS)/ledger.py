@@ -0,0 +1,82 @@
+import csv
+import io
+
+from sqlalchemy import String, tuple_, type_coerce
+from sqlalchemy.orm import aliased
+
+from extensions import db
+from models import User, Department, Appointment
+import queries
+
+# the admin appointment ledger as a CSV download, same filters as the dashboard.
+#
+# rows are fetched in keyset chunks of `chunk_size` (newest first, like the
+# dashboard pages), each chunk a short read on a connection that goes back to the
+# pool straight after. so a slow download never holds a read transaction open
+# (writers and WAL checkpoints carry on) and never has more than one chunk in
+# memory. names come from joins in the same SELECT, no per-row lookups, and the
+# date/time columns are read as the text sqlite stores instead of being parsed
+# into python objects (that parsing was most of the cost per row).
+#
+# excel=True adds a BOM so Excel picks up UTF-8, and defuses cells starting with
+# = + - @ so a patient called "=HYPERLINK(...)" stays text.
+
+DEFAULT_CHUNK_SIZE = 2000
+HEADER = ('id', 'date', 'time', 'status', 'patient', 'patient_email', 'doctor', 'department', 'booked_at')
+
+
+# stored text, compared and printed as is
+CREATED_AT = type_coerce(Appointment.created_at, String)
+
+
+def ledger_select(filters):
+    patient, doctor = aliased(User), aliased(User)
+    query = (
+        db.select(Appointment.id, type_coerce(Appointment.date, String), type_coerce(Appointment.time, String),
+                  Appointment.status, patient.name, patient.email, doctor.name, Department.name, CREATED_AT)
+        .outerjoin(patient, patient.id == Appointment.patient_id)
+        .outerjoin(doctor, doctor.id == Appointment.doctor_id)
+        .outerjoin(Department, Department.id == doctor.specialization_id)
+    )
+    return queries.filter_appointments(query, filters)
+
+
+def rows(filters, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Every matching appointment, newest first, one short query per chunk."""
+    query = ledger_select(filters).order_by(CREATED_AT.desc(), Appointment.id.desc())
+    position = None
+    while True:
+        chunk_query = query
+        if position:
+            created_at, row_id = position
+            # a row value, so sqlite seeks straight to the position (see pagination.py)
+            chunk_query = query.where(tuple_(CREATED_AT, Appointment.id) < (created_at, row_id))
+        with db.engine.connect() as conn:
+            chunk = conn.execute(chunk_query.limit(chunk_size)).all()
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        position = chunk[-1][8], chunk[-1][0]
+
+
+def _defuse(value):
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def csv_stream(filters, excel=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """The ledger as CSV text, yielded about one chunk at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if excel:
+        buffer.write('\ufeff')
+    writer.writerow(HEADER)
+    for n, row in enumerate(rows(filters, chunk_size), 1):
+        values = (row[0], row[1], row[2][:5], row[3], row[4], row[5], row[6], row[7], (row[8] or '')[:19])
+        writer.writerow([_defuse(value) for value in values] if excel else values)
+        if n % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
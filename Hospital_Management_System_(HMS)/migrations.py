@@ -0,0 +1,504 @@
+from datetime import datetime
+
+# versioned schema migrations, run in order at startup instead of db.create_all().
+# the applied version is kept in schema_version. the whole upgrade runs inside one
+# BEGIN IMMEDIATE transaction, so several workers starting together serialize on
+# the write lock and only the first one applies anything.
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def current_version(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER NOT NULL PRIMARY KEY,
+            description VARCHAR(200) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )""")
+    cur.execute("SELECT MAX(version) FROM schema_version")
+    return cur.fetchone()[0] or 0
+
+
+def upgrade(engine):
+    """Apply every pending migration. Returns the list of versions applied."""
+    applied = []
+    raw = engine.raw_connection()
+    dbapi_conn = raw.driver_connection
+    old_isolation = dbapi_conn.isolation_level
+    # take over transaction control from the sqlite3 module so DDL is transactional too
+    dbapi_conn.isolation_level = None
+    cur = dbapi_conn.cursor()
+    # table rebuilds drop and rename tables that others reference; that is only safe
+    # with enforcement off, and the pragma is a no-op inside a transaction
+    cur.execute("PRAGMA foreign_keys")
+    old_foreign_keys = cur.fetchone()[0]
+    cur.execute("PRAGMA foreign_keys = OFF")
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            version = current_version(cur)
+            for target, description, fn in MIGRATIONS:
+                if target <= version:
+                    continue
+                fn(cur)
+                cur.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (target, description, datetime.utcnow().isoformat(sep=' '))
+                )
+                applied.append(target)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    finally:
+        cur.execute(f"PRAGMA foreign_keys = {'ON' if old_foreign_keys else 'OFF'}")
+        cur.close()
+        dbapi_conn.isolation_level = old_isolation
+        raw.close()
+    return applied
+
+
+@migration(1, "baseline schema")
+def baseline(cur):
+    # the tables exactly as db.create_all() used to build them, so existing databases
+    # (created before migrations existed) pass through untouched
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS departments (
+            id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            description TEXT,
+            PRIMARY KEY (id),
+            UNIQUE (name)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            name VARCHAR(150) NOT NULL,
+            email VARCHAR(150) NOT NULL,
+            password VARCHAR(150) NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            created_at DATETIME,
+            specialization_id INTEGER,
+            age INTEGER,
+            gender VARCHAR(20),
+            contact_number VARCHAR(15),
+            address VARCHAR(150),
+            active BOOLEAN NOT NULL,
+            PRIMARY KEY (id),
+            UNIQUE (email),
+            FOREIGN KEY(specialization_id) REFERENCES departments (id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS appointments (
+            id INTEGER NOT NULL,
+            patient_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            date VARCHAR(30) NOT NULL,
+            time VARCHAR(30) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(patient_id) REFERENCES users (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS treatments (
+            id INTEGER NOT NULL,
+            appointment_id INTEGER NOT NULL,
+            diagnosis TEXT NOT NULL,
+            prescription TEXT NOT NULL,
+            follow_up_date VARCHAR(30),
+            notes TEXT,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(appointment_id) REFERENCES appointments (id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS doctor_availability (
+            id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            date VARCHAR(20) NOT NULL,
+            start_time VARCHAR(10),
+            end_time VARCHAR(10),
+            is_available BOOLEAN NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""")
+
+
+@migration(2, "scheduling indexes and unique active booking slot")
+def scheduling_indexes(cur):
+    # two "Booked" rows on the same slot would make the unique index below fail to
+    # build, so keep the oldest booking and cancel the rest
+    cur.execute("""
+        UPDATE appointments SET status = 'Cancelled'
+        WHERE status = 'Booked' AND id NOT IN (
+            SELECT MIN(id) FROM appointments WHERE status = 'Booked'
+            GROUP BY doctor_id, date, time
+        )""")
+
+    # create_appointment (doctor_id, date, time) and book_appointment_form (doctor_id, date)
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_appointments_doctor_date_time ON appointments (doctor_id, date, time)")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_appointments_active_slot
+        ON appointments (doctor_id, date, time) WHERE status = 'Booked'""")
+    # patient_dashboard / patient_history, already in the order they sort by
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_appointments_patient_date_time ON appointments (patient_id, date, time)")
+    # admin keyset pagination, newest first (rowid rides along in every sqlite index)
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_appointments_created_at ON appointments (created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_doctor_availability_doctor_date ON doctor_availability (doctor_id, date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_users_role_active_name ON users (role, active, name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_users_role_created_at ON users (role, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_treatments_appointment_id ON treatments (appointment_id)")
+
+
+def _to_date(value):
+    if value is None or not str(value).strip():
+        return None
+    for fmt in ('%Y-%m-%d', '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(str(value).strip(), fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised date {value!r}")
+
+
+def _to_time(value):
+    if value is None or not str(value).strip():
+        return None
+    for fmt in ('%H:%M:%S', '%H:%M', '%H:%M:%S.%f', '%I:%M %p'):
+        try:
+            return datetime.strptime(str(value).strip(), fmt).strftime('%H:%M:%S')
+        except ValueError:
+            pass
+    raise ValueError(f"unrecognised time {value!r}")
+
+
+def _rebuild(cur, table, create_sql, converters, lenient=()):
+    """Recreate `table` from `create_sql`, converting the named columns on the way.
+
+    sqlite can't ALTER a column's type, so this is the usual create/copy/drop/rename.
+    Columns in `lenient` are set to NULL when they can't be parsed, anything else
+    aborts the migration naming the offending row.
+    """
+    cur.execute(create_sql.format(table=f"{table}_new"))
+    cur.execute(f"SELECT * FROM {table}")
+    columns = [d[0] for d in cur.description]
+    rows = []
+    for row in cur.fetchall():
+        row = dict(zip(columns, row))
+        for column, convert in converters.items():
+            try:
+                row[column] = convert(row[column])
+            except ValueError:
+                if column not in lenient:
+                    raise ValueError(f"{table} id={row['id']}: cannot convert {column}={row[column]!r}")
+                row[column] = None
+        rows.append(tuple(row[c] for c in columns))
+    placeholders = ", ".join("?" for _ in columns)
+    cur.executemany(f"INSERT INTO {table}_new ({', '.join(columns)}) VALUES ({placeholders})", rows)
+    cur.execute(f"DROP TABLE {table}")
+    cur.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+@migration(3, "native DATE/TIME columns")
+def native_date_time(cur):
+    # values are stored as ISO text ('YYYY-MM-DD', 'HH:MM:SS'), which keeps
+    # range predicates on the indexes below plain ordered comparisons
+    _rebuild(cur, "appointments", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            patient_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(patient_id) REFERENCES users (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""", {"date": _to_date, "time": _to_time})
+    _rebuild(cur, "doctor_availability", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            start_time TIME,
+            end_time TIME,
+            is_available BOOLEAN NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""", {"date": _to_date, "start_time": _to_time, "end_time": _to_time},
+        lenient=("start_time", "end_time"))
+    # follow_up_date was free text, keep what parses as a date and drop the rest
+    _rebuild(cur, "treatments", """
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL,
+            appointment_id INTEGER NOT NULL,
+            diagnosis TEXT NOT NULL,
+            prescription TEXT NOT NULL,
+            follow_up_date DATE,
+            notes TEXT,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(appointment_id) REFERENCES appointments (id)
+        )""", {"follow_up_date": _to_date}, lenient=("follow_up_date",))
+
+    # the rebuilt tables lost their indexes
+    cur.execute("CREATE INDEX ix_appointments_doctor_date_time ON appointments (doctor_id, date, time)")
+    cur.execute("""
+        CREATE UNIQUE INDEX uq_appointments_active_slot
+        ON appointments (doctor_id, date, time) WHERE status = 'Booked'""")
+    cur.execute("CREATE INDEX ix_appointments_patient_date_time ON appointments (patient_id, date, time)")
+    cur.execute("CREATE INDEX ix_appointments_created_at ON appointments (created_at)")
+    cur.execute("CREATE INDEX ix_doctor_availability_doctor_date ON doctor_availability (doctor_id, date)")
+    cur.execute("CREATE INDEX ix_treatments_appointment_id ON treatments (appointment_id)")
+
+
+
+@migration(4, "slot holds")
+def slot_holds(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS slot_holds (
+            doctor_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            patient_id INTEGER NOT NULL,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (doctor_id, date, time),
+            FOREIGN KEY(doctor_id) REFERENCES users (id),
+            FOREIGN KEY(patient_id) REFERENCES users (id)
+        )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_slot_holds_expires_at ON slot_holds (expires_at)")
+
+
+@migration(5, "full-text user search index")
+def user_search(cur):
+    # prefix='2 3' keeps short prefix queries (what people type first) on an index
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(
+            name, email, contact_number, department,
+            tokenize = 'unicode61', prefix = '2 3'
+        )""")
+    cur.execute("DELETE FROM user_search")
+    cur.execute("""
+        INSERT INTO user_search (rowid, name, email, contact_number, department)
+        SELECT users.id, users.name, users.email, users.contact_number, departments.name
+        FROM users LEFT JOIN departments ON departments.id = users.specialization_id""")
+
+
+@migration(6, "maintained dashboard counters")
+def dashboard_counters(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name VARCHAR(100) NOT NULL PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )""")
+    # seed from the current data, same computation as counters.reconcile()
+    cur.execute("DELETE FROM counters")
+    cur.execute("""
+        INSERT INTO counters (name, value)
+        SELECT role || 's.active', COUNT(*) FROM users
+        WHERE active = 1 AND role IN ('patient', 'doctor') GROUP BY role""")
+    cur.execute("INSERT INTO counters (name, value) SELECT 'appointments.total', COUNT(*) FROM appointments")
+    cur.execute("""
+        INSERT INTO counters (name, value)
+        SELECT 'appointments.status.' || status, COUNT(*) FROM appointments GROUP BY status""")
+    cur.execute("""
+        INSERT INTO counters (name, value)
+        SELECT 'appointments.department.' || COALESCE(users.specialization_id, 0), COUNT(*)
+        FROM appointments LEFT JOIN users ON users.id = appointments.doctor_id
+        GROUP BY COALESCE(users.specialization_id, 0)""")
+
+
+@migration(7, "appointment archive tables")
+def appointment_archive(cur):
+    # filled by archive.py; treatments get new ids here, appointments keep theirs
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS appointments_archive (
+            id INTEGER NOT NULL,
+            patient_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(patient_id) REFERENCES users (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS treatments_archive (
+            id INTEGER NOT NULL,
+            appointment_id INTEGER NOT NULL,
+            diagnosis TEXT NOT NULL,
+            prescription TEXT NOT NULL,
+            follow_up_date DATE,
+            notes TEXT,
+            created_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(appointment_id) REFERENCES appointments_archive (id)
+        )""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_appointments_archive_patient_date_time
+                   ON appointments_archive (patient_id, date, time)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_treatments_archive_appointment_id
+                   ON treatments_archive (appointment_id)""")
+
+
+@migration(8, "job queue, follow-up reminders and sweep indexes")
+def background_jobs(cur):
+    # see jobs.py
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS job_queue (
+            id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            run_at DATETIME NOT NULL,
+            started_at DATETIME,
+            finished_at DATETIME,
+            processed INTEGER,
+            error TEXT,
+            PRIMARY KEY (id)
+        )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_job_queue_status_run_at ON job_queue (status, run_at)")
+    # one pending run per job, whoever schedules it
+    cur.execute("""CREATE UNIQUE INDEX IF NOT EXISTS uq_job_queue_active_name
+                   ON job_queue (name) WHERE status IN ('queued', 'running')""")
+    # appointment_id has no foreign key, the appointment may move to the archive
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS follow_up_reminders (
+            id INTEGER NOT NULL,
+            appointment_id INTEGER NOT NULL,
+            patient_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            follow_up_date DATE NOT NULL,
+            created_at DATETIME NOT NULL,
+            sent_at DATETIME,
+            PRIMARY KEY (id),
+            UNIQUE (appointment_id, follow_up_date),
+            FOREIGN KEY(patient_id) REFERENCES users (id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_follow_up_reminders_unsent
+                   ON follow_up_reminders (created_at) WHERE sent_at IS NULL""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_treatments_follow_up_date ON treatments (follow_up_date)")
+    # only Booked rows, so the no-show sweep never walks the closed history
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_appointments_booked_date
+                   ON appointments (date) WHERE status = 'Booked'""")
+
+
+@migration(9, "weekly availability templates")
+def availability_templates(cur):
+    # see availability.py
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS availability_templates (
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            start_time TIME,
+            end_time TIME,
+            is_available BOOLEAN NOT NULL,
+            PRIMARY KEY (doctor_id, weekday),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        )""")
+    # each doctor's template for a weekday is what their per-day rows said most
+    # often (latest first on a tie), closed days counting as one whatever their times.
+    # strftime('%w') counts from Sunday, the templates from Monday like date.weekday()
+    cur.execute("""
+        INSERT OR IGNORE INTO availability_templates (doctor_id, weekday, start_time, end_time, is_available)
+        SELECT doctor_id, weekday, start_time, end_time, is_available FROM (
+            SELECT doctor_id, weekday, start_time, end_time, is_available,
+                   ROW_NUMBER() OVER (PARTITION BY doctor_id, weekday ORDER BY COUNT(*) DESC, MAX(date) DESC) AS n
+            FROM (SELECT doctor_id, (CAST(strftime('%w', date) AS INTEGER) + 6) % 7 AS weekday, date,
+                         is_available,
+                         CASE WHEN is_available THEN start_time END AS start_time,
+                         CASE WHEN is_available THEN end_time END AS end_time
+                  FROM doctor_availability)
+            GROUP BY doctor_id, weekday, is_available, start_time, end_time)
+        WHERE n = 1""")
+    # what's left in doctor_availability are the exceptions
+    cur.execute("""
+        DELETE FROM doctor_availability WHERE EXISTS (
+            SELECT 1 FROM availability_templates AS t
+            WHERE t.doctor_id = doctor_availability.doctor_id
+              AND t.weekday = (CAST(strftime('%w', doctor_availability.date) AS INTEGER) + 6) % 7
+              AND t.is_available = doctor_availability.is_available
+              AND (NOT t.is_available OR (t.start_time IS doctor_availability.start_time
+                                          AND t.end_time IS doctor_availability.end_time)))""")
+
+
+@migration(10, "free slot index")
+def free_slot_index(cur):
+    # see free_slots.py; filled on first use
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS free_slots (
+            date DATE NOT NULL,
+            time TIME NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            PRIMARY KEY (date, time, doctor_id),
+            FOREIGN KEY(doctor_id) REFERENCES users (id)
+        ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_free_slots_doctor_date ON free_slots (doctor_id, date)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS free_slot_days (
+            date DATE NOT NULL PRIMARY KEY,
+            slot_minutes INTEGER NOT NULL,
+            built_at DATETIME NOT NULL
+        )""")
+
+# (description, sql, index the plan must mention) for `flask check-indexes`
+HOT_QUERIES = [
+    ("create_appointment slot check",
+     "SELECT id FROM appointments WHERE doctor_id = 1 AND date = '2025-01-01' AND time = '09:00:00'",
+     "ix_appointments_doctor_date_time"),
+    ("book_appointment_form bookings per day",
+     "SELECT time FROM appointments WHERE doctor_id = 1 AND date = '2025-01-01'",
+     "ix_appointments_doctor_date_time"),
+    ("doctor_dashboard upcoming appointments",
+     "SELECT id FROM appointments WHERE doctor_id = 1 AND status = 'Booked' AND date >= '2025-01-01' ORDER BY date, time",
+     "uq_appointments_active_slot"),
+    ("patient_dashboard appointments",
+     "SELECT id FROM appointments WHERE patient_id = 1 ORDER BY date DESC, time DESC",
+     "ix_appointments_patient_date_time"),
+    ("availability exceptions for the next 7 days",
+     "SELECT id FROM doctor_availability WHERE doctor_id = 1 AND date BETWEEN '2025-01-01' AND '2025-01-07'",
+     "ix_doctor_availability_doctor_date"),
+    ("weekly availability template",
+     "SELECT weekday FROM availability_templates WHERE doctor_id = 1",
+     "sqlite_autoindex_availability_templates_1"),
+    ("active doctors by name",
+     "SELECT id FROM users WHERE role = 'doctor' AND active = 1 ORDER BY name",
+     "ix_users_role_active_name"),
+    ("patient_history archived visits",
+     "SELECT id FROM appointments_archive WHERE patient_id = 1 ORDER BY date DESC, time DESC",
+     "ix_appointments_archive_patient_date_time"),
+    ("no-show sweep",
+     "SELECT id FROM appointments WHERE status = 'Booked' AND date < '2025-01-01' LIMIT 500",
+     "ix_appointments_booked_date"),
+    ("follow-up reminder scan",
+     "SELECT id FROM treatments WHERE follow_up_date BETWEEN '2025-01-01' AND '2025-01-04' ORDER BY follow_up_date, id",
+     "ix_treatments_follow_up_date"),
+    ("next available slots",
+     "SELECT doctor_id FROM free_slots WHERE date BETWEEN '2025-01-01' AND '2025-01-07' ORDER BY date, time, doctor_id LIMIT 10",
+     "free_slots"),
+    ("free slot refresh for a doctor-day",
+     "DELETE FROM free_slots WHERE doctor_id = 1 AND date = '2025-01-01'",
+     "ix_free_slots_doctor_date"),
+    ("admin appointments page",
+     "SELECT id FROM appointments ORDER BY created_at DESC, id DESC LIMIT 26",
+     "ix_appointments_created_at"),
+]
+
+
+def explain_hot_queries(conn):
+    """EXPLAIN QUERY PLAN each hot query; yields (description, expected index, plan, ok)."""
+    for description, sql, index in HOT_QUERIES:
+        plan = " / ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+        yield description, index, plan, index in plan
@@ -1,9 +1,23 @@
 from extensions import db
 from flask_login import UserMixin
+from sqlalchemy import text
+from sqlalchemy.dialects import sqlite
 from datetime import datetime
 
+# indexes are created by migrations.py, the declarations here keep the metadata in step
+
+# wall-clock time stored as 'HH:MM:SS' text on sqlite (the default format adds microseconds)
+ClockTime = db.Time().with_variant(
+    sqlite.TIME(storage_format="%(hour)02d:%(minute)02d:%(second)02d", regexp=r"(\d+):(\d+):(\d+)"),
+    "sqlite"
+)
+
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_role_active_name', 'role', 'active', 'name'),
+        db.Index('ix_users_role_created_at', 'role', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(150), nullable = False)
     email = db.Column(db.String(150),unique = True, nullable = False)
@@ -40,11 +54,20 @@ class Department(db.Model):
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        db.Index('ix_appointments_doctor_date_time', 'doctor_id', 'date', 'time'),
+        # only one active booking per slot, cancelled/completed rows don't count
+        db.Index('uq_appointments_active_slot', 'doctor_id', 'date', 'time',
+                 unique=True, sqlite_where=text("status = 'Booked'")),
+        db.Index('ix_appointments_patient_date_time', 'patient_id', 'date', 'time'),
+        db.Index('ix_appointments_created_at', 'created_at'),
+        db.Index('ix_appointments_booked_date', 'date', sqlite_where=text("status = 'Booked'")),
+    )
     id = db.Column(db.Integer, primary_key = True)
     patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
-    date = db.Column(db.String(30), nullable = False)
-    time = db.Column(db.String(30), nullable = False)
+    date = db.Column(db.Date, nullable = False)
+    time = db.Column(ClockTime, nullable = False)
     status = db.Column(db.String(50), nullable = False, default = 'Booked')
     created_at = db.Column(db.DateTime, default = datetime.utcnow)
     treatments = db.relationship('Treatment', backref='appointment', lazy=True)
@@ -52,22 +75,86 @@ class Appointment(db.Model):
     
 class Treatment(db.Model):
     __tablename__ = 'treatments'
+    __table_args__ = (
+        db.Index('ix_treatments_appointment_id', 'appointment_id'),
+        db.Index('ix_treatments_follow_up_date', 'follow_up_date'),
+    )
     id = db.Column(db.Integer, primary_key = True)
     appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id'), nullable = False)
     diagnosis = db.Column(db.Text, nullable = False)
     prescription = db.Column(db.Text, nullable = False)
-    follow_up_date = db.Column(db.String(30), nullable = True)
+    follow_up_date = db.Column(db.Date, nullable = True)
     notes = db.Column(db.Text, nullable = True)
     created_at = db.Column(db.DateTime, default = datetime.utcnow)
+    # lets a list know there are notes without loading them (see queries.patient_history)
+    has_notes = db.column_property(notes.isnot(None))
+
+class ArchivedAppointment(db.Model):
+    # closed appointments moved out of the live table by archive.py, ids kept
+    __tablename__ = 'appointments_archive'
+    __table_args__ = (
+        db.Index('ix_appointments_archive_patient_date_time', 'patient_id', 'date', 'time'),
+    )
+    id = db.Column(db.Integer, primary_key = True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    date = db.Column(db.Date, nullable = False)
+    time = db.Column(ClockTime, nullable = False)
+    status = db.Column(db.String(50), nullable = False)
+    created_at = db.Column(db.DateTime)
+    patient = db.relationship('User', foreign_keys=[patient_id])
+    doctor = db.relationship('User', foreign_keys=[doctor_id])
+    treatments = db.relationship('ArchivedTreatment', backref='appointment', lazy=True)
+
+
+class ArchivedTreatment(db.Model):
+    __tablename__ = 'treatments_archive'
+    __table_args__ = (
+        db.Index('ix_treatments_archive_appointment_id', 'appointment_id'),
+    )
+    id = db.Column(db.Integer, primary_key = True)
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments_archive.id'), nullable = False)
+    diagnosis = db.Column(db.Text, nullable = False)
+    prescription = db.Column(db.Text, nullable = False)
+    follow_up_date = db.Column(db.Date, nullable = True)
+    notes = db.Column(db.Text, nullable = True)
+    created_at = db.Column(db.DateTime)
+    has_notes = db.column_property(notes.isnot(None))
 
 class DoctorAvailability(db.Model):
     __tablename__ = 'doctor_availability'
+    __table_args__ = (
+        db.Index('ix_doctor_availability_doctor_date', 'doctor_id', 'date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    date = db.Column(db.String(20), nullable=False) 
-    start_time = db.Column(db.String(10), nullable=True)
-    end_time = db.Column(db.String(10), nullable=True)
+    date = db.Column(db.Date, nullable=False)
+    start_time = db.Column(ClockTime, nullable=True)
+    end_time = db.Column(ClockTime, nullable=True)
     is_available = db.Column(db.Boolean, default=False, nullable=False)
     doctor = db.relationship('User', backref='availability')
 
 
+class AvailabilityTemplate(db.Model):
+    # a doctor's usual hours per weekday (0 = Monday); doctor_availability rows are
+    # the exceptions for single dates, see availability.py
+    __tablename__ = 'availability_templates'
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    weekday = db.Column(db.Integer, primary_key=True)
+    start_time = db.Column(ClockTime, nullable=True)
+    end_time = db.Column(ClockTime, nullable=True)
+    is_available = db.Column(db.Boolean, default=False, nullable=False)
+
+
+
+class SlotHold(db.Model):
+    # short-lived reservation of a slot while a patient confirms, see booking.py
+    __tablename__ = 'slot_holds'
+    __table_args__ = (
+        db.Index('ix_slot_holds_expires_at', 'expires_at'),
+    )
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    time = db.Column(ClockTime, primary_key=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,69 @@
+import base64
+from collections import namedtuple
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+# keyset (cursor) pagination on (created_at, id), newest first.
+# unlike OFFSET, the cost of fetching page N does not grow with N: the cursor
+# is the last row seen and the next page is a range scan starting just past it.
+
+PER_PAGE = 25
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+def encode_values(*values):
+    raw = "|".join(str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_values(cursor, *parsers):
+    """The values encode_values() packed, each run through its parser; None if garbled."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        parts = base64.urlsafe_b64decode(padded).decode().split('|')
+        if len(parts) != len(parsers):
+            return None
+        return tuple(parse(part) for parse, part in zip(parsers, parts))
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def encode_cursor(row):
+    return encode_values(row.created_at.isoformat(), row.id)
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) or None for a missing/garbled cursor."""
+    return decode_values(cursor, datetime.fromisoformat, int)
+
+
+def keyset_page(query, model, cursor=None, per_page=PER_PAGE):
+    position = decode_cursor(cursor)
+    if position:
+        created_at, row_id = position
+        # written as a row value sqlite seeks the (created_at, id) index to the cursor;
+        # the equivalent OR of the two comparisons scans every newer row first
+        query = query.filter(tuple_(model.created_at, model.id) < (created_at, row_id))
+
+    # one extra row tells us whether there is a next page without a COUNT(*)
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        return Page(rows, encode_cursor(rows[-1]))
+    return Page(rows, None)
+
+
+def url_with_args(**changes):
+    """url_for the current endpoint keeping the query string, with `changes` applied.
+
+    A value of None drops that argument.
+    """
+    args = request.args.to_dict()
+    args.update(changes)
+    args = {k: v for k, v in args.items() if v not in (None, '')}
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
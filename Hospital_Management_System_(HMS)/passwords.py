@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.local import LocalProxy
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from instrumentation import add_time
+
+# password hashing for login/register/add_doctor.
+#
+# PASSWORD_HASH_METHOD picks the werkzeug method and cost, e.g. "scrypt",
+# "scrypt:16384:8:1" or "pbkdf2:sha256:600000". hashes made with anything else
+# are upgraded on the next successful login (needs_rehash).
+#
+# the hashing runs on a small thread pool (hashlib releases the GIL, so the
+# threads really run in parallel) with a cap on how much work may be queued.
+# when the cap is hit we refuse straight away instead of letting logins pile up
+# and tie up every worker, the other routes keep answering.
+#
+# LoginThrottle rejects floods before any hashing happens. its counters live in
+# this process, so with N gunicorn workers the effective limits are up to N times
+# the configured ones.
+#
+# every app gets its own hasher and throttle (init_app), `hasher` and `throttle`
+# are the current app's.
+
+DEFAULT_METHOD = "scrypt"
+
+
+class HasherBusy(Exception):
+    """Too many password checks are already queued."""
+
+
+@lru_cache(maxsize=16)
+def method_prefix(method):
+    # werkzeug fills in default costs ("scrypt" -> "scrypt:32768:8:1"), so compare
+    # against what it actually writes rather than the configured string. costs one
+    # hash, so it runs on first use rather than at startup
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=None, pending=None):
+        self.method = method
+        workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+        self.slots = threading.BoundedSemaphore(pending or workers * 4)
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy()
+        started = time.perf_counter()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+            add_time('hash', time.perf_counter() - started)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split("$", 1)[0] != method_prefix(self.method)
+
+
+class LoginThrottle:
+    """Sliding-window limits: failed logins per account, login attempts per IP."""
+
+    def __init__(self, window=300, max_failures=5, max_per_ip=30):
+        self.window = window
+        self.max_failures = max_failures
+        self.max_per_ip = max_per_ip
+        self.failures = {}   # email -> deque of timestamps
+        self.attempts = {}   # ip -> deque of timestamps
+        self.lock = threading.Lock()
+
+    def _recent(self, table, key, now):
+        hits = table.get(key)
+        if hits is None:
+            return 0
+        while hits and hits[0] <= now - self.window:
+            hits.popleft()
+        if not hits:
+            del table[key]
+            return 0
+        return len(hits)
+
+    def _sweep(self, table, now):
+        if len(table) > 10000:
+            for key in list(table):
+                self._recent(table, key, now)
+
+    def allow(self, email, ip):
+        """Count an attempt from `ip`; False when the account or the IP is over its limit."""
+        now = time.monotonic()
+        with self.lock:
+            self._sweep(self.attempts, now)
+            if self._recent(self.failures, email, now) >= self.max_failures:
+                return False
+            if self._recent(self.attempts, ip, now) >= self.max_per_ip:
+                return False
+            self.attempts.setdefault(ip, deque()).append(now)
+            return True
+
+    def failed(self, email):
+        now = time.monotonic()
+        with self.lock:
+            self._sweep(self.failures, now)
+            self.failures.setdefault(email, deque()).append(now)
+
+    def succeeded(self, email):
+        with self.lock:
+            self.failures.pop(email, None)
+
+
+def init_app(app):
+    """Give `app` its own hasher (PASSWORD_HASH_*) and login throttle (LOGIN_*)."""
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+        app.config.get('PASSWORD_HASH_WORKERS'),
+        app.config.get('PASSWORD_HASH_MAX_PENDING'))
+    app.extensions['login_throttle'] = LoginThrottle(
+        app.config.get('LOGIN_THROTTLE_WINDOW', 300),
+        app.config.get('LOGIN_MAX_FAILURES_PER_ACCOUNT', 5),
+        app.config.get('LOGIN_MAX_ATTEMPTS_PER_IP', 30))
+
+
+# the current app's
+hasher = LocalProxy(lambda: current_app.extensions['password_hasher'])
+throttle = LocalProxy(lambda: current_app.extensions['login_throttle'])
+
+
+def benchmark(seconds=3.0, threads=None, method=None):
+    """Verify one hash in a loop on `threads` threads; returns (verifications/s, per core)."""
+    method = method or hasher.method
+    threads = threads or os.cpu_count() or 1
+    pwhash = generate_password_hash("correct horse", method=method)
+    done = [0] * threads
+    deadline = time.monotonic() + seconds
+
+    def loop(i):
+        while time.monotonic() < deadline:
+            check_password_hash(pwhash, "correct horse")
+            done[i] += 1
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(loop, range(threads)))
+    rate = sum(done) / (time.monotonic() - started)
+    return rate, rate / min(threads, os.cpu_count() or 1)
@@ -0,0 +1,184 @@
+from datetime import date, time, timedelta
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event, and_, or_, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload
+
+from extensions import db
+from models import User, Department, Appointment, Treatment, ArchivedAppointment, ArchivedTreatment
+from pagination import Page, encode_values, decode_values
+
+# shared queries for the dashboards.
+# every relationship in models.py is lazy=True, so a template that touches
+# appt.patient / appt.doctor.department / appt.treatments for each row fires
+# extra SELECTs per row. these helpers load the whole graph up front instead.
+
+# upper bound on SQL statements a single dashboard render may issue,
+# independent of how many rows it shows
+QUERY_BUDGET = 12
+
+# "No-Show" is set by the sweep in jobs.py
+APPOINTMENT_STATUSES = ("Booked", "Completed", "Cancelled", "No-Show")
+
+HISTORY_PAGE_SIZE = 20
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context() and g.get('query_count') is not None:
+        g.query_count += 1
+
+
+def query_budget(limit=QUERY_BUDGET):
+    """Count the statements a view runs (render included) and complain past `limit`.
+
+    Under app.testing this raises, so any test that renders a dashboard fails
+    as soon as an N+1 sneaks back in. Otherwise it only logs a warning.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            g.query_count = 0
+            rv = view(*args, **kwargs)
+            count, g.query_count = g.query_count, None
+            if count > limit:
+                msg = f"{view.__name__} ran {count} queries (budget {limit})"
+                if current_app.testing:
+                    raise AssertionError(msg)
+                current_app.logger.warning(msg)
+            return rv
+        return wrapped
+    return decorator
+
+
+def appointment_graph():
+    """Loader options for an appointment row plus everything the templates show."""
+    return (
+        joinedload(Appointment.patient),
+        joinedload(Appointment.doctor).joinedload(User.department),
+        selectinload(Appointment.treatments),
+    )
+
+
+def upcoming(today=None):
+    """Booked and not in the past. Pairs with the (doctor_id|patient_id, date, time) indexes."""
+    today = today or date.today()
+    return and_(Appointment.status == "Booked", Appointment.date >= today)
+
+
+def past(today=None):
+    # exact complement of upcoming()
+    today = today or date.today()
+    return or_(Appointment.status != "Booked", Appointment.date < today)
+
+
+def within_days(column, days, start=None):
+    """`column` falls in the `days` days starting at `start` (today by default)."""
+    start = start or date.today()
+    return column.between(start, start + timedelta(days=days - 1))
+
+
+def appointments_query():
+    return Appointment.query.options(*appointment_graph())
+
+
+def doctors_query():
+    return User.query.filter_by(role='doctor').options(joinedload(User.department))
+
+
+def patients_query():
+    return User.query.filter_by(role='patient')
+
+
+def departments_query():
+    return Department.query.order_by(Department.name)
+
+
+def doctor_appointments(doctor_id):
+    # doctor is current_user, only the patient side needs loading
+    return Appointment.query.filter_by(doctor_id=doctor_id).options(
+        joinedload(Appointment.patient)
+    )
+
+
+def patient_appointments(patient_id):
+    return Appointment.query.filter_by(patient_id=patient_id).options(
+        joinedload(Appointment.doctor).joinedload(User.department)
+    )
+
+
+# completed visits live in two tables, see archive.py
+HISTORY_TABLES = ((Appointment, Treatment), (ArchivedAppointment, ArchivedTreatment))
+
+
+def patient_history(patient_id, model=Appointment, treatment=Treatment):
+    # notes can be long and are only shown for an expanded visit, so they stay
+    # deferred: reading treatment.notes loads them for that one row
+    return model.query.filter_by(patient_id=patient_id, status="Completed").options(
+        joinedload(model.doctor).joinedload(User.department),
+        selectinload(model.treatments).defer(treatment.notes),
+    )
+
+
+def history_page(patient_id, cursor=None, per_page=HISTORY_PAGE_SIZE):
+    """One page of completed visits, live and archived, newest first, keyset on (date, time, id).
+
+    Each table is read with the same keyset on its (patient_id, date, time) index
+    and the two short lists are merged, so a deep page costs the same as the first.
+    Treatments for the page come in one extra SELECT ... IN per table.
+    """
+    position = decode_values(cursor, date.fromisoformat, time.fromisoformat, int)
+    rows = []
+    for model, treatment in HISTORY_TABLES:
+        query = patient_history(patient_id, model, treatment)
+        if position:
+            query = query.filter(tuple_(model.date, model.time, model.id) < position)
+        rows += query.order_by(model.date.desc(), model.time.desc(), model.id.desc()).limit(per_page + 1).all()
+    rows.sort(key=lambda appt: (appt.date, appt.time, appt.id), reverse=True)
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        return Page(rows, encode_values(last.date.isoformat(), last.time.isoformat(), last.id))
+    return Page(rows, None)
+
+
+def find_appointment(appt_id, **filters):
+    """The appointment with this id from the live table, else from the archive (None if neither)."""
+    return (Appointment.query.filter_by(id=appt_id, **filters).first()
+            or ArchivedAppointment.query.filter_by(id=appt_id, **filters).first())
+
+
+def appointment_filters(args):
+    """Read the admin appointment filters from a query string, dropping invalid values."""
+    filters = {}
+    status = args.get('status', '').strip()
+    if status in APPOINTMENT_STATUSES:
+        filters['status'] = status
+    for key in ('doctor_id', 'department_id'):
+        value = args.get(key, type=int)
+        if value:
+            filters[key] = value
+    for key in ('date_from', 'date_to'):
+        try:
+            filters[key] = date.fromisoformat(args.get(key, '').strip())
+        except ValueError:
+            continue
+    return filters
+
+
+def filter_appointments(query, filters):
+    if 'status' in filters:
+        query = query.filter(Appointment.status == filters['status'])
+    if 'doctor_id' in filters:
+        query = query.filter(Appointment.doctor_id == filters['doctor_id'])
+    if 'department_id' in filters:
+        # subquery instead of a join so it composes with the joinedload of Appointment.doctor
+        dept_doctors = db.select(User.id).where(User.specialization_id == filters['department_id'])
+        query = query.filter(Appointment.doctor_id.in_(dept_doctors))
+    if 'date_from' in filters:
+        query = query.filter(Appointment.date >= filters['date_from'])
+    if 'date_to' in filters:
+        query = query.filter(Appointment.date <= filters['date_to'])
+    return query
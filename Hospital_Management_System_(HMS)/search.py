@@ -0,0 +1,113 @@
+import re
+
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import joinedload
+
+from extensions import db
+from models import User, Department
+
+# full-text search over users, backed by the sqlite FTS5 table user_search
+# (created in migrations.py). rowid is users.id; the department column holds the
+# doctor's department name so "cardio" finds cardiologists without a join.
+# the index is kept in step by the mapper events at the bottom of this file,
+# which write through the same connection/transaction as the ORM flush.
+
+FIELDS = ('name', 'email', 'contact_number', 'department')
+
+# bm25 weights in FIELDS order: a name hit outranks an email or department hit
+WEIGHTS = (10.0, 2.0, 1.0, 5.0)
+
+DEFAULT_LIMIT = 50
+
+
+def match_expression(term, fields=FIELDS):
+    """FTS5 MATCH string: every word of `term` as a prefix, restricted to `fields`.
+
+    Returns None when the term has nothing searchable in it.
+    """
+    tokens = re.findall(r'\w+', term.lower())
+    if not tokens:
+        return None
+    words = " AND ".join(f'"{token}"*' for token in tokens)
+    return f"{{{' '.join(fields)}}} : ({words})"
+
+
+def search_users(term, role, fields=FIELDS, limit=DEFAULT_LIMIT, active_only=False):
+    """Users with `role` matching `term`, best match first.
+
+    A purely numeric term is also tried as an exact user id, which ranks first.
+    """
+    term = term.strip()
+    ids = []
+    if term.isdigit():
+        ids.append(int(term))
+
+    match = match_expression(term, fields)
+    if match:
+        weights = ", ".join(str(w) for w in WEIGHTS)
+        rows = db.session.execute(text(f"""
+            SELECT user_search.rowid FROM user_search
+            JOIN users ON users.id = user_search.rowid
+            WHERE user_search MATCH :match AND users.role = :role
+            {'AND users.active = 1' if active_only else ''}
+            ORDER BY bm25(user_search, {weights})
+            LIMIT :limit"""), {'match': match, 'role': role, 'limit': limit})
+        ids.extend(row[0] for row in rows if row[0] not in ids)
+
+    if not ids:
+        return []
+    query = User.query.filter(User.id.in_(ids), User.role == role).options(joinedload(User.department))
+    if active_only:
+        query = query.filter(User.active == True)
+    found = {user.id: user for user in query}
+    return [found[i] for i in ids[:limit] if i in found]
+
+
+def rebuild(connection):
+    """Repopulate the whole index from users/departments."""
+    connection.execute(text("DELETE FROM user_search"))
+    connection.execute(text("""
+        INSERT INTO user_search (rowid, name, email, contact_number, department)
+        SELECT users.id, users.name, users.email, users.contact_number, departments.name
+        FROM users LEFT JOIN departments ON departments.id = users.specialization_id"""))
+
+
+def _index_user(connection, user):
+    department = None
+    if user.specialization_id:
+        department = connection.execute(
+            text("SELECT name FROM departments WHERE id = :id"), {'id': user.specialization_id}
+        ).scalar()
+    connection.execute(text("DELETE FROM user_search WHERE rowid = :id"), {'id': user.id})
+    connection.execute(text("""
+        INSERT INTO user_search (rowid, name, email, contact_number, department)
+        VALUES (:id, :name, :email, :contact_number, :department)"""),
+        {'id': user.id, 'name': user.name, 'email': user.email,
+         'contact_number': user.contact_number, 'department': department})
+
+
+@event.listens_for(User, 'after_insert')
+def _user_inserted(mapper, connection, user):
+    _index_user(connection, user)
+
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, user):
+    state = inspect(user)
+    if any(state.attrs[key].history.has_changes()
+           for key in ('name', 'email', 'contact_number', 'specialization_id')):
+        _index_user(connection, user)
+
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, user):
+    connection.execute(text("DELETE FROM user_search WHERE rowid = :id"), {'id': user.id})
+
+
+@event.listens_for(Department, 'after_update')
+def _department_renamed(mapper, connection, dept):
+    if inspect(dept).attrs.name.history.has_changes():
+        connection.execute(text("""
+            UPDATE user_search SET department = :name
+            WHERE rowid IN (SELECT id FROM users WHERE specialization_id = :id)"""),
+            {'name': dept.name, 'id': dept.id})
@@ -0,0 +1,195 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+import counters
+import free_slots
+import search
+
+# synthetic data at realistic volume, for benchmark.py and for trying changes at scale.
+#
+# rows go in with plain executemany in batches of `batch_size` and explicit ids, so
+# treatments can point at appointments without reading anything back. that skips
+# the ORM, so the mapper/session hooks don't run: the search index and the counters
+# are rebuilt once at the end instead (search.rebuild, counters.reconcile), and the
+# free slot index starts over (free_slots.reset).
+#
+# every generated email ends in @<tag>.hms.test; seeding again needs another tag.
+
+SPECIALTIES = [
+    "Cardiology", "Neurology", "Orthopedics", "Pediatrics", "Dermatology", "Oncology",
+    "Gastroenterology", "Psychiatry", "Radiology", "Urology", "Nephrology", "Pulmonology",
+    "Endocrinology", "Rheumatology", "Ophthalmology", "ENT", "Gynecology", "General Surgery",
+    "Emergency Medicine", "Anesthesiology", "Hematology", "Infectious Disease",
+]
+FIRST = ["Aarav", "Sita", "Ram", "Gita", "Hari", "Maya", "John", "Mary", "Ali", "Sara", "Chen", "Ana",
+         "Ravi", "Nina", "Omar", "Lena", "Ivan", "Priya", "Kiran", "Asha", "Bikash", "Sunita", "Tom", "Eva"]
+LAST = ["Sharma", "Thapa", "Gurung", "Shrestha", "Rai", "Khan", "Smith", "Garcia", "Lee", "Kim",
+        "Patel", "Singh", "Brown", "Lopez", "Adhikari", "Karki", "Tamang", "Magar", "Novak", "Silva"]
+DIAGNOSES = ["Seasonal flu", "Hypertension", "Type 2 diabetes", "Migraine", "Back pain", "Asthma",
+             "Gastritis", "Sprained ankle", "Anxiety", "Allergic rhinitis", "Dermatitis", "Anemia"]
+PRESCRIPTIONS = ["Paracetamol 500mg", "Amlodipine 5mg", "Metformin 500mg", "Ibuprofen 400mg",
+                 "Salbutamol inhaler", "Omeprazole 20mg", "Cetirizine 10mg", "Rest and fluids"]
+SHIFTS = [(9, 17), (9, 17), (9, 17), (8, 12), (13, 18), (10, 16)]
+SLOT_TIMES = [f"{9 + i // 2:02d}:{30 * (i % 2):02d}:00" for i in range(16)]   # 09:00 .. 16:30
+
+
+def _ts(value):
+    # sqlalchemy's sqlite DateTime format, keyset pagination compares these as text
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+def _next_id(connection, table):
+    return (connection.execute(text(f"SELECT MAX(id) FROM {table}")).scalar() or 0) + 1
+
+
+def _insert(connection, sql, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        connection.exec_driver_sql(sql, rows[start:start + batch_size])
+        connection.commit()
+
+
+def _name(rng):
+    return f"{rng.choice(FIRST)} {rng.choice(LAST)}"
+
+
+def generate(connection, departments, doctors, patients, appointments, history_days,
+             availability_days, batch_size, password_hash, tag="seed", seed=0, today=None,
+             progress=print):
+    """Insert the synthetic data through `connection` (committing per batch). Returns row counts."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    now = datetime.utcnow()
+    domain = f"@{tag}.hms.test"
+    if connection.execute(text("SELECT 1 FROM users WHERE email LIKE :pattern LIMIT 1"),
+                          {'pattern': f"%{domain}"}).first():
+        raise ValueError(f"this database is already seeded with tag {tag!r}, pick another one")
+    started = time.monotonic()
+
+    def step(label, count):
+        progress(f"{label:28s} {count:>10,d} rows   {time.monotonic() - started:7.1f} s")
+
+    # departments: reuse the ones that already exist by name
+    existing = dict(connection.execute(text("SELECT name, id FROM departments")).all())
+    names = [SPECIALTIES[i % len(SPECIALTIES)] + (f" {i // len(SPECIALTIES) + 1}" if i >= len(SPECIALTIES) else "")
+             for i in range(departments)]
+    new = [(name, f"{name} department") for name in names if name not in existing]
+    if new:
+        connection.exec_driver_sql("INSERT INTO departments (name, description) VALUES (?, ?)", new)
+        connection.commit()
+        existing = dict(connection.execute(text("SELECT name, id FROM departments")).all())
+    dept_ids = [existing[name] for name in names]
+    step("departments", len(new))
+
+    # users: doctors then patients, contiguous ids
+    first_user = _next_id(connection, "users")
+    doctor_ids = range(first_user, first_user + doctors)
+    patient_ids = range(first_user + doctors, first_user + doctors + patients)
+    user_sql = """INSERT INTO users (id, name, email, password, role, created_at, specialization_id,
+                  age, gender, contact_number, address, active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+    rows = []
+    for n, user_id in enumerate(doctor_ids):
+        joined = now - timedelta(days=rng.randrange(history_days * 3), seconds=rng.randrange(86400))
+        rows.append((user_id, _name(rng), f"dr{n}{domain}", password_hash, 'doctor', _ts(joined),
+                     dept_ids[n % len(dept_ids)], None, None, None, None, 1))
+    _insert(connection, user_sql, rows, batch_size)
+    step("doctors", doctors)
+    for start in range(0, patients, batch_size):
+        rows = []
+        for n in range(start, min(start + batch_size, patients)):
+            joined = now - timedelta(days=rng.randrange(history_days * 2), seconds=rng.randrange(86400))
+            rows.append((patient_ids[n], _name(rng), f"pt{n}{domain}", password_hash, 'patient', _ts(joined),
+                         None, rng.randint(1, 95), rng.choice(("male", "female", "other")),
+                         f"98{rng.randrange(10**8):08d}", f"Ward {rng.randint(1, 32)}, Kathmandu",
+                         0 if rng.random() < 0.02 else 1))
+        _insert(connection, user_sql, rows, batch_size)
+    step("patients", patients)
+
+    # availability: weekly hours for every doctor (most weekdays open), and a few
+    # dates of the window changed, mostly leave
+    template_sql = """INSERT INTO availability_templates (doctor_id, weekday, start_time, end_time, is_available)
+                      VALUES (?, ?, ?, ?, ?)"""
+    avail_sql = """INSERT INTO doctor_availability (doctor_id, date, start_time, end_time, is_available)
+                   VALUES (?, ?, ?, ?, ?)"""
+    days = [today + timedelta(days=i) for i in range(availability_days)]
+    templates = availability = 0
+    template_rows, rows = [], []
+    for doctor_id in doctor_ids:
+        shift = rng.choice(SHIFTS)
+        hours = (f"{shift[0]:02d}:00:00", f"{shift[1]:02d}:00:00")
+        open_days = set(rng.sample(range(7), rng.choice((5, 5, 6, 4))))
+        for weekday in range(7):
+            template_rows.append((doctor_id, weekday) + (hours + (1,) if weekday in open_days else (None, None, 0)))
+        for day in days:
+            if rng.random() < 0.05:
+                if day.weekday() in open_days:
+                    rows.append((doctor_id, day.isoformat(), None, None, 0))
+                else:
+                    rows.append((doctor_id, day.isoformat()) + hours + (1,))
+        if len(rows) >= batch_size:
+            _insert(connection, avail_sql, rows, batch_size)
+            availability += len(rows)
+            rows = []
+        if len(template_rows) >= batch_size:
+            _insert(connection, template_sql, template_rows, batch_size)
+            templates += len(template_rows)
+            template_rows = []
+    _insert(connection, avail_sql, rows, batch_size)
+    _insert(connection, template_sql, template_rows, batch_size)
+    availability += len(rows)
+    templates += len(template_rows)
+    step("availability_templates", templates)
+    step("doctor_availability", availability)
+
+    # appointments (+ a treatment for each completed one)
+    appt_sql = """INSERT INTO appointments (id, patient_id, doctor_id, date, time, status, created_at)
+                  VALUES (?, ?, ?, ?, ?, ?, ?)"""
+    treat_sql = """INSERT INTO treatments (appointment_id, diagnosis, prescription, follow_up_date, notes, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)"""
+    appt_id = _next_id(connection, "appointments")
+    span = history_days + availability_days
+    booked = set()   # one Booked row per (doctor, day, slot), as uq_appointments_active_slot demands
+    treatments = 0
+    for start in range(0, appointments, batch_size):
+        appt_rows, treat_rows = [], []
+        for _ in range(start, min(start + batch_size, appointments)):
+            doctor_id = rng.choice(doctor_ids)
+            offset = rng.randrange(span) - history_days
+            day = today + timedelta(days=offset)
+            slot = rng.randrange(len(SLOT_TIMES))
+            if rng.random() < 0.12:
+                status = "Cancelled"
+            elif offset < 0:
+                status = "Completed"
+            else:
+                key = (doctor_id * span + offset + history_days) * len(SLOT_TIMES) + slot
+                status = "Cancelled" if key in booked else "Booked"
+                booked.add(key)
+            created = datetime.combine(day, datetime.min.time()) - timedelta(
+                days=rng.randint(1, 30), seconds=rng.randrange(86400), microseconds=rng.randrange(10**6))
+            appt_rows.append((appt_id, rng.choice(patient_ids), doctor_id, day.isoformat(), SLOT_TIMES[slot],
+                              status, _ts(created)))
+            if status == "Completed":
+                follow_up = (day + timedelta(days=rng.randint(7, 60))).isoformat() if rng.random() < 0.2 else None
+                treat_rows.append((appt_id, rng.choice(DIAGNOSES), rng.choice(PRESCRIPTIONS), follow_up,
+                                   "Patient advised to rest.\nReview if symptoms persist." if rng.random() < 0.5 else None,
+                                   _ts(datetime.combine(day, datetime.min.time()) + timedelta(hours=17))))
+            appt_id += 1
+        _insert(connection, appt_sql, appt_rows, batch_size)
+        _insert(connection, treat_sql, treat_rows, batch_size)
+        treatments += len(treat_rows)
+    step("appointments", appointments)
+    step("treatments", treatments)
+
+    # the bulk inserts went around the ORM hooks
+    search.rebuild(connection)
+    connection.commit()
+    step("search index", doctors + patients)
+    counters.reconcile(connection)
+    free_slots.reset(connection)
+    connection.commit()
+    step("counters", 0)
+    return {'departments': len(new), 'doctors': doctors, 'patients': patients,
+            'availability_templates': templates, 'doctor_availability': availability, 'appointments': appointments, 'treatments': treatments}
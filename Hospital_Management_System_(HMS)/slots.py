@@ -0,0 +1,114 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from flask import current_app
+
+from extensions import db
+from models import Appointment, SlotHold
+import availability
+import queries
+
+# slot engine for book_appointment_form.
+# two small queries for the availability (weekly template and exceptions, see
+# availability.py), one for the horizon's active bookings, and the
+# per-day slot grid comes from a memo keyed on (start, end, interval), so the cost
+# of a view doesn't depend on how many appointments the doctor has had.
+
+DEFAULT_HORIZON_DAYS = 7
+DEFAULT_INTERVAL_MINUTES = 30
+
+
+def horizon_days():
+    return current_app.config.get('BOOKING_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)
+
+
+def interval_minutes():
+    return current_app.config.get('SLOT_INTERVAL_MINUTES', DEFAULT_INTERVAL_MINUTES)
+
+
+@lru_cache(maxsize=1024)
+def slot_grid(start, end, interval):
+    """Every slot start in [start, end) as a tuple of datetime.time. Memoized."""
+    if not start or not end or interval <= 0:
+        return ()
+    slots = []
+    current = datetime.combine(date.min, start)
+    end_dt = datetime.combine(date.min, end)
+    step = timedelta(minutes=interval)
+    while current < end_dt:
+        slots.append(current.time())
+        current += step
+    return tuple(slots)
+
+
+def booked_times(doctor_ids, start, days):
+    """{(doctor_id, date): set of times} holding an active (Booked) appointment in the horizon."""
+    rows = db.session.execute(
+        db.select(Appointment.doctor_id, Appointment.date, Appointment.time).where(
+            Appointment.doctor_id.in_(doctor_ids),
+            Appointment.status == "Booked",
+            queries.within_days(Appointment.date, days, start)
+        )
+    )
+    booked = defaultdict(set)
+    for doctor_id, day, time in rows:
+        booked[doctor_id, day].add(time)
+    return booked
+
+
+def held_times(doctor_ids, start, days, patient_id=None, now=None):
+    """{(doctor_id, date): set of times} under an unexpired hold by someone other than `patient_id`."""
+    now = now or datetime.utcnow()
+    rows = db.session.execute(
+        db.select(SlotHold.doctor_id, SlotHold.date, SlotHold.time).where(
+            SlotHold.doctor_id.in_(doctor_ids),
+            SlotHold.patient_id != (patient_id or 0),
+            SlotHold.expires_at > now,
+            queries.within_days(SlotHold.date, days, start)
+        )
+    )
+    held = defaultdict(set)
+    for doctor_id, day, time in rows:
+        held[doctor_id, day].add(time)
+    return held
+
+
+def available_slots(doctor_id, start=None, days=None, interval=None, patient_id=None):
+    """Open slots per available day, as the list book_appointment.html renders.
+
+    Slots held by other patients are left out; `patient_id`'s own holds stay visible.
+    """
+    return available_slots_many([doctor_id], start, days, interval, patient_id)[doctor_id]
+
+
+def available_slots_many(doctor_ids, start=None, days=None, interval=None, patient_id=None):
+    """{doctor_id: available_slots(...)} for several doctors, still in four queries."""
+    start = start or date.today()
+    days = days or horizon_days()
+    interval = interval or interval_minutes()
+    result = {doctor_id: [] for doctor_id in doctor_ids}
+
+    hours = availability.by_date_many(doctor_ids, days, start)
+    open_doctors = sorted({doctor_id for (doctor_id, _), avail in hours.items() if avail.is_available})
+    if not open_doctors:
+        return result
+    booked = booked_times(open_doctors, start, days)
+    held = held_times(open_doctors, start, days, patient_id)
+
+    for doctor_id in open_doctors:
+        for i in range(days):
+            day = start + timedelta(days=i)
+            avail = hours.get((doctor_id, day))
+            if not avail or not avail.is_available:
+                continue
+            taken = booked.get((doctor_id, day), set()) | held.get((doctor_id, day), set())
+            free = [t for t in slot_grid(avail.start_time, avail.end_time, interval) if t not in taken]
+            if free:
+                result[doctor_id].append({
+                    'date': day,
+                    'date_str': day.isoformat(),
+                    'day_name': day.strftime('%A'),
+                    'slots': [t.strftime('%H:%M') for t in free]
+                })
+    return result
@@ -0,0 +1,80 @@
+import os
+import sys
+
+import pytest
+
+# the app's modules are top-level (import booking, import cache ...), as under
+# `flask --app app` or gunicorn from the project directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+
+
+def app_config(path, **overrides):
+    """Settings for an app on the sqlite file at `path`: throwaway profile, no page cache,
+    identity cache in a file next to the database."""
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{path}",
+        'HMS_DB_PROFILE': 'test',
+        'CACHE_BACKEND': 'none',
+        'IDENTITY_CACHE_PATH': os.path.join(os.path.dirname(path), "identity.sqlite"),
+    }
+    config.update(overrides)
+    return config
+
+
+def make_app(path, **overrides):
+    """create_app() on `path`, with every migration applied."""
+    import migrations
+    from extensions import db
+    app = create_app(app_config(path, **overrides))
+    with app.app_context():
+        migrations.upgrade(db.engine)
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path / "hms.db")
+    yield app
+    from extensions import db
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def seeded(app):
+    """A small synthetic hospital (seed.py) plus an admin. Returns ids of a busy doctor, their
+    department and a patient with many visits.
+
+    seed.py leaves the free slot index empty, the first search builds it.
+    """
+    import seed
+    from extensions import db
+    from models import Appointment, User
+    with app.app_context():
+        with db.engine.connect() as conn:
+            seed.generate(conn, departments=4, doctors=12, patients=40, appointments=3000, history_days=60,
+                          availability_days=14, batch_size=1000, password_hash="-", progress=lambda line: None)
+        admin = User(name="admin", email="admin@hms.test", password="-", role='admin')
+        db.session.add(admin)
+        db.session.commit()
+
+        def busiest(column, *where):
+            return db.session.execute(db.select(column).where(*where).group_by(column)
+                                      .order_by(db.func.count().desc()).limit(1)).scalar()
+        doctor = db.session.get(User, busiest(Appointment.doctor_id))
+        return {
+            'admin': admin.id,
+            'doctor': doctor.id,
+            'department': doctor.specialization_id,
+            'patient': busiest(Appointment.patient_id, Appointment.status == "Completed"),
+        }
+
+
+def login(client, user_id):
+    """Sign `client` in as `user_id` without going through the password check."""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import login
+from extensions import db
+from models import Appointment, User
+
+# /api/v1 batches: every item gets its own result, and a bad item is reported
+# instead of being read loosely.
+
+TOMORROW = (date.today() + timedelta(days=1)).isoformat()
+
+
+@pytest.fixture
+def doctor(app):
+    """A doctor with no hours at all, signed in."""
+    with app.app_context():
+        doctor = User(name="API Doctor", email="doctor@api.test", password="-", role='doctor')
+        db.session.add(doctor)
+        db.session.commit()
+        doctor_id = doctor.id
+    client = app.test_client()
+    login(client, doctor_id)
+    return client, doctor_id
+
+
+def open_slots(client, doctor_id):
+    response = client.get(f"/api/v1/availability?doctor_id={doctor_id}")
+    assert response.status_code == 200
+    return {day['date']: day['slots'] for day in response.get_json()['doctors'][str(doctor_id)] if day['slots']}
+
+
+@pytest.mark.parametrize("flag", ["false", "no", 0, 1, None])
+def test_availability_flag_must_be_boolean(doctor, flag):
+    client, doctor_id = doctor
+    response = client.put("/api/v1/availability", json={'days': [
+        {'date': TOMORROW, 'start_time': "09:00", 'end_time': "10:00", 'is_available': flag}]})
+    assert response.status_code == 200
+    [result] = response.get_json()['results']
+    assert not result['ok'] and "is_available must be true or false" in result['error']
+    assert open_slots(client, doctor_id) == {}
+
+
+def test_availability_flag_true(doctor):
+    client, doctor_id = doctor
+    response = client.put("/api/v1/availability", json={'days': [
+        {'date': TOMORROW, 'start_time': "09:00", 'end_time': "10:00", 'is_available': True}]})
+    assert response.get_json()['results'] == [{'ok': True, 'date': TOMORROW}]
+    assert open_slots(client, doctor_id) == {TOMORROW: ["09:00", "09:30"]}
+
+
+def test_weekly_flag_must_be_boolean(doctor):
+    client, _ = doctor
+    response = client.put("/api/v1/availability/weekly", json={'weekdays': [
+        {'weekday': 0, 'start_time': "09:00", 'end_time': "10:00", 'is_available': "false"}]})
+    [result] = response.get_json()['results']
+    assert not result['ok'] and "is_available" in result['error']
+
+
+def test_atomic_must_be_boolean(doctor):
+    client, _ = doctor
+    response = client.put("/api/v1/availability", json={'days': [], 'atomic': "false"})
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def patient(app, doctor):
+    """The doctor above, open 09:00-10:00 tomorrow, and a signed-in patient."""
+    doctor_client, doctor_id = doctor
+    doctor_client.put("/api/v1/availability", json={'days': [
+        {'date': TOMORROW, 'start_time': "09:00", 'end_time': "10:00"}]})
+    with app.app_context():
+        patient = User(name="API Patient", email="patient@api.test", password="-", role='patient')
+        db.session.add(patient)
+        db.session.commit()
+        patient_id = patient.id
+    client = app.test_client()
+    login(client, patient_id)
+    return client, doctor_id
+
+
+def booked(app):
+    with app.app_context():
+        return sorted(appt.time.strftime('%H:%M') for appt in Appointment.query.filter_by(status="Booked"))
+
+
+def test_batch_reports_duplicate_slot(app, patient):
+    client, doctor_id = patient
+    response = client.post("/api/v1/appointments/batch", json={'items': [
+        {'doctor_id': doctor_id, 'date': TOMORROW, 'time': time} for time in ("09:00", "09:00", "09:30")]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['committed'] is True
+    assert [result['ok'] for result in body['results']] == [True, False, True]
+    assert "taken" in body['results'][1]['error']
+    assert booked(app) == ["09:00", "09:30"]
+
+
+def test_atomic_batch_rolls_back_on_duplicate(app, patient):
+    client, doctor_id = patient
+    response = client.post("/api/v1/appointments/batch", json={'atomic': True, 'items': [
+        {'doctor_id': doctor_id, 'date': TOMORROW, 'time': time} for time in ("09:00", "09:00", "09:30")]})
+    assert response.status_code == 409
+    body = response.get_json()
+    assert body['committed'] is False and not any(result['ok'] for result in body['results'])
+    assert booked(app) == []
@@ -0,0 +1,77 @@
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import login
+from extensions import db
+from models import AvailabilityTemplate, DoctorAvailability, User
+
+# the dashboard form and the API write hours through availability.save_weekly() /
+# save_days(), which turn down an available day without a start before its end.
+
+TOMORROW = date.today() + timedelta(days=1)
+
+
+@pytest.fixture
+def doctor(app):
+    """A doctor with no hours at all, signed in."""
+    with app.app_context():
+        doctor = User(name="Form Doctor", email="doctor@form.test", password="-", role='doctor')
+        db.session.add(doctor)
+        db.session.commit()
+        doctor_id = doctor.id
+    client = app.test_client()
+    login(client, doctor_id)
+    return client, doctor_id
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return session.get('_flashes', [])
+
+
+def saved_rows(app, doctor_id):
+    with app.app_context():
+        return (AvailabilityTemplate.query.filter_by(doctor_id=doctor_id).count()
+                + DoctorAvailability.query.filter_by(doctor_id=doctor_id).count())
+
+
+@pytest.mark.parametrize("start, end", [("", "10:00"), ("10:00", "10:00"), ("11:00", "10:00")])
+def test_form_rejects_bad_hours_for_a_date(app, doctor, start, end):
+    client, doctor_id = doctor
+    day = TOMORROW.isoformat()
+    response = client.post("/doctor/update_availability", data={
+        'avail_date': day, f"start_time_{day}": start, f"end_time_{day}": end, f"is_available_{day}": "on"})
+    assert response.status_code == 302
+    assert flashes(client) == [("danger", "Availability not saved: an available day needs start_time before end_time.")]
+    assert saved_rows(app, doctor_id) == 0
+
+
+def test_form_rejects_bad_weekly_hours(app, doctor):
+    client, doctor_id = doctor
+    response = client.post("/doctor/update_availability", data={
+        'weekday': ["0", "1"],
+        'start_time_w0': "09:00", 'end_time_w0': "17:00", 'is_available_w0': "on",
+        'start_time_w1': "17:00", 'end_time_w1': "09:00", 'is_available_w1': "on"})
+    assert response.status_code == 302
+    [(category, _)] = flashes(client)
+    assert category == "danger"
+    # the good Monday isn't saved either
+    assert saved_rows(app, doctor_id) == 0
+
+
+def test_form_saves_good_hours(app, doctor):
+    client, doctor_id = doctor
+    day = TOMORROW.isoformat()
+    client.post("/doctor/update_availability", data={
+        'avail_date': day, f"start_time_{day}": "09:00", f"end_time_{day}": "10:00", f"is_available_{day}": "on"})
+    assert flashes(client) == [("success", "Availability updated successfully.")]
+    assert saved_rows(app, doctor_id) == 1
+
+
+def test_closed_day_needs_no_hours(app, doctor):
+    client, doctor_id = doctor
+    client.post("/doctor/update_availability", data={
+        'weekday': "2", 'start_time_w2': "", 'end_time_w2': ""})
+    assert flashes(client) == [("success", "Availability updated successfully.")]
+    assert saved_rows(app, doctor_id) == 1
@@ -0,0 +1,87 @@
+import multiprocessing
+from collections import Counter
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import create_app
+from conftest import app_config, make_app
+from extensions import db
+from models import Appointment, DoctorAvailability, SlotHold, User
+import booking
+
+# many processes go for the same slot at once, each with its own app and
+# connection, against a WAL database like a deployment with several gunicorn
+# workers. exactly one may win, every other one must be told the slot is taken
+# (not "database is locked").
+
+PROCESSES = 24
+SLOT = time(10, 0)
+
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                                reason="needs the fork start method")
+
+
+def race_config(path):
+    # the development profile: journal_mode=WAL and a busy_timeout
+    return app_config(path, HMS_DB_PROFILE='development', TESTING=False)
+
+
+def _attempt(path, action, patient_id, doctor_id, day, barrier, results):
+    app = create_app(race_config(path))
+    with app.app_context():
+        barrier.wait()
+        try:
+            if action == 'book':
+                booking.book(patient_id, doctor_id, day, SLOT)
+            else:
+                booking.hold_slot(patient_id, doctor_id, day, SLOT)
+            results.put('won')
+        except booking.SlotTaken:
+            results.put('taken')
+        except Exception as e:
+            results.put(f"{type(e).__name__}: {e}")
+        db.engine.dispose()
+
+
+@pytest.fixture
+def clinic(tmp_path):
+    """(app, database path, day, doctor id, patient ids): one doctor open 09:00-17:00 tomorrow."""
+    path = tmp_path / "race.db"
+    app = make_app(path, **race_config(path))
+    day = date.today() + timedelta(days=1)
+    with app.app_context():
+        doctor = User(name="Race Doctor", email="doctor@race.test", password="-", role='doctor')
+        patients = [User(name=f"Patient {n}", email=f"p{n}@race.test", password="-", role='patient')
+                    for n in range(PROCESSES)]
+        db.session.add_all([doctor] + patients)
+        db.session.flush()
+        db.session.add(DoctorAvailability(doctor_id=doctor.id, date=day, start_time=time(9),
+                                          end_time=time(17), is_available=True))
+        db.session.commit()
+        doctor_id, patient_ids = doctor.id, [patient.id for patient in patients]
+        # nothing open across the fork
+        db.engine.dispose()
+    return app, path, day, doctor_id, patient_ids
+
+
+@pytest.mark.parametrize("action", ["book", "hold"])
+def test_exactly_one_wins(clinic, action):
+    app, path, day, doctor_id, patient_ids = clinic
+    ctx = multiprocessing.get_context('fork')
+    barrier, results = ctx.Barrier(len(patient_ids)), ctx.Queue()
+    workers = [ctx.Process(target=_attempt, args=(path, action, patient_id, doctor_id, day, barrier, results))
+               for patient_id in patient_ids]
+    for worker in workers:
+        worker.start()
+    outcomes = Counter(results.get(timeout=60) for _ in workers)
+    for worker in workers:
+        worker.join(timeout=60)
+
+    assert outcomes == {'won': 1, 'taken': len(patient_ids) - 1}
+    with app.app_context():
+        if action == 'book':
+            assert Appointment.query.filter_by(doctor_id=doctor_id, date=day, time=SLOT, status="Booked").count() == 1
+        else:
+            assert SlotHold.query.filter_by(doctor_id=doctor_id, date=day, time=SLOT).count() == 1
+        db.engine.dispose()
@@ -0,0 +1,41 @@
+from datetime import date
+
+import pytest
+
+from conftest import login, make_app
+from extensions import db
+from models import User
+
+# a doctor's cached view of a patient's history has to show visits that
+# import-data brings in, without waiting for the cache to expire.
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = make_app(tmp_path / "hms.db", CACHE_BACKEND='memory')
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_import_refreshes_cached_history(app, seeded, tmp_path):
+    with app.app_context():
+        doctor, patient = db.session.get(User, seeded['doctor']), db.session.get(User, seeded['patient'])
+        emails = doctor.email, patient.email
+    client = app.test_client()
+    login(client, seeded['doctor'])
+    url = f"/doctor/patient_history/{seeded['patient']}"
+    assert b"Imported diagnosis" not in client.get(url).data
+    assert client.get(url).data == client.get(url).data
+
+    appointments, treatments = tmp_path / "appointments.csv", tmp_path / "treatments.csv"
+    appointments.write_text("id,patient_email,doctor_email,date,time,status\n"
+                            f"900001,{emails[1]},{emails[0]},{date.today().isoformat()},23:30,Completed\n")
+    treatments.write_text("appointment_id,diagnosis,prescription,follow_up_date,notes\n"
+                          "900001,Imported diagnosis,Rest,,\n")
+    runner = app.test_cli_runner()
+    for entity, path in (("appointments", appointments), ("treatments", treatments)):
+        result = runner.invoke(args=["import-data", entity, str(path)])
+        assert "imported 1" in result.output, result.output
+
+    assert b"Imported diagnosis" in client.get(url).data
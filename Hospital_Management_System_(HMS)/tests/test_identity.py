@@ -0,0 +1,61 @@
+import re
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login, make_app
+from extensions import db
+
+# load_user serves role/active/name from the identity cache. a warm request must
+# not SELECT the user, and deactivating an account on one worker must sign it
+# out on every other worker at its next request. two create_app()s on the same
+# database and identity file stand in for two gunicorn workers.
+
+USER_SELECT = re.compile(r"\bFROM users\b.*\bWHERE users\.id = ", re.S)
+
+
+@pytest.fixture
+def app(tmp_path):
+    # page cache on, so a warm dashboard is served without touching the database
+    app = make_app(tmp_path / "hms.db", CACHE_BACKEND='memory')
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def other_worker(app, tmp_path):
+    app = make_app(tmp_path / "hms.db", CACHE_BACKEND='memory')
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def statements(app):
+    """Every SQL statement `app` runs from here on."""
+    ran = []
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", lambda conn, cursor, statement, *args: ran.append(statement))
+    return ran
+
+
+def test_warm_request_runs_no_user_query(app, seeded):
+    client = app.test_client()
+    login(client, seeded['patient'])
+    assert client.get("/dashboard/patient").status_code == 200
+    ran = statements(app)
+    assert client.get("/dashboard/patient").status_code == 200
+    assert not [statement for statement in ran if USER_SELECT.search(statement)], ran
+
+
+def test_deactivation_reaches_other_workers(app, other_worker, seeded):
+    patient = app.test_client()
+    login(patient, seeded['patient'])
+    assert patient.get("/dashboard/patient").status_code == 200
+
+    admin = other_worker.test_client()
+    login(admin, seeded['admin'])
+    assert admin.post(f"/admin/toggle_active/{seeded['patient']}").status_code == 302
+
+    response = patient.get("/dashboard/patient")
+    assert response.status_code == 302 and "/login" in response.location
@@ -0,0 +1,37 @@
+import re
+
+import pytest
+from sqlalchemy import create_engine
+
+import migrations
+import seed
+
+# what `flask check-indexes` checks, on a freshly migrated database: every hot
+# scheduling query's plan names its index and none of them reads appointments
+# or treatments row by row. run once empty and once with data and ANALYZE
+# statistics, which the planner weighs when it picks an index.
+
+FULL_SCAN = re.compile(r"\bSCAN (appointments|treatments)\b(?! USING)")
+
+
+@pytest.fixture(scope="module", params=["empty", "analyzed"])
+def engine(request, tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plans') / 'plans.db'}")
+    migrations.upgrade(engine)
+    if request.param == "analyzed":
+        with engine.connect() as conn:
+            seed.generate(conn, departments=4, doctors=20, patients=200, appointments=5000, history_days=90,
+                          availability_days=14, batch_size=1000, password_hash="-", progress=lambda line: None)
+            conn.exec_driver_sql("ANALYZE")
+            conn.commit()
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("description", [description for description, _, _ in migrations.HOT_QUERIES])
+def test_hot_query_uses_its_index(engine, description):
+    with engine.connect() as conn:
+        plans = {d: (index, plan, ok) for d, index, plan, ok in migrations.explain_hot_queries(conn)}
+    index, plan, ok = plans[description]
+    assert ok, f"expected {index}: {plan}"
+    assert not FULL_SCAN.search(plan), plan
@@ -0,0 +1,38 @@
+import logging
+
+from conftest import make_app
+from extensions import db
+from models import User
+
+# the slow query log must not leak what users typed in, and /metrics is not
+# public unless it is asked to be.
+
+
+def test_slow_query_log_has_no_parameters(tmp_path, caplog):
+    # every statement counts as slow
+    app = make_app(tmp_path / "hms.db", SLOW_QUERY_MS=0)
+    form = {'name': "Pat", 'email': "pat@hms.test", 'password': "secret1", 'confirm_password': "secret1",
+            'contact_number': "9800000001", 'address': "12 Lakeside Road"}
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        app.test_client().post("/register", data=form)
+    with app.app_context():
+        pwhash = db.session.execute(db.select(User.password).where(User.email == form['email'])).scalar()
+        db.engine.dispose()
+
+    logged = [record.getMessage() for record in caplog.records if "slow query" in record.getMessage()]
+    assert any("INSERT INTO users" in line for line in logged)
+    for secret in (pwhash, form['email'], form['contact_number'], form['address']):
+        assert not any(secret in line for line in logged), secret
+
+
+def test_metrics_closed_without_token(tmp_path):
+    app = make_app(tmp_path / "hms.db", TESTING=False)
+    assert app.test_client().get("/metrics").status_code == 401
+
+
+def test_metrics_with_token(tmp_path):
+    app = make_app(tmp_path / "hms.db", TESTING=False, METRICS_TOKEN="s3cret")
+    client = app.test_client()
+    assert client.get("/metrics", headers={'Authorization': "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={'Authorization': "Bearer s3cret"})
+    assert response.status_code == 200 and "hms_slow_queries_total" in response.get_data(as_text=True)
@@ -0,0 +1,116 @@
+import pytest
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from conftest import make_app
+from extensions import db
+from models import User
+
+# login goes through passwords.throttle before any hashing, refuses with 503
+# instead of queueing when the hasher is full, and upgrades hashes made with an
+# older method on a successful login.
+
+OLD_METHOD = "pbkdf2:sha256:1000"
+METHOD = "pbkdf2:sha256:2000"
+
+
+@pytest.fixture
+def new_app(tmp_path):
+    """make_app() with the cheap METHOD and extra `overrides`, disposed afterwards."""
+    apps = []
+
+    def new_app(**overrides):
+        apps.append(make_app(tmp_path / "hms.db", PASSWORD_HASH_METHOD=METHOD, **overrides))
+        return apps[-1]
+    yield new_app
+    for app in apps:
+        with app.app_context():
+            db.engine.dispose()
+
+
+def add_patient(app, email, password, method=METHOD):
+    with app.app_context():
+        user = User(name="Pat", email=email, password=generate_password_hash(password, method=method),
+                    role='patient')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def count_verifies(app, monkeypatch):
+    """A list that grows by one for every password the app checks."""
+    hasher = app.extensions['password_hasher']
+    verify, calls = hasher.verify, []
+
+    def counted(pwhash, password):
+        calls.append(pwhash)
+        return verify(pwhash, password)
+    monkeypatch.setattr(hasher, 'verify', counted)
+    return calls
+
+
+def log_in(client, email, password, ip="10.0.0.1"):
+    return client.post("/login", data={'email': email, 'password': password},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def test_account_throttled_before_hashing(new_app, monkeypatch):
+    app = new_app(LOGIN_MAX_FAILURES_PER_ACCOUNT=2)
+    add_patient(app, "pat@hms.test", "right")
+    verified = count_verifies(app, monkeypatch)
+    client = app.test_client()
+
+    assert log_in(client, "pat@hms.test", "wrong").status_code == 200
+    assert log_in(client, "pat@hms.test", "wrong", ip="10.0.0.2").status_code == 200
+    assert len(verified) == 2
+    # even the right password, from another address
+    assert log_in(client, "pat@hms.test", "right", ip="10.0.0.3").status_code == 429
+    assert len(verified) == 2
+
+
+def test_ip_throttled_before_hashing(new_app, monkeypatch):
+    app = new_app(LOGIN_MAX_ATTEMPTS_PER_IP=3)
+    for n in range(4):
+        add_patient(app, f"pat{n}@hms.test", "right")
+    verified = count_verifies(app, monkeypatch)
+    client = app.test_client()
+
+    for n in range(3):
+        assert log_in(client, f"pat{n}@hms.test", "wrong").status_code == 200
+    assert log_in(client, "pat3@hms.test", "right").status_code == 429
+    assert len(verified) == 3
+    assert log_in(client, "pat3@hms.test", "right", ip="10.0.0.2").status_code == 302
+
+
+def test_busy_hasher_refuses(new_app):
+    app = new_app(PASSWORD_HASH_MAX_PENDING=1)
+    add_patient(app, "pat@hms.test", "right")
+    slots = app.extensions['password_hasher'].slots
+    client = app.test_client()
+
+    # another login holds the only slot
+    assert slots.acquire(blocking=False)
+    try:
+        assert log_in(client, "pat@hms.test", "right").status_code == 503
+    finally:
+        slots.release()
+    assert log_in(client, "pat@hms.test", "right").status_code == 302
+
+
+def test_login_upgrades_old_hash(new_app):
+    app = new_app()
+    user_id = add_patient(app, "pat@hms.test", "right", method=OLD_METHOD)
+
+    assert log_in(app.test_client(), "pat@hms.test", "right").status_code == 302
+    with app.app_context():
+        pwhash = db.session.get(User, user_id).password
+    assert pwhash.startswith(METHOD + "$")
+    assert check_password_hash(pwhash, "right")
+
+
+def test_failed_login_keeps_old_hash(new_app):
+    app = new_app()
+    user_id = add_patient(app, "pat@hms.test", "right", method=OLD_METHOD)
+
+    assert log_in(app.test_client(), "pat@hms.test", "wrong").status_code == 200
+    with app.app_context():
+        assert db.session.get(User, user_id).password.startswith(OLD_METHOD + "$")
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import text
+
+from conftest import login
+from extensions import db
+from models import Appointment
+from queries import QUERY_BUDGET, query_budget
+
+# every dashboard render is wrapped in queries.query_budget(), which raises
+# AssertionError past QUERY_BUDGET statements when app.testing is set. the test
+# client lets that propagate, so rendering the pages against seeded data is the
+# check: an N+1 on any of the listed rows fails the request.
+
+PAGES = [
+    ('admin', "/dashboard/admin"),
+    ('admin', "/dashboard/admin?doctor_search=a&patient_search=a"),
+    ('admin', "/dashboard/admin?status=Completed"),
+    ('doctor', "/dashboard/doctor"),
+    ('patient', "/dashboard/patient"),
+    ('patient', "/dashboard/patient?search_query=a"),
+    ('doctor', "/doctor/patient_history/{patient}"),
+    # on a cold free slot index
+    ('patient', "/patient/next_available?department_id={department}"),
+    ('patient', "/patient/next_available?search_query=a&from=09:00&to=12:00"),
+]
+
+
+@pytest.mark.parametrize("role, url", PAGES)
+def test_dashboard_within_budget(app, seeded, role, url):
+    with app.app_context():
+        # enough rows that one query per row would blow the budget
+        assert Appointment.query.filter_by(doctor_id=seeded['doctor']).count() > QUERY_BUDGET
+        assert Appointment.query.filter_by(patient_id=seeded['patient']).count() > QUERY_BUDGET
+
+    client = app.test_client()
+    login(client, seeded[role])
+    response = client.get(url.format(**seeded))
+    assert response.status_code == 200
+
+
+def test_over_budget_fails_under_testing(app):
+    @query_budget(limit=1)
+    def chatty():
+        db.session.execute(text("SELECT 1"))
+        db.session.execute(text("SELECT 2"))
+        return "ok"
+
+    with app.test_request_context():
+        with pytest.raises(AssertionError, match="ran 2 queries"):
+            chatty()
@@ -0,0 +1,386 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from itertools import islice
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+import counters
+import free_slots
+import search
+from passwords import DEFAULT_METHOD
+from queries import APPOINTMENT_STATUSES
+
+# bulk import/export of departments, users, appointments and treatments as CSV or
+# NDJSON (one json object per line), for `flask import-data` / `flask export-data`.
+#
+# the columns (an export can be imported again):
+#   departments   name, description
+#   users         name, email, role, password, department, age, gender, contact_number, address, active
+#                 (role doctor|patient, department by name, password plain text:
+#                 exports leave it empty and the importer's --default-password fills in)
+#   appointments  id, patient_email, doctor_email, date, time, status (id may be empty)
+#   treatments    appointment_id, diagnosis, prescription, follow_up_date, notes
+#
+# appointment/treatment exports include the archived rows (archive.py), imports
+# always go into the live tables.
+#
+# exports read through a streaming cursor and write row by row, so memory stays flat
+# whatever the table size. imports read `chunk_size` rows at a time, validate each
+# one (a bad row is reported with its line number and skipped, the rest go in),
+# hash passwords on a process pool, and insert the chunk with one executemany.
+# a chunk the database rejects (unique email, one Booked row per slot, ...) is
+# retried row by row in savepoints so only the offending rows are lost.
+# inserts bypass the ORM hooks, so the search index and counters are rebuilt at the end.
+
+ENTITIES = ('departments', 'users', 'appointments', 'treatments')
+
+COLUMNS = {
+    'departments': ('name', 'description'),
+    'users': ('name', 'email', 'role', 'password', 'department', 'age', 'gender',
+              'contact_number', 'address', 'active'),
+    'appointments': ('id', 'patient_email', 'doctor_email', 'date', 'time', 'status'),
+    'treatments': ('appointment_id', 'diagnosis', 'prescription', 'follow_up_date', 'notes'),
+}
+
+EXPORT_SQL = {
+    'departments': "SELECT name, description FROM departments ORDER BY id",
+    'users': """SELECT users.name, users.email, users.role, '' AS password, departments.name AS department,
+                users.age, users.gender, users.contact_number, users.address, users.active
+                FROM users LEFT JOIN departments ON departments.id = users.specialization_id
+                WHERE users.role != 'admin' ORDER BY users.id""",
+    'appointments': """SELECT appointments.id, patients.email AS patient_email, doctors.email AS doctor_email,
+                       appointments.date, substr(appointments.time, 1, 5) AS time, appointments.status
+                       FROM appointments
+                       JOIN users AS patients ON patients.id = appointments.patient_id
+                       JOIN users AS doctors ON doctors.id = appointments.doctor_id
+                       ORDER BY appointments.id""",
+    'treatments': """SELECT appointment_id, diagnosis, prescription, follow_up_date, notes
+                     FROM treatments ORDER BY id""",
+}
+
+# archived rows (archive.py) go out first, they hold the older ids
+ARCHIVE_EXPORT_SQL = {
+    'appointments': """SELECT appointments.id, patients.email AS patient_email, doctors.email AS doctor_email,
+                       appointments.date, substr(appointments.time, 1, 5) AS time, appointments.status
+                       FROM appointments_archive AS appointments
+                       JOIN users AS patients ON patients.id = appointments.patient_id
+                       JOIN users AS doctors ON doctors.id = appointments.doctor_id
+                       ORDER BY appointments.id""",
+    'treatments': """SELECT appointment_id, diagnosis, prescription, follow_up_date, notes
+                     FROM treatments_archive ORDER BY id""",
+}
+
+INSERT_SQL = {
+    'departments': "INSERT INTO departments (name, description) VALUES (?, ?)",
+    'users': """INSERT INTO users (name, email, password, role, created_at, specialization_id,
+                age, gender, contact_number, address, active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    'appointments': """INSERT INTO appointments (id, patient_id, doctor_id, date, time, status, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+    'treatments': """INSERT INTO treatments (appointment_id, diagnosis, prescription, follow_up_date, notes, created_at)
+                     VALUES (?, ?, ?, ?, ?, ?)""",
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(filename, fmt=None):
+    if fmt:
+        return fmt
+    return 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+# export
+
+def export(connection, entity, out, fmt='csv', chunk_size=5000):
+    """Write every row of `entity` to the text stream `out`. Returns the row count."""
+    columns = COLUMNS[entity]
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        def write(row):
+            out.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+    count = 0
+    for sql in (ARCHIVE_EXPORT_SQL.get(entity), EXPORT_SQL[entity]):
+        if sql is None:
+            continue
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(text(sql))
+        for row in result:
+            write(row)
+            count += 1
+    return count
+
+
+# import
+
+def read_rows(stream, fmt='csv'):
+    """(line number, dict) for every record in `stream`; unparseable NDJSON lines yield the error."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, RowError(f"not valid json: {e.msg}")
+            continue
+        yield line_no, row if isinstance(row, dict) else RowError("expected a json object")
+
+
+def _text(row, key, required=False):
+    value = row.get(key)
+    value = "" if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f"{key} is required")
+    return value or None
+
+
+def _int(row, key, required=False):
+    value = _text(row, key, required)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise RowError(f"{key} must be a number, got {value!r}")
+
+
+def _date(row, key, required=False):
+    value = _text(row, key, required)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise RowError(f"{key} must be YYYY-MM-DD, got {value!r}")
+
+
+def _bool(row, key, default=True):
+    value = _text(row, key)
+    if value is None:
+        return default
+    if value.lower() in ('1', 'true', 'yes', 'y'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'n'):
+        return False
+    raise RowError(f"{key} must be true or false, got {value!r}")
+
+
+def _now():
+    return datetime.utcnow().isoformat(sep=' ', timespec='microseconds')
+
+
+def _lookup(connection, sql, values):
+    """{value: row} for an `IN :values` query, in one round trip."""
+    if not values:
+        return {}
+    stmt = text(sql).bindparams(bindparam('values', expanding=True))
+    return {row[0]: row[1:] for row in connection.execute(stmt, {'values': sorted(values)})}
+
+
+class Importer:
+    """Validates and inserts one entity's rows, chunk by chunk."""
+
+    def __init__(self, connection, entity, default_password=None, hash_method=None, pool=None):
+        self.connection = connection
+        self.entity = entity
+        self.default_password = default_password
+        self.hash_method = hash_method or DEFAULT_METHOD
+        self.pool = pool
+        self.seen = set()   # keys already in this file (emails, names, slots)
+        self.imported = 0
+        self.errors = []    # (line number, message)
+        self.departments = dict(connection.execute(text("SELECT name, id FROM departments")).all())
+
+    def run(self, rows, chunk_size):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            good = []
+            for line_no, row in chunk:
+                try:
+                    if isinstance(row, Exception):
+                        raise row
+                    good.append((line_no, getattr(self, f"parse_{self.entity}")(row)))
+                except RowError as e:
+                    self.errors.append((line_no, str(e)))
+            good = getattr(self, f"resolve_{self.entity}")(good)
+            self.insert(good)
+        return self.imported
+
+    def reject(self, line_no, message):
+        self.errors.append((line_no, message))
+
+    def once(self, key):
+        # False when this file already had `key`
+        if key in self.seen:
+            return False
+        self.seen.add(key)
+        return True
+
+    def insert(self, good):
+        if not good:
+            return
+        sql = INSERT_SQL[self.entity]
+        try:
+            with self.connection.begin_nested():
+                self.connection.exec_driver_sql(sql, [tuple(params) for _, params in good])
+            self.imported += len(good)
+        except IntegrityError:
+            # find the culprits one by one, keep the rest
+            for line_no, params in good:
+                try:
+                    with self.connection.begin_nested():
+                        self.connection.exec_driver_sql(sql, tuple(params))
+                    self.imported += 1
+                except IntegrityError as e:
+                    self.reject(line_no, f"rejected by the database: {e.orig}")
+        self.connection.commit()
+
+    # departments
+
+    def parse_departments(self, row):
+        return [_text(row, 'name', True), _text(row, 'description')]
+
+    def resolve_departments(self, good):
+        kept = []
+        for line_no, params in good:
+            if params[0] in self.departments or not self.once(params[0]):
+                self.reject(line_no, f"department {params[0]!r} already exists")
+            else:
+                kept.append((line_no, params))
+        return kept
+
+    # users
+
+    def parse_users(self, row):
+        email = _text(row, 'email', True).lower()
+        if '@' not in email:
+            raise RowError(f"not an email address: {email!r}")
+        role = _text(row, 'role', True).lower()
+        if role not in ('doctor', 'patient'):
+            raise RowError(f"role must be doctor or patient, got {role!r}")
+        department_id = None
+        department = _text(row, 'department')
+        if department:
+            if department not in self.departments:
+                raise RowError(f"unknown department {department!r}")
+            department_id = self.departments[department]
+        password = _text(row, 'password') or self.default_password
+        if not password:
+            raise RowError("password is required (or pass --default-password)")
+        if len(password) < 6:
+            raise RowError("password must be at least 6 characters")
+        age = _int(row, 'age')
+        if age is not None and age <= 0:
+            raise RowError("age must be a positive number")
+        # the password slot holds the plain text until resolve_users hashes it
+        return [_text(row, 'name', True), email, password, role, _now(), department_id, age,
+                _text(row, 'gender'), _text(row, 'contact_number'), _text(row, 'address'),
+                int(_bool(row, 'active'))]
+
+    def resolve_users(self, good):
+        taken = _lookup(self.connection, "SELECT email, id FROM users WHERE email IN :values",
+                        {params[1] for _, params in good})
+        kept = []
+        for line_no, params in good:
+            if params[1] in taken or not self.once(params[1]):
+                self.reject(line_no, f"email {params[1]} is already registered")
+            else:
+                kept.append((line_no, params))
+        passwords = [params[2] for _, params in kept]
+        if self.pool:
+            hashes = self.pool.map(generate_password_hash, passwords, [self.hash_method] * len(passwords),
+                                   chunksize=max(1, len(passwords) // (4 * (os.cpu_count() or 1))))
+        else:
+            hashes = (generate_password_hash(p, self.hash_method) for p in passwords)
+        for (_, params), pwhash in zip(kept, hashes):
+            params[2] = pwhash
+        return kept
+
+    # appointments
+
+    def parse_appointments(self, row):
+        status = _text(row, 'status') or "Booked"
+        if status not in APPOINTMENT_STATUSES:
+            raise RowError(f"status must be one of {', '.join(APPOINTMENT_STATUSES)}, got {status!r}")
+        time = _text(row, 'time', True)
+        try:
+            time = datetime.strptime(time[:5], '%H:%M').strftime('%H:%M:%S')
+        except ValueError:
+            raise RowError(f"time must be HH:MM, got {time!r}")
+        return [_int(row, 'id'), _text(row, 'patient_email', True).lower(), _text(row, 'doctor_email', True).lower(),
+                _date(row, 'date', True), time, status, _now()]
+
+    def resolve_appointments(self, good):
+        users = _lookup(self.connection, "SELECT email, id, role FROM users WHERE email IN :values",
+                        {params[1] for _, params in good} | {params[2] for _, params in good})
+        archived = _lookup(self.connection, "SELECT id FROM appointments_archive WHERE id IN :values",
+                           {params[0] for _, params in good if params[0] is not None})
+        kept = []
+        for line_no, params in good:
+            patient, doctor = users.get(params[1]), users.get(params[2])
+            if params[0] in archived:
+                self.reject(line_no, f"appointment {params[0]} is archived")
+            elif not patient or patient[1] != 'patient':
+                self.reject(line_no, f"no patient with email {params[1]}")
+            elif not doctor or doctor[1] != 'doctor':
+                self.reject(line_no, f"no doctor with email {params[2]}")
+            elif params[5] == "Booked" and not self.once((doctor[0], params[3], params[4])):
+                self.reject(line_no, "the slot is booked twice in this file")
+            else:
+                params[1], params[2] = patient[0], doctor[0]
+                kept.append((line_no, params))
+        return kept
+
+    # treatments
+
+    def parse_treatments(self, row):
+        return [_int(row, 'appointment_id', True), _text(row, 'diagnosis', True), _text(row, 'prescription', True),
+                _date(row, 'follow_up_date'), _text(row, 'notes'), _now()]
+
+    def resolve_treatments(self, good):
+        found = _lookup(self.connection, "SELECT id, status FROM appointments WHERE id IN :values",
+                        {params[0] for _, params in good})
+        kept = []
+        for line_no, params in good:
+            if params[0] not in found:
+                self.reject(line_no, f"no appointment {params[0]}")
+            else:
+                kept.append((line_no, params))
+        return kept
+
+
+def import_rows(connection, entity, rows, chunk_size=2000, default_password=None, hash_method=None, workers=None):
+    """Import `rows` ((line number, dict) pairs) into `entity`. Returns (imported, errors)."""
+    pool = None
+    if entity == 'users' and (workers or os.cpu_count() or 1) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    try:
+        importer = Importer(connection, entity, default_password, hash_method, pool)
+        importer.run(rows, chunk_size)
+    finally:
+        if pool:
+            pool.shutdown()
+    if importer.imported and entity in ('departments', 'users', 'appointments'):
+        if entity != 'appointments':
+            search.rebuild(connection)
+        else:
+            free_slots.reset(connection)
+        counters.reconcile(connection)
+        connection.commit()
+    return importer.imported, sorted(importer.errors)
@@ -0,0 +1,976 @@
+from sqlalchemy.exc import IntegrityError
+import calendar
+from datetime import datetime, date, timedelta
+from flask import Blueprint, Response, abort, current_app, render_template, request, redirect, url_for, flash, stream_with_context
+from flask_login import login_user, logout_user, login_required, current_user
+from markupsafe import Markup, escape
+
+from extensions import db, login_manager
+from models import User, Department, Appointment, Treatment, DoctorAvailability
+import availability
+import queries
+import slots
+import booking
+import free_slots
+import search
+import counters
+import identity
+import ledger
+import jobs
+from passwords import hasher, throttle, HasherBusy
+from cache import cache, cached_page, add_tags, user_tag, history_tag, DOCTOR_DIRECTORY, HISTORY
+from queries import query_budget
+from pagination import Page, keyset_page, url_with_args
+
+# every page of the app. registered by create_app() in app.py, endpoints are "main.<view>"
+bp = Blueprint('main', __name__)
+
+def parse_time(value):
+    # 'HH:MM' from the forms, None when left blank
+    return datetime.strptime(value, '%H:%M').time() if value else None
+
+@login_manager.user_loader
+def load_user(user_id):
+    # cached fields only, the full row loads on demand (identity.py)
+    return identity.load(int(user_id))
+
+bp.add_app_template_global(url_with_args)
+
+@bp.app_template_filter('hhmm')
+def hhmm(value):
+    return value.strftime('%H:%M') if value else ''
+
+@bp.app_template_filter('nl2br')
+def nl2br(value):
+    return Markup('<br>').join(escape(value or '').split('\n'))
+
+
+@bp.route("/")
+def index():
+    # redirect root to the registration page to avoid 404 when visiting '/'
+    return redirect(url_for('main.register'))
+
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    if current_user.is_authenticated:
+        if current_user.role == "admin":
+            return redirect(url_for("main.admin_dashboard"))
+        if current_user.role == "doctor":
+            return redirect(url_for("main.doctor_dashboard"))
+        if current_user.role == "patient":
+            return redirect(url_for("main.patient_dashboard"))
+
+    if request.method == "POST":
+        email = request.form.get("email", "").strip().lower()
+        password = request.form.get("password", "")
+
+        if not email or not password:
+            flash("Email and password are required.", "danger")
+            return render_template("login.html")
+
+        # throttled before any hashing work, see passwords.py
+        if not throttle.allow(email, request.remote_addr):
+            flash("Too many login attempts. Please wait a few minutes and try again.", "danger")
+            return render_template("login.html"), 429
+
+        user = User.query.filter_by(email=email).first()
+
+        if not user or not user.is_active:
+            throttle.failed(email)
+            flash("Invalid email or password. Please try again.", "danger")
+            return render_template("login.html")
+
+        try:
+            valid = hasher.verify(user.password, password)
+        except HasherBusy:
+            flash("The server is busy right now, please try again in a moment.", "danger")
+            return render_template("login.html"), 503
+
+        if not valid:
+            throttle.failed(email)
+            flash("Invalid email or password. Please try again.", "danger")
+            return render_template("login.html")
+
+        throttle.succeeded(email)
+
+        # upgrade hashes made with an older method/cost while we have the plain password
+        if hasher.needs_rehash(user.password):
+            try:
+                user.password = hasher.hash(password)
+                db.session.commit()
+            except HasherBusy:
+                pass  #next login ma garchha
+
+        login_user(user)
+        flash("Logged in successfully!", "success")
+
+        if user.role == "admin":
+            return redirect(url_for("main.admin_dashboard"))
+        elif user.role == "doctor":
+            return redirect(url_for("main.doctor_dashboard"))
+        else:
+            return redirect(url_for("main.patient_dashboard"))
+
+    return render_template("login.html")
+
+
+@bp.route("/logout")
+@login_required
+def logout():
+    logout_user()
+    flash("You have been logged out.", "success")
+    return redirect(url_for("main.login"))
+
+@bp.route("/register", methods=["GET", "POST"])
+def register():
+    #login vaisakeko huda redirect by role
+    if current_user.is_authenticated:
+        if current_user.role == "admin":
+            return redirect(url_for("main.admin_dashboard"))
+        if current_user.role == "doctor":
+            return redirect(url_for("main.doctor_dashboard"))
+        if current_user.role == "patient":
+            return redirect(url_for("main.patient_dashboard"))
+        
+    if request.method == "POST":
+        name = request.form.get("name", "").strip()
+        email = request.form.get("email", "").strip().lower()
+        password = request.form.get("password", "")
+        confirm = request.form.get("confirm_password", "")
+        age_raw = request.form.get("age", "").strip()
+        gender = request.form.get("gender", "").strip() or None
+        contact_number = request.form.get("contact_number", "").strip() or None
+        address = request.form.get("address", "").strip() or None
+
+        age = None
+
+        #server tira bata validate garne
+        if not name or not email or not password or not confirm:
+            flash("Please fill all the required fields.", "danger")
+            return render_template("register.html")
+        
+        if len(password) < 6:
+            flash("Password must be atleast 6 characters long.", "danger")
+            return render_template("register.html")
+        
+        if password != confirm:
+            flash("Passwords do not match.", "danger")
+            return render_template("register.html")
+        
+        age = None
+        if age_raw:
+            try:
+                age_val = int(age_raw)
+                if age_val>0:
+                    age = age_val
+                else:
+                    flash("Age must be a positive number.", "danger")
+                    return render_template("register.html")
+            except ValueError:
+                flash("Please enter a valid age!","danger")
+                return render_template("register.html")
+
+        
+        #email ko uniqueness check garna lai
+        existing = User.query.filter_by(email=email).first()
+        if existing:
+            flash("An account already exists with that email, try logging in.", "danger")
+            return render_template("register.html")
+        
+        #ps hash gari patient user banaune
+        try:
+            hashed = hasher.hash(password)
+            user = User(
+                name=name,
+                email=email,
+                password=hashed,
+                role="patient",
+                age=age,
+                gender=gender,
+                contact_number=contact_number,
+                address=address,
+                active=True
+            )
+            db.session.add(user)
+            db.session.commit()
+            flash("Registration successful. Now you can login.", "success")
+            return redirect(url_for("main.login"))   
+        
+        except IntegrityError:
+            db.session.rollback()
+            flash("An account already exists with that email, try logging in.", "danger")
+            return render_template("register.html")
+
+        except HasherBusy:
+            flash("The server is busy right now, please try again in a moment.", "danger")
+            return render_template("register.html"), 503
+        
+        except Exception as e:
+            db.session.rollback()
+            flash("Unexpected error occured while creating your account, Please try again.", "danger")
+            return render_template("register.html")
+        
+    #GET mas
+    return render_template("register.html")
+
+
+@bp.route("/dashboard/admin")
+@login_required
+@query_budget()
+def admin_dashboard():
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    doctor_search = request.args.get("doctor_search", "").strip()
+    patient_search = request.args.get("patient_search", "").strip()
+
+    # maintained totals, see counters.py
+    totals = counters.read_all(db.session.connection())
+    patient_count = totals.get(counters.active_key('patient'), 0)
+    doctor_count = totals.get(counters.active_key('doctor'), 0)
+    appointment_count = totals.get('appointments.total', 0)
+
+    per_page = current_app.config.get('ADMIN_PAGE_SIZE', 25)
+
+    # a search shows the best `per_page` matches by rank, otherwise page newest first
+    if patient_search:
+        patients_page = Page(search.search_users(patient_search, 'patient',
+                                                 fields=('name', 'email', 'contact_number'),
+                                                 limit=per_page), None)
+    else:
+        patients_page = keyset_page(queries.patients_query(), User, request.args.get("patient_after"), per_page)
+
+    if doctor_search:
+        doctors_page = Page(search.search_users(doctor_search, 'doctor',
+                                                fields=('name', 'email', 'department'),
+                                                limit=per_page), None)
+    else:
+        doctors_page = keyset_page(queries.doctors_query(), User, request.args.get("doctor_after"), per_page)
+    
+    # get departments
+    departments = queries.departments_query().all()
+
+    appointments_by_status = [(status, totals.get(counters.status_key(status), 0))
+                              for status in queries.APPOINTMENT_STATUSES]
+    appointments_by_department = [(dept.name, totals.get(counters.department_key(dept.id), 0))
+                                  for dept in departments]
+    
+    # sort(newest first), filtered server side
+    appointment_filters = queries.appointment_filters(request.args)
+    all_appointments_query = queries.filter_appointments(queries.appointments_query(), appointment_filters)
+    appointments_page = keyset_page(all_appointments_query, Appointment, request.args.get("appt_after"), per_page)
+    
+    return render_template("admin_dashboard.html", 
+                           departments=departments,
+                           patient_count=patient_count,
+                           doctor_count=doctor_count,
+                           appointment_count=appointment_count,
+                           appointments_by_status=appointments_by_status,
+                           appointments_by_department=appointments_by_department,
+                           all_patients=patients_page.items,
+                           all_doctors=doctors_page.items,
+                           patients_next=patients_page.next_cursor,
+                           doctors_next=doctors_page.next_cursor,
+                           doctor_search=doctor_search,
+                           patient_search=patient_search,
+                           all_appointments=appointments_page.items,
+                           appointments_next=appointments_page.next_cursor,
+                           appointment_filters=appointment_filters,
+                           appointment_statuses=queries.APPOINTMENT_STATUSES
+                           )
+
+
+@bp.route("/admin/appointments/export")
+@login_required
+def export_appointments():
+    """Download the appointment ledger as CSV, with the dashboard's filters. Streamed, see ledger.py."""
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    filters = queries.appointment_filters(request.args)
+    excel = request.args.get('format') == 'excel'
+    filename = f"appointments-{date.today().isoformat()}{'-excel' if excel else ''}.csv"
+    return Response(stream_with_context(ledger.csv_stream(filters, excel=excel)),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@bp.route("/admin/cache_stats")
+@login_required
+def cache_stats():
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    return dict(cache.stats(), identity=identity.cache.stats())
+
+
+@bp.route("/admin/edit_doctor/<int:user_id>", methods=["GET"])
+@login_required
+def edit_doctor_form(user_id):
+    """Show the form to edit a doctor's profile."""
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+        
+    doctor = User.query.filter_by(id=user_id, role='doctor').first_or_404()
+    departments = Department.query.all()
+    
+    return render_template("edit_doctor.html", doctor=doctor, departments=departments)
+
+
+@bp.route("/admin/edit_doctor/<int:user_id>", methods=["POST"])
+@login_required
+def edit_doctor_submit(user_id):
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    doctor = User.query.filter_by(id=user_id, role='doctor').first_or_404()
+    
+    name = request.form.get("name", "").strip()
+    email = request.form.get("email", "").strip().lower()
+    specialization_id = request.form.get("specialization_id")
+
+    if not name or not email or not specialization_id:
+        flash("Name, Email, and Department are required.", "danger")
+        return redirect(url_for('main.edit_doctor_form', user_id=user_id))
+
+    # check if agadi dekhi vako email ma change hudaixa ki vanera
+    if email != doctor.email and User.query.filter_by(email=email).first():
+        flash("That email is already in use by another account.", "danger")
+        return redirect(url_for('main.edit_doctor_form', user_id=user_id))
+    
+    try:
+        doctor.name = name
+        doctor.email = email
+        doctor.specialization_id = int(specialization_id)
+        db.session.commit()
+        cache.invalidate(user_tag(doctor.id), DOCTOR_DIRECTORY)
+        identity.forget(doctor.id)
+        flash(f"Doctor {doctor.name}'s profile has been updated.", "success")
+        return redirect(url_for('main.admin_dashboard'))
+        
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred while updating: {e}", "danger")
+        return redirect(url_for('main.edit_doctor_form', user_id=user_id))
+
+@bp.route("/admin/toggle_active/<int:user_id>", methods = ["POST"])
+@login_required
+def toggle_active(user_id):
+    if current_user.role!='admin':
+        flash("Access Unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    user = User.query.get_or_404(user_id)
+
+    if user.id == current_user.id:
+        flash("You cannot deactivate your own account.", "danger")
+        return redirect(url_for('main.login'))
+    
+    user.is_active = not user.is_active
+    db.session.commit()
+    cache.invalidate(user_tag(user.id), DOCTOR_DIRECTORY if user.role == 'doctor' else None)
+    identity.forget(user.id)
+
+    if user.is_active:
+        flash(f"User {user.name} has been activated.", "success")
+    else:
+        flash(f"User {user.name} has been deactivated/blacklisted.", "success")
+    return redirect(url_for('main.admin_dashboard'))
+
+@bp.route("/admin/add_department", methods=["POST"])
+@login_required
+def add_department():
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    if request.method == "POST":
+        name = request.form.get("name", "").strip()
+        description = request.form.get("description", "").strip() or None
+
+        if not name:
+            flash("Department name is required.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+
+        existing = Department.query.filter_by(name=name).first()
+        if existing:
+            flash("A department with this name already exists.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+        
+        try:
+            new_dept = Department(name=name, description=description)
+            db.session.add(new_dept)
+            db.session.commit()
+            flash(f"Department '{name}' added successfully.", "success")
+        except Exception as e:
+            db.session.rollback()
+            flash(f"Error adding department: {e}", "danger")
+        
+        return redirect(url_for('main.admin_dashboard'))
+
+
+@bp.route("/admin/add_doctor", methods=["POST"])
+@login_required
+def add_doctor():
+    # Only admin can add doctors
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    if request.method == "POST":
+        name = request.form.get("name", "").strip()
+        email = request.form.get("email", "").strip().lower()
+        password = request.form.get("password", "")
+        
+        try:
+            specialization_id = int(request.form.get("specialization_id"))
+        except (ValueError, TypeError):
+            flash("Please select a valid department.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+
+        if not name or not email or not password or not specialization_id:
+            flash("All fields are required.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+        
+        if len(password) < 6:
+            flash("Password must be at least 6 characters long.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+        
+        existing = User.query.filter_by(email=email).first()
+        if existing:
+            flash("An account already exists with that email.", "danger")
+            return redirect(url_for('main.admin_dashboard'))
+        
+    #doctor banauna lai
+        try:
+            hashed = hasher.hash(password)
+            new_doctor = User(
+                name=name,
+                email=email,
+                password=hashed,
+                role="doctor",
+                specialization_id=specialization_id
+            )
+            db.session.add(new_doctor)
+            db.session.commit()
+            cache.invalidate(DOCTOR_DIRECTORY)
+            flash(f"Doctor {name} added successfully.", "success")
+        except HasherBusy:
+            flash("The server is busy right now, please try again in a moment.", "danger")
+        except Exception as e:
+            db.session.rollback()
+            flash(f"Error adding doctor: {e}", "danger")
+        
+        return redirect(url_for('main.admin_dashboard'))
+
+
+@bp.route("/dashboard/doctor")
+@login_required
+@cached_page
+@query_budget()
+def doctor_dashboard():
+    if current_user.role != 'doctor':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    # read only: the weekly hours, and what they come to over the next 7 days with
+    # the exceptions applied. rows are only written by update_availability
+    templates = availability.weekly(current_user.id)
+    weekly_schedule = []
+    for weekday, day_name in enumerate(calendar.day_name):
+        template = templates.get(weekday)
+        weekly_schedule.append({
+            'weekday': weekday,
+            'day_name': day_name,
+            'start_time': template.start_time if template and template.start_time else availability.DEFAULT_START,
+            'end_time': template.end_time if template and template.end_time else availability.DEFAULT_END,
+            'is_available': bool(template and template.is_available)
+        })
+
+    availability_schedule = []
+    start_date = date.today()
+    effective = availability.by_date(current_user.id, 7, start_date)
+    
+    for i in range(7):
+        current_date = start_date + timedelta(days=i)
+        avail = effective.get(current_date)
+
+        availability_schedule.append({
+            'date': current_date,
+            'day_name': current_date.strftime('%A'),
+            'start_time': avail.start_time if avail and avail.start_time else availability.DEFAULT_START,
+            'end_time': avail.end_time if avail and avail.end_time else availability.DEFAULT_END,
+            'is_available': bool(avail and avail.is_available),
+            'exception': isinstance(avail, DoctorAvailability)
+        })
+
+    upcoming_appointments = queries.doctor_appointments(current_user.id).filter(
+        queries.upcoming()
+    ).order_by(Appointment.date, Appointment.time).all()
+
+    past_appointments = queries.doctor_appointments(current_user.id).filter(
+        queries.past()
+    ).order_by(Appointment.date.desc(), Appointment.time.desc()).all()
+
+    # the lists show patient names, so a patient editing their profile drops this page too
+    add_tags(*(user_tag(appt.patient_id) for appt in upcoming_appointments + past_appointments))
+
+    return render_template("doctor_dashboard.html",
+                           upcoming_appointments = upcoming_appointments,
+                           past_appointments = past_appointments,
+                           weekly_schedule = weekly_schedule,
+                           availability_schedule = availability_schedule) 
+
+
+@bp.route("/dashboard/patient")
+@login_required
+@cached_page
+@query_budget()
+def patient_dashboard():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    search_query = request.args.get("search_query", "").strip()
+
+    if search_query:
+        doctors = search.search_users(search_query, 'doctor', fields=('name', 'department'), active_only=True)
+    else:
+        doctors = queries.doctors_query().filter_by(active = True).order_by(User.name).all()
+
+    upcoming_appointments = queries.patient_appointments(current_user.id).filter(
+        queries.upcoming()
+    ).order_by(Appointment.date, Appointment.time).all()
+
+    past_appointments = queries.patient_appointments(current_user.id).filter(
+        queries.past()
+    ).order_by(Appointment.date.desc(), Appointment.time.desc()).all()
+
+    # doctor names/departments come from the directory
+    add_tags(DOCTOR_DIRECTORY)
+
+    return render_template("patient_dashboard.html",
+                           doctors = doctors,
+                           search_query = search_query,
+                           upcoming_appointments=upcoming_appointments,
+                           past_appointments=past_appointments)
+
+@bp.route("/doctor/manage_appointment/<int:appt_id>", methods = ["GET", "POST"])
+@login_required
+def manage_appointment(appt_id):
+    if current_user.role!='doctor':
+        flash("Access denied!!", "danger")
+        return redirect(url_for('main.login'))
+    
+    appt = Appointment.query.filter_by(id=appt_id, doctor_id = current_user.id).first_or_404()
+
+    treatment = Treatment.query.filter_by(appointment_id = appt_id).first()
+
+    if request.method == "POST":
+        diagnosis = request.form.get("diagnosis", "").strip()
+        prescription = request.form.get("prescription", "").strip()
+        notes = request.form.get("notes", "").strip() or None
+
+        if not diagnosis or not prescription:
+            flash("Diagnosis and Prescription are required to complete an appointment.", "danger")
+            return render_template("manage_appointment.html", appt=appt, treatment=treatment)
+
+        follow_up = request.form.get("follow_up_date", "").strip()
+        try:
+            follow_up_date = date.fromisoformat(follow_up) if follow_up else None
+        except ValueError:
+            flash("Invalid follow-up date.", "danger")
+            return render_template("manage_appointment.html", appt=appt, treatment=treatment)
+        if follow_up_date and follow_up_date <= appt.date:
+            flash("The follow-up date must be after the visit.", "danger")
+            return render_template("manage_appointment.html", appt=appt, treatment=treatment)
+        
+        try:
+            if treatment:
+                if treatment.follow_up_date != follow_up_date:
+                    # the reminder the worker queued is for the old date
+                    jobs.forget_reminders(db.session.connection(), appt.id)
+                treatment.diagnosis = diagnosis
+                treatment.prescription = prescription
+                treatment.notes = notes
+                treatment.follow_up_date = follow_up_date
+            else:
+                treatment = Treatment(
+                    appointment_id = appt.id,
+                    diagnosis = diagnosis,
+                    prescription = prescription,
+                    follow_up_date = follow_up_date,
+                    notes = notes)
+                db.session.add(treatment)
+            
+            appt.status =  "Completed"
+
+            db.session.commit()
+            cache.invalidate(user_tag(appt.doctor_id), user_tag(appt.patient_id), history_tag(appt.patient_id))
+            flash("Appointment marked as 'Completed' and treatment notes saved", "success")
+            return redirect(url_for('main.doctor_dashboard'))
+        
+        except Exception as e:
+            db.session.rollback()
+            flash(f"An error occured: {e}", "danger")
+
+    return render_template("manage_appointment.html", appt=appt, treatment=treatment)
+
+
+@bp.route("/doctor/cancel_appointment/<int:appt_id>", methods=["POST"])
+@login_required
+def cancel_appointment(appt_id):
+    if current_user.role != 'doctor':
+        flash("Access denied!!", "danger")
+        return redirect(url_for('main.login'))
+    # read and cancel under the write lock, like booking
+    booking.write_transaction(db.session)
+    appt = Appointment.query.filter_by(id=appt_id, doctor_id=current_user.id, status="Booked").first_or_404()
+    
+    try:
+        appt.status = "Cancelled"
+        db.session.commit()
+        cache.invalidate(user_tag(appt.doctor_id), user_tag(appt.patient_id))
+        flash("Appointment has been cancelled.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+        
+    return redirect(url_for('main.doctor_dashboard'))
+
+# completed visits only change through manage_appointment, which drops
+# history_tag(patient), so a rendered page of them is kept for an hour
+# (HISTORY_CACHE_TTL_SECONDS) and shared by every doctor who opens the patient.
+@bp.route("/doctor/patient_history/<int:patient_id>")
+@login_required
+@cached_page
+@query_budget()
+def patient_history(patient_id):
+    if current_user.role!='doctor':
+        flash("Accedd denied!!", "danger")
+        return redirect(url_for('main.login'))
+    
+    patient = User.query.filter_by(id=patient_id, role='patient').first_or_404()
+    after = request.args.get('after') or None
+    expand = request.args.get('expand', type=int)
+
+    key = f"history:{patient.id}:{after or ''}:{expand or ''}"
+    visits = cache.get(key)
+    if visits is None:
+        page = queries.history_page(patient.id, after,
+                                    current_app.config.get('HISTORY_PAGE_SIZE', queries.HISTORY_PAGE_SIZE))
+        visits = render_template("_history_visits.html", patient=patient, history=page.items,
+                                 after=after, next_cursor=page.next_cursor, expand=expand)
+        # doctor name/department edits drop the doctor's tag
+        tags = {history_tag(patient.id), HISTORY} | {user_tag(appt.doctor_id) for appt in page.items}
+        cache.set(key, visits, tags, ttl=current_app.config.get('HISTORY_CACHE_TTL_SECONDS', 3600))
+    # the page around the visits goes stale with them (a completed visit, import-data)
+    add_tags(user_tag(patient.id), history_tag(patient.id), HISTORY)
+
+    return render_template("patient_history.html", patient=patient, visits=Markup(visits))
+
+@bp.route("/doctor/update_availability", methods=["POST"])
+@login_required
+def update_availability():
+    if current_user.role != 'doctor':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    # the dashboard posts either the weekly hours (weekday fields) or single dates
+    # (avail_date fields); a date set back to its weekly hours stops being an exception
+    try:
+        weekdays = [int(w) for w in request.form.getlist("weekday") if 0 <= int(w) <= 6]
+        availability.save_weekly(current_user.id, [
+            (weekday,
+             parse_time(request.form.get(f"start_time_w{weekday}")),
+             parse_time(request.form.get(f"end_time_w{weekday}")),
+             f"is_available_w{weekday}" in request.form)
+            for weekday in weekdays
+        ])
+
+        today = date.today()
+        days = [date.fromisoformat(d) for d in request.form.getlist("avail_date")]
+        availability.save_days(current_user.id, [
+            (day,
+             parse_time(request.form.get(f"start_time_{day.isoformat()}")),
+             parse_time(request.form.get(f"end_time_{day.isoformat()}")),
+             f"is_available_{day.isoformat()}" in request.form)
+            for day in days if day >= today
+        ])
+        
+        db.session.commit()
+        cache.invalidate(user_tag(current_user.id))
+        flash("Availability updated successfully.", "success")
+
+    except ValueError as e:
+        # hours that fail availability.check_hours(), or a date/weekday that doesn't parse
+        db.session.rollback()
+        flash(f"Availability not saved: {e}.", "danger")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+
+    return redirect(url_for('main.doctor_dashboard'))
+
+@bp.route("/patient/book_appointment/<int:doctor_id>")
+@login_required
+@query_budget()
+def book_appointment_form(doctor_id):
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+        
+    doctor = User.query.filter_by(id=doctor_id, role='doctor', active=True).first_or_404()
+
+    available_slots = slots.available_slots(doctor.id, patient_id=current_user.id)
+
+    return render_template("book_appointment.html", 
+                           doctor=doctor, 
+                           available_slots=available_slots,
+                           horizon_days=slots.horizon_days(),
+                           use_holds=booking.hold_seconds() > 0)
+
+@bp.route("/patient/next_available")
+@login_required
+def next_available():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    if request.args.get("department_id", type=int) or request.args.get("search_query", "").strip():
+        # the search reads a precomputed index (free_slots.py) that the worker's
+        # free_slot_index job keeps built. if it hasn't got to today yet, the missing
+        # days are built here: a write that grows with the number of doctors, so it
+        # stays out of the page's query budget. our read ends first, without WAL it
+        # would block that write
+        db.session.commit()
+        free_slots.ensure(db.engine)
+    return next_available_page()
+
+@query_budget()
+def next_available_page():
+    department_id = request.args.get("department_id", type=int)
+    search_query = request.args.get("search_query", "").strip()
+    try:
+        start_time = parse_time(request.args.get("from", ""))
+        end_time = parse_time(request.args.get("to", ""))
+    except ValueError:
+        flash("Please give times as HH:MM.", "danger")
+        start_time = end_time = None
+
+    found = None
+    if department_id or search_query:
+        doctor_ids = None
+        if search_query:
+            doctor_ids = [doctor.id for doctor in search.search_users(
+                search_query, 'doctor', fields=('name', 'department'), active_only=True)]
+        found = free_slots.earliest(db.engine, doctor_ids, department_id, start_time, end_time,
+                                    current_app.config.get('NEXT_AVAILABLE_LIMIT', free_slots.DEFAULT_LIMIT),
+                                    patient_id=current_user.id)
+
+    return render_template("next_available.html",
+                           departments=queries.departments_query().all(),
+                           department_id=department_id,
+                           search_query=search_query,
+                           start_time=start_time,
+                           end_time=end_time,
+                           found=found,
+                           horizon_days=slots.horizon_days(),
+                           use_holds=booking.hold_seconds() > 0)
+
+@bp.route("/patient/create_appointment", methods=["POST"])
+@login_required
+def create_appointment():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    doctor_id = request.form.get("doctor_id")
+    appt_date = request.form.get("appt_date")
+    appt_time = request.form.get("appt_time")
+    
+    if not doctor_id or not appt_date or not appt_time:
+        flash("An error occurred. Please try booking again.", "danger")
+        return redirect(url_for('main.patient_dashboard'))
+
+    try:
+        doctor_id = int(doctor_id)
+        appt_date = date.fromisoformat(appt_date)
+        appt_time = parse_time(appt_time)
+    except ValueError:
+        flash("An error occurred. Please try booking again.", "danger")
+        return redirect(url_for('main.patient_dashboard'))
+
+    try:
+        booking.book(current_user.id, doctor_id, appt_date, appt_time)
+        flash("Appointment booked successfully!", "success")
+        return redirect(url_for('main.patient_dashboard'))
+    except booking.BookingError as e:
+        flash(str(e), "danger")
+        return redirect(url_for('main.book_appointment_form', doctor_id=doctor_id))
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+        return redirect(url_for('main.book_appointment_form', doctor_id=doctor_id))
+
+@bp.route("/patient/hold_slot", methods=["POST"])
+@login_required
+def hold_slot():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    try:
+        doctor_id = int(request.form.get("doctor_id", ""))
+        appt_date = date.fromisoformat(request.form.get("appt_date", ""))
+        appt_time = parse_time(request.form.get("appt_time", ""))
+    except ValueError:
+        appt_time = None
+    if not appt_time:
+        flash("An error occurred. Please try booking again.", "danger")
+        return redirect(url_for('main.patient_dashboard'))
+
+    try:
+        expires_at = booking.hold_slot(current_user.id, doctor_id, appt_date, appt_time)
+    except booking.BookingError as e:
+        flash(str(e), "danger")
+        return redirect(url_for('main.book_appointment_form', doctor_id=doctor_id))
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+        return redirect(url_for('main.book_appointment_form', doctor_id=doctor_id))
+
+    doctor = User.query.get(doctor_id)
+    return render_template("confirm_appointment.html",
+                           doctor=doctor,
+                           appt_date=appt_date,
+                           appt_time=appt_time,
+                           hold_minutes=max(1, int((expires_at - datetime.utcnow()).total_seconds() // 60)))
+
+@bp.route("/patient/cancel_appointment/<int:appt_id>", methods=["POST"])
+@login_required
+def patient_cancel_appointment(appt_id):
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    booking.write_transaction(db.session)
+    appt = Appointment.query.filter_by(
+        id=appt_id, 
+        patient_id=current_user.id, 
+        status="Booked"
+    ).first_or_404()
+
+    try:
+        appt.status = "Cancelled"
+        db.session.commit()
+        cache.invalidate(user_tag(appt.doctor_id), user_tag(appt.patient_id))
+        flash("Your appointment has been successfully cancelled.", "success")
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+        
+    return redirect(url_for('main.patient_dashboard'))
+
+@bp.route("/patient/view_details/<int:appt_id>")
+@login_required
+def view_appointment_details(appt_id):
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    # old visits may have moved to the archive
+    appt = queries.find_appointment(appt_id, patient_id=current_user.id) or abort(404)
+
+    if appt.status != "Completed":
+        flash("Details are only available for completed appointments.", "danger")
+        return redirect(url_for('main.patient_dashboard'))
+    
+    treatment = appt.treatments[0] if appt.treatments else None
+
+    return render_template("view_appointment_details.html", appt=appt, treatment=treatment)
+
+
+
+@bp.route("/patient/edit_profile", methods=["GET"])
+@login_required
+def edit_profile_form():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+        
+    return render_template("edit_profile.html")
+    
+
+@bp.route("/patient/edit_profile", methods=["POST"])
+@login_required
+def edit_profile_submit():
+    if current_user.role != 'patient':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+
+    name = request.form.get("name", "").strip()
+    age_raw = request.form.get("age", "").strip()
+    gender = request.form.get("gender", "").strip() or None
+    contact_number = request.form.get("contact_number", "").strip() or None
+    address = request.form.get("address", "").strip() or None
+
+    if not name:
+        flash("Name is required.", "danger")
+        return render_template("edit_profile.html")
+        
+    age = None
+    if age_raw:
+        try:
+            age_val = int(age_raw)
+            if age_val > 0:
+                age = age_val
+            else:
+                flash("Age must be a positive number.", "danger")
+                return render_template("edit_profile.html")
+        except ValueError:
+            flash("Please enter a valid age.", "danger")
+            return render_template("edit_profile.html")
+            
+    try:
+        user = User.query.get(current_user.id)
+        user.name = name
+        user.age = age
+        user.gender = gender
+        user.contact_number = contact_number
+        user.address = address
+        
+        db.session.commit()
+        cache.invalidate(user_tag(user.id))
+        identity.forget(user.id)
+        flash("Your profile has been updated successfully.", "success")
+        return redirect(url_for('main.patient_dashboard'))
+
+    except Exception as e:
+        db.session.rollback()
+        flash(f"An error occurred: {e}", "danger")
+        return render_template("edit_profile.html")
+
+@bp.route("/admin/view_details/<int:appt_id>")
+@login_required
+def admin_view_appointment_details(appt_id):
+    if current_user.role != 'admin':
+        flash("Access unauthorized.", "danger")
+        return redirect(url_for('main.login'))
+    
+    appt = queries.find_appointment(appt_id) or abort(404)
+
+    if appt.status != "Completed":
+        flash("Details only available for completed appointments.", "danger")
+        return redirect(url_for('main.admin_dashboard'))
+    treatment = appt.treatments[0] if appt.treatments else None
+    
+    if not treatment:
+        flash("No treatment details were found.", "warning")
+        return redirect(url_for('main.admin_dashboard'))
+    
+    return render_template("view_appointment_details.html", appt=appt, treatment=treatment)